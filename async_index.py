@@ -0,0 +1,118 @@
+"""
+The asyncio entry point: the same as index.handler, but the updates are
+processed by AsyncTeleBot on a ydb.aio pool, so one instance can serve many
+updates concurrently. Set the function entry point to `async_index.handler`.
+"""
+
+import asyncio
+import os
+import time
+
+import telebot
+
+import metrics
+from bot.async_structure import create_async_bot
+from database.command_log import command_log
+from database.ydb_settings import (
+    get_cached_ydb_pool,
+    get_ydb_async_pool,
+    stop_ydb_async_pool,
+)
+from logs import logger
+
+YDB_ENDPOINT = os.getenv("YDB_ENDPOINT")
+YDB_DATABASE = os.getenv("YDB_DATABASE")
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+# kept between warm invocations while the event loop is the same
+_cached = {
+    "key": None,
+    "loop": None,
+    "sync_pool": None,
+    "pool": None,
+    "driver": None,
+    "bot": None,
+}
+
+
+async def close_cached_async_pool():
+    pool, driver, loop = _cached["pool"], _cached["driver"], _cached["loop"]
+    _cached.update(pool=None, driver=None)
+    if pool is None:
+        return
+
+    stop = stop_ydb_async_pool(pool, driver)
+    if loop is asyncio.get_running_loop():
+        await stop
+    elif loop.is_running():
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(stop, loop))
+    elif not loop.is_closed():
+        # the loop has been left by the runtime, it can still run in another thread
+        await asyncio.to_thread(loop.run_until_complete, stop)
+    else:
+        stop.close()
+        logger.warning("Old YDB async pool is not stopped: its event loop is closed")
+
+
+async def get_bot():
+    """
+    Returns the configured async bot. ydb.aio pools are bound to the event loop,
+    so the bot is rebuilt if the runtime has started a new one. The old pool
+    and driver are stopped first.
+    """
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    sync_pool, is_new_pool = await asyncio.to_thread(
+        get_cached_ydb_pool, YDB_ENDPOINT, YDB_DATABASE
+    )
+
+    key = (BOT_TOKEN, os.getenv("IS_TESTING"))
+    is_cold = (
+        is_new_pool
+        or _cached["sync_pool"] is not sync_pool
+        or _cached["loop"] is not loop
+        or _cached["key"] != key
+    )
+    if is_cold:
+        await close_cached_async_pool()
+        pool, driver = await get_ydb_async_pool(YDB_ENDPOINT, YDB_DATABASE)
+        command_log.set_pool(sync_pool)
+        _cached.update(
+            key=key,
+            loop=loop,
+            sync_pool=sync_pool,
+            pool=pool,
+            driver=driver,
+            bot=create_async_bot(BOT_TOKEN, pool, sync_pool),
+        )
+
+    logger.info(
+        "{} start".format("Cold" if is_cold else "Warm"),
+        extra={
+            "is_cold_start": is_cold,
+            "is_new_pool": is_new_pool,
+            "setup_ms": round((time.perf_counter() - start) * 1000, 3),
+            "command_log": command_log.get_stats(),
+        },
+    )
+    return _cached["bot"]
+
+
+async def process_update(bot, update):
+    with metrics.update_metrics(update.update_id):
+        try:
+            async with bot.current_states.unit_of_work():
+                await bot.process_new_updates([update])
+        finally:
+            await asyncio.to_thread(command_log.flush)
+
+
+async def handler(event, _):
+    logger.debug("New event: %s", event)
+
+    bot = await get_bot()
+    await process_update(bot, telebot.types.Update.de_json(event["body"]))
+    return {
+        "statusCode": 200,
+        "body": "!",
+    }
@@ -0,0 +1,124 @@
+"""
+Compares TeleBot's linear handler scan with StateIndexedTeleBot:
+
+    python benchmarks/dispatch.py
+
+Both bots get the handlers of bot.structure in the same order and a message
+for every (state, text) pair the handlers know about. The state storage counts
+get_state calls: without a unit of work each of them is a YDB query.
+The script fails if the bots pick different handlers for any message.
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from telebot import TeleBot, custom_filters, types
+from telebot.storage.base_storage import StateStorageBase
+
+from bot.routing import StateIndexedTeleBot, get_state_keys
+from bot.structure import get_handlers
+
+CHAT_ID = 1
+TEXTS = ["hello", "12", "/help", "/cancel", "/exit", "/next", "/stop", "/train", "/x"]
+N_ROUNDS = 100
+
+
+class CountingStorage(StateStorageBase):
+    def __init__(self):
+        super().__init__()
+        self.state = None
+        self.n_reads = 0
+
+    def get_state(self, chat_id, user_id):
+        self.n_reads += 1
+        return self.state
+
+
+def make_message(text):
+    message = {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": CHAT_ID, "type": "private"},
+        "from": {"id": CHAT_ID, "is_bot": False, "first_name": "dispatch"},
+    }
+    if text is None:
+        message["document"] = {"file_id": "file", "file_unique_id": "file"}
+    else:
+        message["text"] = text
+    return types.Message.de_json(message)
+
+
+def make_bot(bot_class, chosen):
+    bot = bot_class("1:dispatch", state_storage=CountingStorage(), threaded=False)
+    for handler in get_handlers():
+
+        def record(message, bot, name=handler.callback.__name__):
+            chosen.append(name)
+
+        bot.register_message_handler(record, **handler.kwargs, pass_bot=True)
+    bot.add_custom_filter(custom_filters.StateFilter(bot))
+    return bot
+
+
+def get_all_states():
+    states = set()
+    for handler in get_handlers():
+        states.update(get_state_keys(handler.kwargs.get("state")))
+    return [None] + sorted(state for state in states if isinstance(state, str))
+
+
+def run(bot, chosen, cases):
+    bot.current_states.n_reads = 0
+    del chosen[:]
+    start = time.perf_counter()
+    for _ in range(N_ROUNDS):
+        for state, message in cases:
+            bot.current_states.state = state
+            bot.process_new_messages([message])
+    elapsed_us = (time.perf_counter() - start) * 1e6
+    n_messages = N_ROUNDS * len(cases)
+    return {
+        "state reads/update": bot.current_states.n_reads / n_messages,
+        "us/update": elapsed_us / n_messages,
+        "chosen": chosen[: len(cases)],
+    }
+
+
+def main():
+    cases = [
+        (state, make_message(text))
+        for state in get_all_states()
+        for text in TEXTS + [None]
+    ]
+
+    results = {}
+    for name, bot_class in [("linear", TeleBot), ("indexed", StateIndexedTeleBot)]:
+        chosen = []
+        results[name] = run(make_bot(bot_class, chosen), chosen, cases)
+        print(
+            "{:<8} {:>6.2f} state reads/update {:>8.1f} us/update".format(
+                name,
+                results[name]["state reads/update"],
+                results[name]["us/update"],
+            )
+        )
+
+    mismatches = [
+        (state, message.text, linear, indexed)
+        for (state, message), linear, indexed in zip(
+            cases, results["linear"]["chosen"], results["indexed"]["chosen"]
+        )
+        if linear != indexed
+    ]
+    print("{} messages, {} handled differently".format(len(cases), len(mismatches)))
+    for mismatch in mismatches:
+        print("  state {}, text {!r}: {} vs {}".format(*mismatch))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
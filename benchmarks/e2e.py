@@ -0,0 +1,376 @@
+"""
+Offline end-to-end benchmark: synthetic updates of every command flow go
+through index.handler, with the Bot API answered in process and a temporary
+SQLite database instead of YDB:
+
+    python benchmarks/e2e.py
+    python benchmarks/e2e.py --update-baseline
+
+Every chat sets a language, imports --n-words words and creates a group, then
+repeats --n-rounds rounds of /show_words paging, /group_add_words, a full
+"no hints" /train session and /show_languages. For every flow it reports the
+latency of its updates and the database and Bot API calls it makes.
+
+The numbers are compared with benchmarks/e2e_baseline.json: the script fails
+if a flow makes more calls than in the baseline, if its p95 latency is more
+than --latency-tolerance times and --latency-slack-ms above the baseline one,
+or if a handler fails.
+The call counts don't depend on the machine, the latencies do.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from telebot import apihelper
+
+import bot.dispatcher as dispatcher_module
+import index
+import logs
+from bot.dispatcher import TokenBucket, dispatcher
+from database.sqlite_backend import get_cached_sqlite_backend
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "e2e_baseline.json")
+FIRST_CHAT_ID = 10**12
+# the harness measures the bot, not the Telegram rate limits
+UNTHROTTLED_RATE = 10**9
+# calls measured by metrics.track, the others are only counted
+DB_CALLS = ("sqlite", "ydb")
+API_CALL_PREFIX = "telegram."
+WORD_PATTERN = re.compile(r"(word|meaning)(\d+)")
+
+
+class StubResponse:
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self.payload
+
+
+class TelegramStub:
+    """
+    Stands in for the requests session of telebot: answers every Bot API
+    call with success and keeps the last message sent to every chat.
+    """
+
+    def __init__(self):
+        self.message_ids = itertools.count(1)
+        self.last_messages = {}
+
+    def request(self, method, url, params=None, files=None, **kwargs):
+        params = params or {}
+        api_method = url.rsplit("/", 1)[-1]
+        result = True
+        if api_method.startswith(("send", "edit")):
+            result = self.record_message(params)
+        return StubResponse({"ok": True, "result": result})
+
+    def record_message(self, params):
+        chat_id = int(params["chat_id"])
+        self.last_messages[chat_id] = params
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    def get_buttons(self, chat_id):
+        markup = json.loads(self.last_messages[chat_id].get("reply_markup") or "{}")
+        return [
+            button["text"] if isinstance(button, dict) else button
+            for row in markup.get("keyboard", [])
+            for button in row
+            if button
+        ]
+
+
+class MetricsCollector(logging.Handler):
+    """
+    Picks the per-update metrics and the errors out of the log records.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.updates = []
+        self.errors = []
+
+    def emit(self, record):
+        if hasattr(record, "metrics"):
+            self.updates.append(record.metrics)
+        elif record.levelno >= logging.ERROR:
+            self.errors.append(record.getMessage())
+
+
+def make_update(update_id, chat_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "e2e"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        command_length = len(text.split()[0])
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": command_length}
+        ]
+    return {"update_id": update_id, "message": message}
+
+
+def tap_words(n_taps):
+    # word buttons of the last keyboard, the commands are not words
+    def choose(stub, chat_id, step):
+        words = [
+            button for button in stub.get_buttons(chat_id) if not button.startswith("/")
+        ]
+        return words[step % len(words)] if words else "/exit"
+
+    return [choose] * n_taps
+
+
+def answer_words(n_words):
+    # every other answer is right
+    def answer(stub, chat_id, step):
+        match = WORD_PATTERN.search(stub.last_messages[chat_id].get("text", ""))
+        if match is None or step % 2 == 1:
+            return "wrong"
+        kind, number = match.groups()
+        return "{}{}".format("meaning" if kind == "word" else "word", number)
+
+    return [answer] * n_words
+
+
+def get_setup_flows(n_words):
+    words = "\n".join("word{0} = meaning{0}".format(i) for i in range(n_words))
+    return [
+        ("set_language", ["/set_language", "fi", "en"]),
+        ("add_words", ["/add_words", "together", words]),
+        ("create_group", ["/create_group", "group"]),
+    ]
+
+
+def get_round_flows(n_train_words):
+    return [
+        ("show_words", ["/show_words", "a-z", "/next", "/next", "/exit"]),
+        (
+            "group_add_words",
+            ["/group_add_words", "group", "a-z"] + tap_words(3) + ["/exit"],
+        ),
+        (
+            "train",
+            ["/train", "random", "➡️ㅤ", str(n_train_words), "no hints"]
+            + answer_words(n_train_words),
+        ),
+        ("show_languages", ["/show_languages"]),
+    ]
+
+
+class Harness:
+    def __init__(self, n_chats):
+        self.chat_ids = [FIRST_CHAT_ID + i for i in range(n_chats)]
+        self.update_ids = itertools.count(1)
+        self.stub = TelegramStub()
+        self.collector = MetricsCollector()
+        # flow -> one entry per update: (latency_ms, db calls, api calls)
+        self.results = defaultdict(list)
+        # flow -> number of times it was run
+        self.n_runs = defaultdict(int)
+
+    def run_flow(self, name, chat_id, steps):
+        for step, text in enumerate(steps):
+            if callable(text):
+                text = text(self.stub, chat_id, step)
+            update = make_update(next(self.update_ids), chat_id, text)
+
+            n_updates = len(self.collector.updates)
+            start = time.perf_counter()
+            try:
+                index.handler({"body": json.dumps(update)}, None)
+            except Exception as e:
+                self.collector.errors.append("{}: {!r}".format(name, e))
+            latency_ms = (time.perf_counter() - start) * 1000
+
+            metrics = self.collector.updates[n_updates]
+            self.results[name].append(
+                (
+                    latency_ms,
+                    sum(metrics["counts"].get(call, 0) for call in DB_CALLS),
+                    sum(
+                        count
+                        for call, count in metrics["counts"].items()
+                        if call.startswith(API_CALL_PREFIX)
+                        and call in metrics["durations_ms"]
+                    ),
+                )
+            )
+        self.n_runs[name] += 1
+
+    def run_flows(self, flows):
+        # chats take turns, each runs its flow from the start to the end
+        for name, steps in flows:
+            for chat_id in self.chat_ids:
+                self.run_flow(name, chat_id, steps)
+
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def summarize(harness):
+    report = {}
+    for name, results in harness.results.items():
+        latencies_ms = [latency_ms for latency_ms, _, _ in results]
+        n_runs = harness.n_runs[name]
+        report[name] = {
+            "updates": len(results),
+            "p50_ms": round(get_percentile(latencies_ms, 50), 3),
+            "p95_ms": round(get_percentile(latencies_ms, 95), 3),
+            "p99_ms": round(get_percentile(latencies_ms, 99), 3),
+            # per run of the flow by one chat
+            "db_calls": round(sum(db for _, db, _ in results) / n_runs, 3),
+            "api_calls": round(sum(api for _, _, api in results) / n_runs, 3),
+        }
+    return report
+
+
+def print_report(report):
+    print(
+        "{:<16} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+            "flow", "updates", "p50 ms", "p95 ms", "p99 ms", "db/run", "api/run"
+        )
+    )
+    for name, row in report.items():
+        print(
+            "{:<16} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>9.1f}".format(
+                name,
+                row["updates"],
+                row["p50_ms"],
+                row["p95_ms"],
+                row["p99_ms"],
+                row["db_calls"],
+                row["api_calls"],
+            )
+        )
+
+
+def find_regressions(report, baseline, latency_tolerance, latency_slack_ms):
+    regressions = []
+    for name, expected in baseline.items():
+        actual = report.get(name)
+        if actual is None:
+            regressions.append("{}: the flow is missing".format(name))
+            continue
+        for column in ["db_calls", "api_calls"]:
+            if actual[column] > expected[column]:
+                regressions.append(
+                    "{}: {} {} > {}".format(
+                        name, column, actual[column], expected[column]
+                    )
+                )
+        # sub-millisecond latencies are too noisy for the tolerance alone
+        if actual["p95_ms"] > max(
+            expected["p95_ms"] * latency_tolerance,
+            expected["p95_ms"] + latency_slack_ms,
+        ):
+            regressions.append(
+                "{}: p95 {:.2f} ms, the baseline is {:.2f} ms".format(
+                    name, actual["p95_ms"], expected["p95_ms"]
+                )
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-chats", type=int, default=10)
+    parser.add_argument("--n-words", type=int, default=200)
+    parser.add_argument("--n-rounds", type=int, default=3)
+    parser.add_argument("--n-train-words", type=int, default=10)
+    parser.add_argument("--latency-tolerance", type=float, default=3.0)
+    parser.add_argument("--latency-slack-ms", type=float, default=5.0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+    settings = {
+        "n_chats": args.n_chats,
+        "n_words": args.n_words,
+        "n_rounds": args.n_rounds,
+        "n_train_words": args.n_train_words,
+    }
+
+    # only the metrics and the errors are needed, not the log lines
+    logs.logHandler.setLevel(logging.CRITICAL + 1)
+    harness = Harness(args.n_chats)
+    logs.logger.addHandler(harness.collector)
+
+    apihelper.session = harness.stub
+    dispatcher_module.PER_CHAT_RATE = UNTHROTTLED_RATE
+    dispatcher_module.PER_CHAT_BURST = UNTHROTTLED_RATE
+    dispatcher.global_bucket = TokenBucket(UNTHROTTLED_RATE, UNTHROTTLED_RATE)
+
+    with tempfile.TemporaryDirectory() as directory:
+        index.BOT_TOKEN = "1:e2e"
+        index.SQLITE_PATH = os.path.join(directory, "e2e.sqlite")
+
+        start = time.perf_counter()
+        harness.run_flows(get_setup_flows(args.n_words))
+        for _ in range(args.n_rounds):
+            harness.run_flows(get_round_flows(args.n_train_words))
+        elapsed_s = time.perf_counter() - start
+
+        get_cached_sqlite_backend(index.SQLITE_PATH)[0].close()
+
+    report = summarize(harness)
+    print_report(report)
+    n_updates = sum(row["updates"] for row in report.values())
+    print("{} updates in {:.1f} s".format(n_updates, elapsed_s))
+
+    if harness.collector.errors:
+        print("{} errors, the first ones:".format(len(harness.collector.errors)))
+        for error in harness.collector.errors[:5]:
+            print("  " + error)
+        sys.exit(1)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump({"settings": settings, "flows": report}, baseline_file, indent=4)
+            baseline_file.write("\n")
+        print("Baseline saved to {}".format(args.baseline))
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with, run with --update-baseline")
+        return
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline["settings"] != settings:
+        print("The baseline was recorded with {}".format(baseline["settings"]))
+        sys.exit(1)
+
+    regressions = find_regressions(
+        report, baseline["flows"], args.latency_tolerance, args.latency_slack_ms
+    )
+    for regression in regressions:
+        print("Regression: " + regression)
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
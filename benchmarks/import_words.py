@@ -0,0 +1,105 @@
+"""
+Compares /import with the /add_words path on a synthetic vocabulary:
+
+    python benchmarks/import_words.py --n-words 5000
+
+Parsing is always measured. Writing is measured too if YDB_ENDPOINT and
+YDB_DATABASE are set: the words are saved for a scratch chat and deleted after.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import database.model as db_model
+import metrics
+from bot import importing
+from database.ydb_settings import get_ydb_pool
+
+BENCHMARK_CHAT_ID = -1
+BENCHMARK_LANGUAGE = "benchmark"
+
+
+def make_file(n_words):
+    lines = ["word{} = translation{} / other{}".format(i, i, i) for i in range(n_words)]
+    return "\n".join(lines)
+
+
+def parse_add_words_together(text):
+    # the parsing of process_adding_words_together
+    words, translations = [], []
+    for entry in filter(
+        lambda x: len(x) > 0, [w.strip().lower() for w in text.split("\n")]
+    ):
+        words.append(entry.split("=")[0].strip().lower())
+        translations.append(
+            json.dumps([m.strip().lower() for m in entry.split("=")[1].split("/")])
+        )
+    return words, translations
+
+
+def parse_import(text):
+    errors = []
+    words, translations = [], []
+    for batch in importing.parse_import_file(
+        text.encode(), db_model.WORDS_IMPORT_BUCKET_SIZE, errors
+    ):
+        words.extend(word for word, _ in batch)
+        translations.extend(translation for _, translation in batch)
+    return words, translations
+
+
+def measure(name, func):
+    with metrics.update_metrics(name) as current:
+        start = time.perf_counter()
+        result = func()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    print(
+        "{:<24} {:>10.1f} ms {:>6} YDB round trips".format(
+            name, elapsed_ms, current.counts["ydb"]
+        )
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-words", type=int, default=5000)
+    args = parser.parse_args()
+
+    text = make_file(args.n_words)
+    words, translations = measure(
+        "parse /add_words", lambda: parse_add_words_together(text)
+    )
+    measure("parse /import", lambda: parse_import(text))
+
+    if os.getenv("YDB_ENDPOINT") is None or os.getenv("YDB_DATABASE") is None:
+        print("YDB_ENDPOINT and YDB_DATABASE are not set, writes are not measured")
+        return
+
+    pool = get_ydb_pool(os.getenv("YDB_ENDPOINT"), os.getenv("YDB_DATABASE"))
+    for name, write in [
+        ("write /add_words", db_model.update_vocab),
+        ("write /import", db_model.add_new_words),
+    ]:
+        try:
+            measure(
+                name,
+                lambda: write(
+                    pool,
+                    BENCHMARK_CHAT_ID,
+                    BENCHMARK_LANGUAGE,
+                    words,
+                    translations,
+                ),
+            )
+        finally:
+            db_model.delete_language(pool, BENCHMARK_CHAT_ID, BENCHMARK_LANGUAGE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Replays a trace recorded by index.handler with TRACE_PATH set (see tracing.py)
+against the bot, with the Bot API answered in process:
+
+    python benchmarks/replay.py trace.jsonl --speed 10 --concurrency 16
+
+The updates are submitted at the pace of the trace sped up --speed times, to
+the worker pool of server.py with --concurrency workers: the updates of
+a chat are processed one at a time in the order they were recorded.
+The storage is a temporary SQLite database, or YDB from YDB_ENDPOINT and
+YDB_DATABASE with --ydb.
+
+The report has the throughput and the latency distributions, both from the
+moment an update was due to the end of its processing and of the processing
+alone, in total and by the command each chat was in. --save-report writes it
+as JSON for before/after comparisons.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from e2e import UNTHROTTLED_RATE, MetricsCollector, TelegramStub, make_update
+from telebot import apihelper, util
+
+import bot.dispatcher as dispatcher_module
+import index
+import logs
+from bot.dispatcher import TokenBucket, dispatcher
+from bot.structure import get_handlers
+from database.sqlite_backend import get_cached_sqlite_backend
+from server import ChatOrderedWorkerPool
+from tracing import read_trace
+
+# the updates are not rejected, the replay waits for the workers instead
+DRAIN_TIMEOUT_S = 600
+# the events sent before the first command of their chat
+NO_COMMAND = "-"
+
+
+def get_entry_commands():
+    # the ones of a state, like /next or /exit, continue the command of the chat
+    return {
+        command
+        for handler in get_handlers()
+        if "state" not in handler.kwargs
+        for command in handler.kwargs.get("commands", [])
+    }
+
+
+def get_percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    percentiles = {
+        "p{}_ms".format(percentile): round(
+            values[min(len(values) - 1, int(len(values) * percentile / 100))], 3
+        )
+        for percentile in [50, 95, 99]
+    }
+    percentiles["max_ms"] = round(values[-1], 3)
+    return percentiles
+
+
+class Replay:
+    def __init__(self, events, speed, concurrency):
+        self.events = events
+        self.speed = speed
+        self.lock = threading.Lock()
+        # (command, latency_ms, processing_ms) for every processed update
+        self.results = []
+        self.max_lag_ms = 0.0
+        self.entry_commands = get_entry_commands()
+        self.workers = ChatOrderedWorkerPool(
+            self.process, n_workers=concurrency, max_pending=len(events) + 1
+        )
+
+    def process(self, item):
+        due, command, update = item
+        start = time.perf_counter()
+        index.handler({"body": json.dumps(update)}, None)
+        end = time.perf_counter()
+        with self.lock:
+            self.results.append((command, (end - due) * 1000, (end - start) * 1000))
+
+    def run(self):
+        """
+        Returns the number of seconds from the first update to the last processed one.
+        """
+        self.workers.start()
+        first_time = self.events[0]["time"]
+        commands = {}
+        start = time.perf_counter()
+        for update_id, event in enumerate(self.events, 1):
+            due = start + (event["time"] - first_time) / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.max_lag_ms = max(self.max_lag_ms, -delay * 1000)
+
+            chat_id, text = event["chat"], event["text"]
+            command = util.extract_command(text)
+            if command in self.entry_commands:
+                commands[chat_id] = "/" + command
+            item = (
+                due,
+                commands.get(chat_id, NO_COMMAND),
+                make_update(update_id, chat_id, text),
+            )
+            self.workers.submit(chat_id, item)
+
+        n_left = self.workers.drain(DRAIN_TIMEOUT_S)
+        if n_left:
+            print("{} updates were not processed in time".format(n_left))
+        return time.perf_counter() - start
+
+    def summarize(self, elapsed_s, trace_s):
+        by_command = defaultdict(list)
+        for command, latency_ms, processing_ms in self.results:
+            by_command[command].append((latency_ms, processing_ms))
+        return {
+            "updates": len(self.results),
+            "failed": self.workers.get_stats()["failed"],
+            "trace_s": round(trace_s, 3),
+            "elapsed_s": round(elapsed_s, 3),
+            "offered_per_s": round(
+                len(self.events) / max(trace_s / self.speed, 1e-9), 1
+            ),
+            "processed_per_s": round(len(self.results) / elapsed_s, 1),
+            "max_submit_lag_ms": round(self.max_lag_ms, 3),
+            "latency": get_percentiles([r[1] for r in self.results]),
+            "processing": get_percentiles([r[2] for r in self.results]),
+            "commands": {
+                command: {
+                    "updates": len(results),
+                    "latency": get_percentiles([r[0] for r in results]),
+                    "processing": get_percentiles([r[1] for r in results]),
+                }
+                for command, results in sorted(
+                    by_command.items(), key=lambda item: -len(item[1])
+                )
+            },
+        }
+
+
+def print_report(report):
+    print(
+        "{} updates of {:.1f} s of trace replayed in {:.1f} s, {} failed".format(
+            report["updates"], report["trace_s"], report["elapsed_s"], report["failed"]
+        )
+    )
+    print(
+        "offered {:.1f}/s, processed {:.1f}/s, submitted up to {:.1f} ms late".format(
+            report["offered_per_s"],
+            report["processed_per_s"],
+            report["max_submit_lag_ms"],
+        )
+    )
+    header = "{:<22} {:>7} {:>9} {:>9} {:>9} {:>9} {:>11}"
+    row = "{:<22} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>11.2f}"
+    print(
+        header.format(
+            "command", "updates", "p50 ms", "p95 ms", "p99 ms", "max ms", "proc p95 ms"
+        )
+    )
+    rows = [("all", report)] + list(report["commands"].items())
+    for command, stats in rows:
+        latency = stats["latency"]
+        if not latency:
+            continue
+        print(
+            row.format(
+                command,
+                stats["updates"],
+                latency["p50_ms"],
+                latency["p95_ms"],
+                latency["p99_ms"],
+                latency["max_ms"],
+                stats["processing"]["p95_ms"],
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=float, default=1.0, help="e.g. 1, 10 or 100")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ydb", action="store_true")
+    parser.add_argument(
+        "--keep-throttling",
+        action="store_true",
+        help="wait for the Telegram rate limits as the bot does in production",
+    )
+    parser.add_argument("--save-report")
+    args = parser.parse_args()
+
+    # the replayer sends the texts only, e.g. the documents can't be downloaded
+    events = sorted(
+        (
+            event
+            for event in read_trace(args.trace)
+            if event["chat"] is not None and "text" in event
+        ),
+        key=lambda event: event["time"],
+    )
+    if not events:
+        print("No text messages in the trace")
+        sys.exit(1)
+    trace_s = events[-1]["time"] - events[0]["time"]
+
+    logs.logHandler.setLevel(logging.CRITICAL + 1)
+    collector = MetricsCollector()
+    logs.logger.addHandler(collector)
+
+    apihelper.session = TelegramStub()
+    if not args.keep_throttling:
+        dispatcher_module.PER_CHAT_RATE = UNTHROTTLED_RATE
+        dispatcher_module.PER_CHAT_BURST = UNTHROTTLED_RATE
+        dispatcher.global_bucket = TokenBucket(UNTHROTTLED_RATE, UNTHROTTLED_RATE)
+
+    replay = Replay(events, args.speed, args.concurrency)
+    index.BOT_TOKEN = "1:replay"
+    with tempfile.TemporaryDirectory() as directory:
+        if not args.ydb:
+            index.SQLITE_PATH = os.path.join(directory, "replay.sqlite")
+        elapsed_s = replay.run()
+        if not args.ydb:
+            get_cached_sqlite_backend(index.SQLITE_PATH)[0].close()
+
+    report = replay.summarize(elapsed_s, trace_s)
+    print_report(report)
+    for error in collector.errors[:5]:
+        print("  " + error)
+
+    if args.save_report:
+        with open(args.save_report, "w") as report_file:
+            json.dump(
+                dict(report, settings=vars(args)),
+                report_file,
+                indent=4,
+                ensure_ascii=False,
+            )
+            report_file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Load generator for server.py: posts synthetic webhook updates and measures
+how many updates per second the server processes.
+
+It needs a YDB with the bot tables, e.g. a local one:
+
+    docker run -d --rm --name ydb-local -h localhost -p 2136:2136 \
+        -e YDB_USE_IN_MEMORY_PDISKS=true cr.yandex/yc/yandex-docker-local-ydb:latest
+    export YDB_ENDPOINT=grpc://localhost:2136 YDB_DATABASE=/local YDB_ANONYMOUS_CREDENTIALS=1
+    # create the tables from README.md, then
+    python benchmarks/server_load.py --n-chats 50 --n-updates 2000 --workers 16
+
+The server is started as a subprocess talking to a stub of the Bot API run by
+this script. Every update sent gets exactly one reply, so an update is done
+when the stub receives the next reply for its chat. The server is stopped
+with SIGTERM at the end to check that it drains.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import error, parse, request
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+# every one of them is answered with a single message
+COMMANDS = ["/help", "/show_languages", "/show_current_language", "/howto"]
+FIRST_CHAT_ID = 10**12
+RETRY_DELAY_S = 0.1
+
+
+class TelegramStub:
+    """
+    Answers every Bot API call with success and records when each chat
+    gets its messages.
+    """
+
+    def __init__(self, port):
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.replies = defaultdict(list)
+        self.n_replies = 0
+        self.message_ids = itertools.count(1)
+        self.server = ThreadingHTTPServer(("localhost", port), self.make_handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                # telebot sends the parameters in the query string
+                url = parse.urlparse(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                params = dict(parse.parse_qsl(url.query))
+                params.update(parse.parse_qsl(body.decode(errors="ignore")))
+                method = url.path.rsplit("/", 1)[-1]
+                result = True
+                if method == "sendMessage":
+                    result = stub.record_message(params)
+                self.reply({"ok": True, "result": result})
+
+            do_GET = do_POST
+
+            def reply(self, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def record_message(self, params):
+        chat_id = int(params["chat_id"])
+        with self.condition:
+            self.replies[chat_id].append(time.perf_counter())
+            self.n_replies += 1
+            self.condition.notify_all()
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    def wait_for_replies(self, n_replies, timeout):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.n_replies >= n_replies, timeout)
+
+
+def make_update(update_id, chat_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "load"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+def post_until_accepted(url, update):
+    # like Telegram, an update rejected by backpressure is sent again later
+    data = json.dumps(update).encode()
+    n_rejected = 0
+    while True:
+        try:
+            request.urlopen(request.Request(url, data=data, method="POST"))
+            return n_rejected
+        except error.HTTPError as e:
+            if e.code != 503:
+                raise
+            n_rejected += 1
+            time.sleep(RETRY_DELAY_S)
+
+
+def wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("localhost", port)) == 0:
+                return True
+        time.sleep(0.1)
+    return False
+
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-chats", type=int, default=50)
+    parser.add_argument("--n-updates", type=int, default=2000)
+    parser.add_argument("--n-clients", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--max-pending", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--stub-port", type=int, default=8081)
+    args = parser.parse_args()
+
+    stub = TelegramStub(args.stub_port)
+    env = dict(
+        os.environ,
+        BOT_TOKEN=os.getenv("BOT_TOKEN", "1:load"),
+        TELEGRAM_API_URL="http://localhost:{}/bot{{0}}/{{1}}".format(args.stub_port),
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "server.py",
+            "--host",
+            "localhost",
+            "--port",
+            str(args.port),
+            "--workers",
+            str(args.workers),
+            "--max-pending",
+            str(args.max_pending),
+        ],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        if not wait_for_port(args.port, timeout=60):
+            print("The server has not started")
+            return
+
+        # every client posts the updates of its own chats in order
+        chat_ids = [FIRST_CHAT_ID + i for i in range(args.n_chats)]
+        client_updates = defaultdict(list)
+        sent_at = defaultdict(deque)
+        for update_id in range(args.n_updates):
+            chat_id = chat_ids[update_id % args.n_chats]
+            text = COMMANDS[update_id % len(COMMANDS)]
+            client_updates[chat_id % args.n_clients].append(
+                (chat_id, make_update(update_id + 1, chat_id, text))
+            )
+
+        url = "http://localhost:{}/".format(args.port)
+
+        def run_client(updates):
+            n_rejected = 0
+            for chat_id, update in updates:
+                sent_at[chat_id].append(time.perf_counter())
+                n_rejected += post_until_accepted(url, update)
+            return n_rejected
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.n_clients) as executor:
+            n_rejected = sum(executor.map(run_client, client_updates.values()))
+        posted_s = time.perf_counter() - start
+        is_done = stub.wait_for_replies(args.n_updates, timeout=600)
+        elapsed_s = time.perf_counter() - start
+
+        latencies_ms = [
+            (replied - sent) * 1000
+            for chat_id in chat_ids
+            for sent, replied in zip(sent_at[chat_id], stub.replies[chat_id])
+        ]
+        print("updates:        {} ({} replied)".format(args.n_updates, stub.n_replies))
+        print("posted in:      {:.1f} s, {} rejected".format(posted_s, n_rejected))
+        print("updates/s:      {:.1f}".format(stub.n_replies / elapsed_s))
+        if latencies_ms:
+            print(
+                "latency, ms:    p50 {:.1f} p95 {:.1f} p99 {:.1f}".format(
+                    *[get_percentile(latencies_ms, p) for p in [50, 95, 99]]
+                )
+            )
+        if not is_done:
+            print("Not all the updates were replied to in time")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        print("server exit code: {}".format(server.wait(timeout=60)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Async ports of bot.handlers for AsyncTeleBot, picked by bot.async_structure by
+the name of the handler. Handlers without a port run in a worker thread.
+"""
+
+import asyncio
+
+import database.async_model as async_model
+import word as word_utils
+from bot import common, constants, keyboards, states, utils
+from logs import logged_execution, logger
+from user_interaction import texts
+
+
+@logged_execution
+async def handle_language_not_set(message, bot):
+    await bot.send_message(message.chat.id, texts.no_language_is_set)
+
+
+# common
+@logged_execution
+async def process_exit(message, bot, pool):
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        init_message = data.get("init_message")
+    if init_message is not None:
+        await asyncio.to_thread(
+            utils.clear_history, bot, message.chat.id, init_message, message.id + 1
+        )
+
+    await bot.delete_state(message.from_user.id, message.chat.id)
+    await bot.send_message(message.chat.id, texts.exited, reply_markup=keyboards.empty)
+
+
+@logged_execution
+async def process_cancel(message, bot, pool):
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        init_message = data.get("init_message")
+    if init_message is not None:
+        await asyncio.to_thread(
+            utils.clear_history, bot, message.chat.id, init_message, message.id + 1
+        )
+
+    await bot.delete_state(message.from_user.id, message.chat.id)
+    await bot.send_message(
+        message.chat.id, texts.cancel_short, reply_markup=keyboards.empty
+    )
+
+
+@logged_execution
+async def handle_help(message, bot, pool):
+    await async_model.log_command(pool, message.chat.id, message.text)
+    await bot.send_message(
+        message.chat.id, texts.help_message, reply_markup=keyboards.empty
+    )
+
+
+async def send_howto(message, bot, pool, text):
+    await async_model.log_command(pool, message.chat.id, message.text)
+    await bot.send_message(
+        message.chat.id,
+        text,
+        reply_markup=keyboards.empty,
+        parse_mode="MarkdownV2",
+    )
+
+
+@logged_execution
+async def handle_howto_basic(message, bot, pool):
+    await send_howto(message, bot, pool, texts.how_to_text)
+
+
+@logged_execution
+async def handle_howto_training(message, bot, pool):
+    await send_howto(message, bot, pool, texts.howto_training_text)
+
+
+@logged_execution
+async def handle_howto_groups(message, bot, pool):
+    await send_howto(message, bot, pool, texts.howto_groups)
+
+
+@logged_execution
+async def handle_unknown(message, bot, pool):
+    logger.warning(
+        f"Unknown message! chat_id: {message.chat.id}, message: {message.text}"
+    )
+
+
+# SHOW WORDS
+
+
+@logged_execution
+async def handle_show_words(message, bot, pool):
+    await async_model.log_command(pool, message.chat.id, message.text)
+    language = await async_model.get_current_language(pool, message.chat.id)
+    if language is None:
+        await handle_language_not_set(message, bot)
+        return
+
+    stats = await async_model.get_vocabulary_stats(pool, message.chat.id, language)
+    n_words = stats["n_words"]
+    if n_words == 0:
+        await bot.send_message(
+            message.chat.id, texts.no_words_yet, reply_markup=keyboards.empty
+        )
+        return
+
+    await bot.send_message(
+        message.chat.id,
+        texts.words_count.format(n_words, language),
+        reply_markup=keyboards.empty,
+    )
+
+    await bot.send_message(
+        message.chat.id, texts.choose_sorting, reply_markup=common.get_sorting_markup()
+    )
+
+    await bot.set_state(
+        message.from_user.id, states.ShowWordsState.choose_sort, message.chat.id
+    )
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        common.init_show_words(data, language, n_words, message.text)
+
+
+@logged_execution
+async def process_choose_word_sort(message, bot, pool):
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        original_command = data["original_command"]
+        is_supported = common.choose_word_sort(data, message.text)
+
+    if not is_supported:
+        await bot.delete_state(message.from_user.id, message.chat.id)
+        await bot.reply_to(
+            message, texts.sorting_not_supported.format(original_command)
+        )
+        return
+
+    await bot.set_state(
+        message.from_user.id, states.ShowWordsState.show_words, message.chat.id
+    )
+    await process_show_words_batch_next(message, bot, pool)
+
+
+@logged_execution
+async def process_show_words_batch_unknown(message, bot, pool):
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        original_command = data["original_command"]
+    await bot.delete_state(message.from_user.id, message.chat.id)
+    await bot.send_message(
+        message.chat.id,
+        texts.unknown_command.format(original_command),
+        reply_markup=keyboards.empty,
+    )
+
+
+@logged_execution
+async def process_show_words_batch_next(message, bot, pool):
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        language = data["language"]
+        sorting = data["sorting"]
+        group_id = data["group_id"]
+        cursor = data["cursor"]
+        batch_number = data["batch_number"]
+        n_words = data["n_words"]
+
+    # one extra word tells whether there is a next page
+    words = await async_model.get_vocab_page(
+        pool,
+        message.chat.id,
+        language,
+        sorting,
+        cursor,
+        constants.SHOW_WORDS_BATCH_SIZE + 1,
+        group_id=group_id,
+    )
+    text, next_cursor = common.get_words_page(words, n_words, batch_number)
+
+    if next_cursor is None:
+        markup = keyboards.empty
+        await bot.delete_state(message.from_user.id, message.chat.id)
+    else:
+        markup = keyboards.get_reply_keyboard(["/exit", "/next"])
+        async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+            data["cursor"] = next_cursor
+            data["batch_number"] += 1
+
+    await bot.send_message(
+        message.chat.id, text, reply_markup=markup, parse_mode="MarkdownV2"
+    )
+
+
+# show language info
+
+
+@logged_execution
+async def handle_show_current_language(message, bot, pool):
+    await async_model.log_command(pool, message.chat.id, message.text)
+    current_language = await async_model.get_current_language(pool, message.chat.id)
+    if current_language is not None:
+        await bot.send_message(
+            message.chat.id, texts.current_language.format(current_language)
+        )
+    else:
+        await handle_language_not_set(message, bot)
+
+
+@logged_execution
+async def handle_show_languages(message, bot, pool):
+    # independent reads go concurrently instead of a multi-statement batch
+    _, languages, current_language, stats = await asyncio.gather(
+        async_model.log_command(pool, message.chat.id, message.text),
+        async_model.get_available_languages(pool, message.chat.id),
+        async_model.get_current_language(pool, message.chat.id),
+        async_model.get_all_vocabulary_stats(pool, message.chat.id),
+    )
+
+    await bot.send_message(
+        message.chat.id,
+        common.format_languages(languages, current_language, stats),
+        reply_markup=keyboards.empty,
+    )
+
+
+# TRAIN
+
+
+@logged_execution
+async def handle_train_step_stop(message, bot, pool):
+    await bot.delete_state(message.from_user.id, message.chat.id)
+    await bot.send_message(
+        message.chat.id, texts.training_stopped, reply_markup=keyboards.empty
+    )
+
+
+@logged_execution
+async def handle_train_step(message, bot, pool):
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        word_utils.upgrade_train_state(data)
+        step = data["step"]
+        n_words = data["n_words"]
+        scores = data["scores"]
+        hints = data["hints"]
+        direction = data["direction"]
+        session_id = data["session_id"]
+        language = data["language"]
+
+    # the answered word and the next one are read in one query, and concurrently
+    # the words the wrong options of the test hints are chosen among
+    reads = [
+        async_model.get_training_words_by_idx(
+            pool,
+            message.chat.id,
+            session_id,
+            common.get_train_step_word_idxs(step, n_words),
+        )
+    ]
+    if hints == "test" and step < n_words:
+        reads.append(async_model.get_random_words(pool, message.chat.id, language))
+    words, *candidates = await asyncio.gather(*reads)
+    words = {word["word_idx"]: word for word in words}
+
+    if step != 0:  # not a first iteration
+        is_correct, reply = common.check_train_answer(
+            message.text, words[step], hints, direction
+        )
+        scores |= int(is_correct) << (step - 1)
+        await bot.send_message(message.chat.id, reply, reply_markup=keyboards.empty)
+
+    if step == n_words:  # training complete
+        if hints == "no hints":
+            await async_model.set_training_scores(
+                pool,
+                message.chat.id,
+                session_id,
+                list(range(1, n_words + 1)),
+                word_utils.get_scores_from_bitmap(scores, n_words),
+            )
+            await async_model.update_final_scores(
+                pool, message.chat.id, session_id, language, direction
+            )
+        else:
+            await bot.send_message(message.chat.id, texts.training_no_scores)
+        await bot.delete_state(message.from_user.id, message.chat.id)
+
+        await bot.send_message(
+            message.chat.id,
+            common.format_training_results(scores, n_words),
+            reply_markup=keyboards.empty,
+        )
+        return
+
+    text, markup = common.format_train_step(
+        words[step + 1], hints, direction, candidates[0] if candidates else ()
+    )
+    await bot.send_message(
+        message.chat.id, text, reply_markup=markup, parse_mode="MarkdownV2"
+    )
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data["step"] += 1
+        data["scores"] = scores
@@ -0,0 +1,184 @@
+import asyncio
+import copy
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from telebot.asyncio_storage.base_storage import StateContext, StateStorageBase
+from telebot.storage import base_storage
+
+import database.async_model as async_model
+import database.model as db_model
+import metrics
+from logs import logger
+
+
+class AsyncStateYDBStorage(StateStorageBase):
+    """
+    StateYDBStorage for AsyncTeleBot, on a ydb.aio pool.
+
+    The unit of work is kept in a context variable rather than a thread local:
+    the updates processed concurrently by one event loop share the thread.
+    """
+
+    def __init__(self, ydb_pool):
+        super().__init__()
+        self.pool = ydb_pool
+        self.entries = ContextVar("state_entries", default=None)
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        token = self.entries.set({})
+        try:
+            yield
+        finally:
+            entries = self.entries.get()
+            self.entries.reset(token)
+            await self.flush(entries)
+
+    async def flush(self, entries):
+        for chat_id, entry in entries.items():
+            if not entry["is_changed"]:
+                continue
+
+            try:
+                metrics.count("state.writes")
+                await async_model.set_state_if_version(
+                    self.pool, chat_id, entry["state"], entry["version"]
+                )
+            except db_model.StateConflictError:
+                logger.error(
+                    f"Lost state update for chat_id {chat_id}: "
+                    f"state was changed by a concurrent update"
+                )
+
+    async def read_state(self, chat_id):
+        entries = self.entries.get()
+        if entries is None:
+            metrics.count("state.reads")
+            return await async_model.get_state(self.pool, chat_id)
+
+        if chat_id not in entries:
+            metrics.count("state.reads")
+            state, version = await async_model.get_state_with_version(
+                self.pool, chat_id
+            )
+            # another coroutine of the same update may have read it meanwhile
+            entries.setdefault(
+                chat_id, {"state": state, "version": version, "is_changed": False}
+            )
+        return entries[chat_id]["state"]
+
+    async def write_state(self, chat_id, full_state):
+        entries = self.entries.get()
+        if entries is None:
+            metrics.count("state.writes")
+            if full_state is None:
+                await async_model.clear_state(self.pool, chat_id)
+            else:
+                await async_model.set_state(self.pool, chat_id, full_state)
+            return
+
+        await self.read_state(chat_id)  # the version has to be known before writing
+        entries[chat_id]["state"] = full_state
+        entries[chat_id]["is_changed"] = True
+
+    async def set_data(self, chat_id, user_id, key, value):
+        full_state = await self.read_state(chat_id)
+        if full_state is None:
+            return False
+
+        full_state = copy.deepcopy(full_state)
+        full_state["data"][key] = value
+        await self.write_state(chat_id, full_state)
+        return True
+
+    async def get_data(self, chat_id, user_id):
+        full_state = await self.read_state(chat_id)
+        if full_state:
+            return full_state.get("data", {})
+
+        return {}
+
+    async def set_state(self, chat_id, user_id, state):
+        if hasattr(state, "name"):
+            state = state.name
+
+        data = copy.deepcopy(await self.get_data(chat_id, user_id))
+        await self.write_state(chat_id, {"state": state, "data": data})
+        return True
+
+    async def delete_state(self, chat_id, user_id):
+        if await self.read_state(chat_id) is None:
+            return False
+
+        await self.write_state(chat_id, None)
+        return True
+
+    async def reset_data(self, chat_id, user_id):
+        full_state = await self.read_state(chat_id)
+        if full_state:
+            await self.write_state(
+                chat_id, {"state": full_state.get("state"), "data": {}}
+            )
+            return True
+        return False
+
+    async def get_state(self, chat_id, user_id):
+        full_state = await self.read_state(chat_id)
+        if full_state is None:
+            return None
+        return full_state.get("state")
+
+    def get_interactive_data(self, chat_id, user_id):
+        return StateContext(self, chat_id, user_id)
+
+    async def save(self, chat_id, user_id, data):
+        full_state = await self.read_state(chat_id)
+        if full_state:
+            await self.write_state(
+                chat_id, {"state": full_state.get("state"), "data": copy.deepcopy(data)}
+            )
+            return False
+
+
+class BridgedStateStorage(base_storage.StateStorageBase):
+    """
+    The state storage of the sync bot of the bridged handlers, which run in
+    worker threads of the event loop: every call is run on the loop by the
+    AsyncStateYDBStorage of the async bot, so the state changes of a bridged
+    handler go to the unit of work of its update like the ones of a port.
+    The worker thread has a copy of the context of the update, and so do the
+    coroutines it submits.
+    """
+
+    def __init__(self, storage, loop):
+        super().__init__()
+        self.storage = storage
+        self.loop = loop
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def set_data(self, chat_id, user_id, key, value):
+        return self.run(self.storage.set_data(chat_id, user_id, key, value))
+
+    def get_data(self, chat_id, user_id):
+        return self.run(self.storage.get_data(chat_id, user_id))
+
+    def set_state(self, chat_id, user_id, state):
+        return self.run(self.storage.set_state(chat_id, user_id, state))
+
+    def delete_state(self, chat_id, user_id):
+        return self.run(self.storage.delete_state(chat_id, user_id))
+
+    def reset_data(self, chat_id, user_id):
+        return self.run(self.storage.reset_data(chat_id, user_id))
+
+    def get_state(self, chat_id, user_id):
+        return self.run(self.storage.get_state(chat_id, user_id))
+
+    def get_interactive_data(self, chat_id, user_id):
+        return base_storage.StateContext(self, chat_id, user_id)
+
+    def save(self, chat_id, user_id, data):
+        return self.run(self.storage.save(chat_id, user_id, data))
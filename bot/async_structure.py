@@ -0,0 +1,62 @@
+import asyncio
+
+from telebot import TeleBot, asyncio_filters
+from telebot.async_telebot import AsyncTeleBot
+
+import metrics
+from bot import async_handlers, dispatcher
+from bot.async_states import AsyncStateYDBStorage, BridgedStateStorage
+from bot.structure import get_handlers
+
+
+def bridge(callback, sync_bot, sync_pool):
+    """
+    Runs a handler that has no async port in a worker thread. It works with
+    the sync bot and pool, the state of the sync bot is kept by the unit of
+    work of the update on the event loop.
+    """
+
+    async def handle(message, bot, pool):
+        await asyncio.to_thread(callback, message, sync_bot, sync_pool)
+
+    return handle
+
+
+def bind_pool(callback, pool):
+    # AsyncTeleBot passes (message, bot) to the handlers registered with pass_bot
+    async def handle(message, bot):
+        await callback(message, bot, pool)
+
+    return handle
+
+
+def create_async_bot(bot_token, pool, sync_pool):
+    """
+    The asyncio flavour of bot.structure.create_bot: the same handlers in the
+    same order, on a ydb.aio pool. `sync_pool` serves the bridged handlers.
+    Has to be called on the event loop the bot runs on.
+    """
+    dispatcher.install()
+    dispatcher.install_async()
+    state_storage = AsyncStateYDBStorage(pool)
+    bot = AsyncTeleBot(bot_token, state_storage=state_storage)
+    sync_bot = TeleBot(
+        bot_token,
+        state_storage=BridgedStateStorage(state_storage, asyncio.get_running_loop()),
+        threaded=False,
+    )
+
+    for handler in get_handlers():
+        name = handler.callback.__name__
+        callback = getattr(async_handlers, name, None)
+        if callback is None:
+            callback = bridge(handler.callback, sync_bot, sync_pool)
+
+        bot.register_message_handler(
+            metrics.timed_handler(bind_pool(callback, pool), name),
+            **handler.kwargs,
+            pass_bot=True,
+        )
+
+    bot.add_custom_filter(asyncio_filters.StateFilter(bot))
+    return bot
@@ -0,0 +1,129 @@
+"""
+The logic of the handlers that doesn't depend on how they reach Telegram and
+the database, shared by bot.handlers and their ports in bot.async_handlers.
+The functions take what the handlers have read and return what they send.
+"""
+
+import json
+
+import word as word_utils
+from bot import constants, keyboards, utils
+from user_interaction import options, texts
+
+# SHOW WORDS
+
+
+def init_show_words(data, language, n_words, original_command):
+    data["language"] = language
+    data["n_words"] = n_words
+    data["original_command"] = original_command
+
+
+def get_sorting_markup():
+    return keyboards.get_reply_keyboard(
+        options.show_words_sort_options, ["/exit"], row_width=3
+    )
+
+
+def choose_word_sort(data, text):
+    """
+    Starts the pagination with the chosen sorting, returns False if it is not supported.
+    """
+    if text not in options.show_words_sort_options:
+        return False
+
+    # the words are sorted and paginated by the database
+    data["sorting"] = options.show_words_sort_options[text]
+    data["group_id"] = None
+    data["cursor"] = None
+    data["batch_number"] = 0
+    return True
+
+
+def get_words_page(words, n_words, batch_number):
+    """
+    Returns the text of a page of words and the cursor of the next one, None
+    for the last page. `words` has one word more than the page if there are more.
+    """
+    words_batch = words[: constants.SHOW_WORDS_BATCH_SIZE]
+    words_formatted = [word_utils.format_word_for_listing(word) for word in words_batch]
+
+    n_pages = utils.get_number_of_batches(constants.SHOW_WORDS_BATCH_SIZE, n_words)
+    # the vocabulary may have changed since the words were counted
+    n_pages = max(n_pages, batch_number + 1)
+
+    text = texts.word_formatted.format(
+        batch_number + 1, n_pages, "\n".join(words_formatted)
+    )
+    if len(words) <= constants.SHOW_WORDS_BATCH_SIZE:
+        return text, None
+    return text, [words_batch[-1]["sort_key"], words_batch[-1]["word"]]
+
+
+# SHOW LANGUAGES
+
+
+def format_languages(languages, current_language, stats):
+    if len(languages) == 0:
+        return texts.show_languages_none
+
+    languages = [
+        options.show_languages_mark_current[l == current_language].format(
+            texts.language_words_count.format(
+                l, stats[l]["n_words"] if l in stats else 0
+            )
+        )
+        for l in sorted(languages)
+    ]
+    return texts.available_languages.format(len(languages), "\n".join(languages))
+
+
+# TRAIN
+
+
+def get_train_step_word_idxs(step, n_words):
+    # the answered word and the next one
+    return [idx for idx in [step, step + 1] if 1 <= idx <= n_words]
+
+
+def check_train_answer(text, word, hints, direction):
+    """
+    Returns whether the answer is correct and the reply to it.
+    """
+    is_correct = word_utils.compare_user_input_with_db(text, word, hints, direction)
+    if is_correct:
+        return True, texts.train_correct_answer
+    return False, texts.train_wrong_answer.format(
+        word_utils.get_translation(word, direction)
+    )
+
+
+def format_training_results(scores, n_words):
+    n_correct = bin(scores).count("1")
+    reaction = None
+    for score, current_reaction in sorted(
+        options.train_reactions.items(), key=lambda x: x[0]
+    ):
+        if n_correct / n_words >= score:
+            reaction = current_reaction
+    return texts.training_results.format(n_correct, n_words, reaction)
+
+
+def format_train_step(word, hints, direction, candidates=()):
+    """
+    Returns the text and the keyboard of the message asking for the word.
+    The wrong options of the test hints are the ones saved with the word by
+    the trainings that precomputed them, or are chosen among `candidates`.
+    """
+    translation = word_utils.get_translation(word, direction)
+    distractors = []
+    if hints == "test" and word["distractors"] is not None:
+        distractors = json.loads(word["distractors"])
+    elif hints == "test":
+        distractors = word_utils.get_similar_hints(
+            translation, word_utils.group_hints_by_length(candidates, direction)
+        )
+    text = word_utils.format_train_message(
+        word_utils.get_word(word, direction), translation, hints
+    )
+    return text, keyboards.format_train_buttons(translation, distractors, hints)
@@ -1,2 +1,5 @@
 SHOW_WORDS_BATCH_SIZE = 20
 GROUP_ADD_WORDS_BATCH_SIZE = 6
+IMPORT_MAX_FILE_SIZE = 5 * 1024 * 1024
+IMPORT_MAX_REPORTED_ERRORS = 10
+IMPORT_MAX_REPORTED_WORDS = 20
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from telebot import apihelper
+
+import metrics
+from logs import logger
+
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+PER_CHAT_RATE = 1
+# a handler usually sends a few messages in a row, they shouldn't wait
+PER_CHAT_BURST = 3
+MAX_TRACKED_CHATS = 10000
+
+MAX_RETRIES = 3
+# longer waits don't fit into a function invocation
+MAX_RETRY_AFTER_S = 10
+
+DELETE_MESSAGES_CHUNK_SIZE = 100
+THROTTLED_METHOD_PREFIXES = ("send", "edit", "copy", "forward")
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def reserve(self):
+        """
+        Takes a token and returns how long to wait before using it, seconds.
+        Tokens may go negative: the callers are served in the order of reservation.
+        """
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+
+class Dispatcher:
+    """
+    Sits between TeleBot and the Telegram API as apihelper.CUSTOM_REQUEST_SENDER
+    (and between AsyncTeleBot and it as asyncio_helper._process_request):
+    throttles outgoing messages with a global and per-chat token buckets
+    and retries requests rejected with 429 after `retry_after` seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self.chat_buckets = OrderedDict()
+        self.n_calls_saved = 0
+        self.n_retries = 0
+        self.throttled_ms = 0.0
+        # asyncio_helper._process_request before install_async replaced it
+        self.process_request_original = None
+
+    def get_chat_bucket(self, chat_id):
+        # the lock is held by the caller
+        if chat_id in self.chat_buckets:
+            self.chat_buckets.move_to_end(chat_id)
+        else:
+            self.chat_buckets[chat_id] = TokenBucket(PER_CHAT_RATE, PER_CHAT_BURST)
+            while len(self.chat_buckets) > MAX_TRACKED_CHATS:
+                self.chat_buckets.popitem(last=False)
+        return self.chat_buckets[chat_id]
+
+    def reserve(self, chat_id):
+        """
+        Returns how long a message to the chat has to wait, seconds.
+        """
+        with self.lock:
+            wait_s = self.global_bucket.reserve()
+            if chat_id is not None:
+                wait_s = max(wait_s, self.get_chat_bucket(chat_id).reserve())
+            self.throttled_ms += wait_s * 1000
+
+        if wait_s > 0:
+            metrics.count("telegram.throttled_ms", round(wait_s * 1000, 3))
+        return wait_s
+
+    def throttle(self, chat_id):
+        wait_s = self.reserve(chat_id)
+        if wait_s > 0:
+            time.sleep(wait_s)
+
+    async def throttle_async(self, chat_id):
+        wait_s = self.reserve(chat_id)
+        if wait_s > 0:
+            await asyncio.sleep(wait_s)
+
+    def count_retry(self, api_method, retry_after):
+        logger.warning(f"{api_method} is rate limited, retry in {retry_after} s")
+        with self.lock:
+            self.n_retries += 1
+        metrics.count("telegram.retries")
+
+    def send_request(self, method, url, **kwargs):
+        api_method = urlparse(url).path.rsplit("/", 1)[-1]
+        if api_method.startswith(THROTTLED_METHOD_PREFIXES):
+            self.throttle((kwargs.get("params") or {}).get("chat_id"))
+
+        for attempt in range(MAX_RETRIES + 1):
+            response = metrics.send_telegram_request(method, url, **kwargs)
+            if response.status_code != 429 or attempt == MAX_RETRIES:
+                return response
+
+            retry_after = get_retry_after(response)
+            if retry_after is None or retry_after > MAX_RETRY_AFTER_S:
+                return response
+
+            self.count_retry(api_method, retry_after)
+            time.sleep(retry_after)
+            rewind_files(kwargs.get("files"))
+
+        return response
+
+    async def process_request(
+        self, token, url, method="get", params=None, files=None, request_timeout=None
+    ):
+        """
+        The asyncio counterpart of send_request. `url` is the API method here,
+        a rejected request raises ApiTelegramException instead of returning.
+        """
+        from telebot import asyncio_helper
+
+        if url.startswith(THROTTLED_METHOD_PREFIXES):
+            await self.throttle_async((params or {}).get("chat_id"))
+
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                with metrics.track("telegram." + url):
+                    return await self.process_request_original(
+                        token, url, method, params, files, request_timeout
+                    )
+            except asyncio_helper.ApiTelegramException as e:
+                if e.error_code != 429 or attempt == MAX_RETRIES:
+                    raise
+                retry_after = get_retry_after_from_json(e.result_json)
+                if retry_after is None or retry_after > MAX_RETRY_AFTER_S:
+                    raise
+
+            self.count_retry(url, retry_after)
+            await asyncio.sleep(retry_after)
+            rewind_files(files)
+
+    def delete_messages(self, bot, chat_id, message_ids):
+        """
+        Deletes the messages with one deleteMessages call per 100 of them.
+        Messages that can't be deleted are skipped by Telegram.
+        """
+        message_ids = list(message_ids)
+        for i in range(0, len(message_ids), DELETE_MESSAGES_CHUNK_SIZE):
+            chunk = message_ids[i : i + DELETE_MESSAGES_CHUNK_SIZE]
+            try:
+                apihelper._make_request(
+                    bot.token,
+                    "deleteMessages",
+                    params={"chat_id": chat_id, "message_ids": json.dumps(chunk)},
+                    method="post",
+                )
+            except apihelper.ApiException as e:
+                logger.warning(f"Failed to delete {len(chunk)} messages: {e}")
+                continue
+
+            with self.lock:
+                self.n_calls_saved += len(chunk) - 1
+            metrics.count("telegram.calls_saved", len(chunk) - 1)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "calls_saved": self.n_calls_saved,
+                "retries": self.n_retries,
+                "throttled_ms": round(self.throttled_ms, 3),
+            }
+
+
+def get_retry_after(response):
+    try:
+        return get_retry_after_from_json(response.json())
+    except ValueError:
+        return None
+
+
+def get_retry_after_from_json(result_json):
+    try:
+        return result_json["parameters"]["retry_after"]
+    except (KeyError, TypeError):
+        return None
+
+
+def rewind_files(files):
+    # a retried upload has to be read from the beginning again
+    for value in (files or {}).values():
+        file = value[1] if isinstance(value, tuple) else value
+        if hasattr(file, "seek"):
+            file.seek(0)
+
+
+dispatcher = Dispatcher()
+
+
+def install():
+    apihelper.CUSTOM_REQUEST_SENDER = dispatcher.send_request
+
+
+def install_async():
+    # AsyncTeleBot doesn't use apihelper: its requests go through aiohttp
+    # in asyncio_helper, whose API functions call _process_request
+    from telebot import asyncio_helper
+
+    if dispatcher.process_request_original is None:
+        dispatcher.process_request_original = asyncio_helper._process_request
+    asyncio_helper._process_request = dispatcher.process_request
@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+import tempfile
+
+# the buffer moves to a temporary file when it gets larger
+MAX_IN_MEMORY_SIZE = 1024 * 1024
+
+EXPORT_FIELDS = [
+    "word",
+    "translations",
+    "added_timestamp",
+    "score_from",
+    "score_to",
+    "n_trains_from",
+    "n_trains_to",
+]
+
+
+def format_row(row):
+    return {
+        "word": row["word"],
+        "translations": json.loads(row["translation"]),
+        "added_timestamp": row["added_timestamp"],
+        "score_from": row["score_from"],
+        "score_to": row["score_to"],
+        "n_trains_from": row["n_trains_from"],
+        "n_trains_to": row["n_trains_to"],
+    }
+
+
+def write_csv(rows, text):
+    # the first two columns can be read back by /import
+    writer = csv.writer(text)
+    for row in rows:
+        entry = format_row(row)
+        entry["translations"] = " / ".join(entry["translations"])
+        writer.writerow([entry[field] for field in EXPORT_FIELDS])
+
+
+def write_jsonl(rows, text):
+    for row in rows:
+        text.write(json.dumps(format_row(row), ensure_ascii=False))
+        text.write("\n")
+
+
+WRITERS = {
+    "csv": write_csv,
+    "jsonl": write_jsonl,
+}
+
+
+def export_rows(rows, export_format, max_in_memory_size=MAX_IN_MEMORY_SIZE):
+    """
+    Writes the rows one by one into a binary buffer that spills to disk,
+    returns the buffer rewound and the number of rows written.
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=max_in_memory_size)
+    text = io.TextIOWrapper(buffer, encoding="utf-8", newline="")
+
+    n_rows = 0
+
+    def counted(rows):
+        nonlocal n_rows
+        for row in rows:
+            n_rows += 1
+            yield row
+
+    WRITERS[export_format](counted(rows), text)
+    text.flush()
+    text.detach()  # closing the wrapper would close the buffer
+    buffer.seek(0)
+    return buffer, n_rows
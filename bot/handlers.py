@@ -3,7 +3,7 @@ from hashlib import blake2b
 
 import database.model as db_model
 import word as word_utils
-from bot import constants, keyboards, states, utils
+from bot import common, constants, exporting, importing, keyboards, states, utils
 from logs import logged_execution, logger
 from user_interaction import config, options, texts
 
@@ -114,7 +114,11 @@ def handle_unknown(message, bot, pool):
 @logged_execution
 def handle_set_language(message, bot, pool):
     db_model.log_command(pool, message.chat.id, message.text)
-    language = db_model.get_current_language(pool, message.chat.id)
+    with db_model.Batch(pool) as batch:
+        language = batch.get_current_language(message.chat.id)
+        languages = batch.get_available_languages(message.chat.id)
+    language, languages = language.value, languages.value
+
     if language is not None:
         bot.send_message(
             message.chat.id,
@@ -122,7 +126,6 @@ def handle_set_language(message, bot, pool):
             reply_markup=keyboards.empty,
         )
 
-    languages = db_model.get_available_languages(pool, message.chat.id)
     bot.set_state(
         message.from_user.id, states.SetLanguageState.choose_language, message.chat.id
     )
@@ -217,8 +220,9 @@ def process_save_new_language(message, bot, pool):
         texts.new_language_created.format(full_language_name),
         reply_markup=keyboards.empty,
     )
-    db_model.user_add_language(pool, message.chat.id, full_language_name)
-    db_model.update_current_lang(pool, message.chat.id, full_language_name)
+    with db_model.Batch(pool) as batch:
+        batch.user_add_language(message.chat.id, full_language_name)
+        batch.update_current_lang(message.chat.id, full_language_name)
     bot.send_message(
         message.chat.id,
         texts.language_is_set.format(full_language_name),
@@ -413,6 +417,226 @@ def process_word_translation_one_by_one(message, bot, pool):
             )
 
 
+# IMPORT WORDS
+
+
+@logged_execution
+def handle_import(message, bot, pool):
+    db_model.log_command(pool, message.chat.id, message.text)
+    language = db_model.get_current_language(pool, message.chat.id)
+    if language is None:
+        utils.handle_language_not_set(message, bot)
+        return
+
+    bot.set_state(
+        message.from_user.id, states.ImportWordsState.wait_file, message.chat.id
+    )
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data["language"] = language
+
+    bot.send_message(
+        message.chat.id,
+        texts.import_instruction.format(language),
+        reply_markup=keyboards.empty,
+    )
+
+
+@logged_execution
+def process_import_not_a_file(message, bot, pool):
+    bot.reply_to(message, texts.import_not_a_file)
+
+
+@logged_execution
+def process_import_file(message, bot, pool):
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        language = data["language"]
+
+    if (message.document.file_size or 0) > constants.IMPORT_MAX_FILE_SIZE:
+        bot.reply_to(
+            message,
+            texts.import_file_too_large.format(
+                constants.IMPORT_MAX_FILE_SIZE // 1024 // 1024
+            ),
+        )
+        return
+
+    file_info = bot.get_file(message.document.file_id)
+    content = bot.download_file(file_info.file_path)
+
+    # the file is decoded at once and parsed lazily, every batch is saved
+    # in a single transaction
+    errors = []
+    try:
+        batches = importing.parse_import_file(
+            content, db_model.WORDS_IMPORT_BUCKET_SIZE, errors
+        )
+    except UnicodeDecodeError:
+        bot.delete_state(message.from_user.id, message.chat.id)
+        bot.reply_to(message, texts.import_not_utf8, reply_markup=keyboards.empty)
+        return
+
+    n_saved = 0
+    existing_words = []
+    progress_message = None
+    for batch in batches:
+        # the words that are already in the vocabulary aren't reset
+        batch_existing_words = db_model.add_new_words(
+            pool,
+            message.chat.id,
+            language,
+            [word for word, _ in batch],
+            [translation for _, translation in batch],
+            bucket_size=db_model.WORDS_IMPORT_BUCKET_SIZE,
+        )
+        existing_words.extend(batch_existing_words)
+        n_saved += len(batch) - len(batch_existing_words)
+
+        if progress_message is None:
+            progress_message = bot.send_message(
+                message.chat.id, texts.import_progress.format(n_saved)
+            )
+        else:
+            bot.edit_message_text(
+                texts.import_progress.format(n_saved),
+                message.chat.id,
+                progress_message.message_id,
+            )
+
+    bot.delete_state(message.from_user.id, message.chat.id)
+
+    if len(errors) > 0:
+        reported = "\n".join(
+            str(error) for error in errors[: constants.IMPORT_MAX_REPORTED_ERRORS]
+        )
+        if len(errors) > constants.IMPORT_MAX_REPORTED_ERRORS:
+            reported += texts.import_errors_more.format(
+                len(errors) - constants.IMPORT_MAX_REPORTED_ERRORS
+            )
+        bot.send_message(
+            message.chat.id, texts.import_errors.format(len(errors), reported)
+        )
+
+    if len(existing_words) > 0:
+        reported = ", ".join(existing_words[: constants.IMPORT_MAX_REPORTED_WORDS])
+        if len(existing_words) > constants.IMPORT_MAX_REPORTED_WORDS:
+            reported += texts.import_errors_more.format(
+                len(existing_words) - constants.IMPORT_MAX_REPORTED_WORDS
+            )
+        bot.send_message(
+            message.chat.id, texts.import_existing.format(len(existing_words), reported)
+        )
+
+    if progress_message is None:
+        bot.send_message(
+            message.chat.id, texts.import_nothing, reply_markup=keyboards.empty
+        )
+    else:
+        bot.edit_message_text(
+            texts.import_finished.format(n_saved),
+            message.chat.id,
+            progress_message.message_id,
+        )
+
+
+# EXPORT WORDS
+
+
+@logged_execution
+def handle_export(message, bot, pool):
+    db_model.log_command(pool, message.chat.id, message.text)
+    language = db_model.get_current_language(pool, message.chat.id)
+    if language is None:
+        utils.handle_language_not_set(message, bot)
+        return
+
+    bot.set_state(
+        message.from_user.id, states.ExportWordsState.choose_format, message.chat.id
+    )
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data["language"] = language
+
+    markup = keyboards.get_reply_keyboard(options.export_formats, ["/cancel"])
+    bot.send_message(message.chat.id, texts.export_choose_format, reply_markup=markup)
+
+
+@logged_execution
+def process_choose_export_format(message, bot, pool):
+    if message.text not in options.export_formats:
+        markup = keyboards.get_reply_keyboard(options.export_formats, ["/cancel"])
+        bot.reply_to(message, texts.export_format_unknown, reply_markup=markup)
+        return
+
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data["format"] = message.text
+        language = data["language"]
+
+    groups = db_model.get_all_groups(pool, message.chat.id, language)
+    if len(groups) == 0:
+        send_export(message, bot, pool, language, message.text)
+        return
+
+    group_names = sorted([group["group_name"].decode() for group in groups])
+    bot.set_state(
+        message.from_user.id, states.ExportWordsState.choose_group, message.chat.id
+    )
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data["group_names"] = group_names
+
+    markup = keyboards.get_reply_keyboard(
+        [options.export_all_words] + group_names, ["/cancel"], row_width=3
+    )
+    bot.send_message(message.chat.id, texts.export_choose_group, reply_markup=markup)
+
+
+@logged_execution
+def process_choose_export_group(message, bot, pool):
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        language = data["language"]
+        export_format = data["format"]
+        group_names = data["group_names"]
+
+    if message.text == options.export_all_words:
+        send_export(message, bot, pool, language, export_format)
+        return
+
+    groups = db_model.get_group_by_name(pool, message.chat.id, language, message.text)
+    if len(groups) != 1:
+        markup = keyboards.get_reply_keyboard(
+            [options.export_all_words] + group_names, ["/cancel"], row_width=3
+        )
+        bot.reply_to(message, texts.no_such_group, reply_markup=markup)
+        return
+
+    group_id = groups[0]["group_id"].decode("utf-8")
+    send_export(message, bot, pool, language, export_format, group_id, message.text)
+
+
+@logged_execution
+def send_export(
+    message, bot, pool, language, export_format, group_id=None, group_name=None
+):
+    bot.delete_state(message.from_user.id, message.chat.id)
+
+    # rows are streamed from a scan query into a buffer that spills to disk
+    rows = db_model.export_vocab(pool, message.chat.id, language, group_id)
+    buffer, n_words = exporting.export_rows(rows, export_format)
+    with buffer:
+        if n_words == 0:
+            bot.send_message(
+                message.chat.id, texts.export_empty, reply_markup=keyboards.empty
+            )
+            return
+
+        file_name = language if group_name is None else f"{language}-{group_name}"
+        bot.send_document(
+            message.chat.id,
+            buffer,
+            caption=texts.export_finished.format(n_words),
+            visible_file_name=f"{file_name}.{export_format}",
+            reply_markup=keyboards.empty,
+        )
+
+
 # SHOW WORDS
 
 
@@ -425,8 +649,8 @@ def handle_show_words(message, bot, pool):
         utils.handle_language_not_set(message, bot)
         return
 
-    vocab = db_model.get_full_vocab(pool, message.chat.id, language)
-    if len(vocab) == 0:
+    n_words = db_model.get_vocabulary_stats(pool, message.chat.id, language)["n_words"]
+    if n_words == 0:
         bot.send_message(
             message.chat.id, texts.no_words_yet, reply_markup=keyboards.empty
         )
@@ -434,68 +658,31 @@ def handle_show_words(message, bot, pool):
 
     bot.send_message(
         message.chat.id,
-        texts.words_count.format(len(vocab), language),
+        texts.words_count.format(n_words, language),
         reply_markup=keyboards.empty,
     )
 
-    for entry in vocab:
-        word = word_utils.Word(entry)
-        entry["score"] = word.get_overall_score()
-        entry["n_trains"] = word.get_total_trains()
-
     # TODO: make all keyboards one time
-    markup = keyboards.get_reply_keyboard(
-        options.show_words_sort_options, ["/exit"], row_width=3
+    bot.send_message(
+        message.chat.id, texts.choose_sorting, reply_markup=common.get_sorting_markup()
     )
-    bot.send_message(message.chat.id, texts.choose_sorting, reply_markup=markup)
 
     bot.set_state(
         message.from_user.id, states.ShowWordsState.choose_sort, message.chat.id
     )
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        data["vocabulary"] = vocab
-        data["original_command"] = message.text
+        common.init_show_words(data, language, n_words, message.text)
 
 
 @logged_execution
 def process_choose_word_sort(message, bot, pool):
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        if message.text not in options.show_words_sort_options:
+        if not common.choose_word_sort(data, message.text):
             bot.delete_state(message.from_user.id, message.chat.id)
             bot.reply_to(
                 message, texts.sorting_not_supported.format(data["original_command"])
             )
             return
-
-        words = data["vocabulary"]
-
-    # TODO: get rid of string constants
-    if message.text == "a-z":
-        words = sorted(words, key=lambda w: w["word"])
-    elif message.text == "z-a":
-        words = sorted(words, key=lambda w: w["word"])[::-1]
-    elif message.text == "n trains ⬇️":
-        words = sorted(words, key=lambda w: w["n_trains"])[::-1]
-    elif message.text == "n trains ⬆️":
-        words = sorted(words, key=lambda w: w["n_trains"])
-    elif message.text == "time added ⬇️":
-        words = sorted(words, key=lambda w: w["added_timestamp"])[::-1]
-    elif message.text == "time added ⬆️":
-        words = sorted(words, key=lambda w: w["added_timestamp"])
-    elif message.text == "score ⬇️":
-        unknown_score = list(filter(lambda w: w["score"] is None, words))
-        known_score = list(filter(lambda w: w["score"] is not None, words))
-        words = sorted(known_score, key=lambda w: w["score"])[::-1]
-        words.extend(unknown_score)
-    elif message.text == "score ⬆️":
-        unknown_score = list(filter(lambda w: w["score"] is None, words))
-        known_score = list(filter(lambda w: w["score"] is not None, words))
-        words = sorted(known_score, key=lambda w: w["score"])
-        words.extend(unknown_score)
-
-    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        data["vocabulary"] = words
-        data["batch_number"] = 0
     bot.set_state(
         message.from_user.id, states.ShowWordsState.show_words, message.chat.id
     )
@@ -517,36 +704,37 @@ def process_show_words_batch_unknown(message, bot, pool):
 @logged_execution
 def process_show_words_batch_next(message, bot, pool):
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        language = data["language"]
+        sorting = data["sorting"]
+        group_id = data["group_id"]
+        cursor = data["cursor"]
         batch_number = data["batch_number"]
-        words = data["vocabulary"]
-
-    words_batch = words[
-        batch_number
-        * constants.SHOW_WORDS_BATCH_SIZE : (batch_number + 1)
-        * constants.SHOW_WORDS_BATCH_SIZE
-    ]
-    words_formatted = [word_utils.format_word_for_listing(word) for word in words_batch]
+        n_words = data["n_words"]
 
-    n_pages = len(words) // constants.SHOW_WORDS_BATCH_SIZE
-    if len(words) % constants.SHOW_WORDS_BATCH_SIZE > 0:
-        n_pages += 1
+    # one extra word tells whether there is a next page
+    words = db_model.get_vocab_page(
+        pool,
+        message.chat.id,
+        language,
+        sorting,
+        cursor,
+        constants.SHOW_WORDS_BATCH_SIZE + 1,
+        group_id=group_id,
+    )
+    text, next_cursor = common.get_words_page(words, n_words, batch_number)
 
-    if len(words_batch) < constants.SHOW_WORDS_BATCH_SIZE:
+    if next_cursor is None:
         # we've run out of words
         markup = keyboards.empty
         bot.delete_state(message.from_user.id, message.chat.id)
     else:
         markup = keyboards.get_reply_keyboard(["/exit", "/next"])
         with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+            data["cursor"] = next_cursor
             data["batch_number"] += 1
 
     bot.send_message(
-        message.chat.id,
-        texts.word_formatted.format(
-            batch_number + 1, n_pages, "\n".join(words_formatted)
-        ),
-        reply_markup=markup,
-        parse_mode="MarkdownV2",
+        message.chat.id, text, reply_markup=markup, parse_mode="MarkdownV2"
     )
 
 
@@ -568,23 +756,16 @@ def handle_show_current_language(message, bot, pool):
 @logged_execution
 def handle_show_languages(message, bot, pool):
     db_model.log_command(pool, message.chat.id, message.text)
-    languages = sorted(db_model.get_available_languages(pool, message.chat.id))
-    current_language = db_model.get_current_language(pool, message.chat.id)
+    with db_model.Batch(pool) as batch:
+        languages = batch.get_available_languages(message.chat.id)
+        current_language = batch.get_current_language(message.chat.id)
+        stats = batch.get_all_vocabulary_stats(message.chat.id)
 
-    if len(languages) == 0:
-        bot.send_message(
-            message.chat.id, texts.show_languages_none, reply_markup=keyboards.empty
-        )
-    else:
-        languages = [
-            options.show_languages_mark_current[l == current_language].format(l)
-            for l in languages
-        ]
-        bot.send_message(
-            message.chat.id,
-            texts.available_languages.format(len(languages), "\n".join(languages)),
-            reply_markup=keyboards.empty,
-        )
+    bot.send_message(
+        message.chat.id,
+        common.format_languages(languages.value, current_language.value, stats.value),
+        reply_markup=keyboards.empty,
+    )
 
 
 # delete language
@@ -746,23 +927,21 @@ def process_show_group_contents(message, bot, pool):
         return
 
     group_id = groups[0]["group_id"].decode("utf-8")
-    group_contents = sorted(
-        db_model.get_group_contents(pool, group_id), key=lambda w: w["word"]
+    n_words = db_model.count_vocab_words(
+        pool, message.chat.id, language, group_id=group_id
     )
 
-    for entry in group_contents:
-        word = word_utils.Word(entry)
-        entry["score"] = word.get_overall_score()
-        entry["n_trains"] = word.get_total_trains()
-
-    if len(group_contents) == 0:
+    if n_words == 0:
         bot.delete_state(message.from_user.id, message.chat.id)
         bot.reply_to(message, texts.show_group_empty, reply_markup=keyboards.empty)
         return
 
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data["sorting"] = options.show_words_sort_options["a-z"]
+        data["group_id"] = group_id
+        data["cursor"] = None
         data["batch_number"] = 0
-        data["vocabulary"] = group_contents
+        data["n_words"] = n_words
 
     bot.set_state(
         message.from_user.id, states.ShowWordsState.show_words, message.chat.id
@@ -799,31 +978,19 @@ def handle_choose_group_to_add_words(message, bot, pool):
         return
 
     group_id = groups[0]["group_id"].decode("utf-8")
-    vocabulary = db_model.get_full_vocab(pool, message.chat.id, language)
-    words_in_group = set(
-        [entry["word"] for entry in db_model.get_group_contents(pool, group_id)]
-    )
-
-    words_to_add = []
-    for entry in vocabulary:
-        if entry["word"] in words_in_group:
-            continue
-        words_to_add.append(entry)
+    n_words = db_model.count_group_candidates(pool, message.chat.id, language, group_id)
 
-    if len(words_to_add) == 0:
+    if n_words == 0:
         bot.delete_state(message.from_user.id, message.chat.id)
         bot.reply_to(message, texts.group_edit_full)
         return
 
+    # the words are read a batch at a time, only the chosen ones are kept
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        data["vocabulary"] = words_to_add
-        data["masks"] = [0] * len(words_to_add)
-        data["batch_number"] = 0
-        data["is_start"] = True
-        data["batch_size"] = constants.GROUP_ADD_WORDS_BATCH_SIZE
+        data["n_words"] = n_words
+        data["chosen_words"] = []
         data["group_id"] = group_id
         data["group_name"] = message.text
-        data["action"] = "add"
 
     bot.set_state(
         message.from_user.id, states.AddGroupWordsState.choose_sorting, message.chat.id
@@ -839,9 +1006,6 @@ def handle_choose_group_to_add_words(message, bot, pool):
 
 @logged_execution
 def process_choose_sorting_to_add_words(message, bot, pool):
-    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        vocabulary = data["vocabulary"]
-
     if message.text not in options.group_add_words_sort_options:
         markup = keyboards.get_reply_keyboard(
             options.group_add_words_sort_options, ["/exit"]
@@ -849,17 +1013,151 @@ def process_choose_sorting_to_add_words(message, bot, pool):
         bot.reply_to(message, texts.sorting_not_supported, reply_markup=markup)
         return
 
-    if message.text == "a-z":
-        vocabulary = sorted(vocabulary, key=lambda x: x["translation"])
-    elif message.text == "time added ⬇️":
-        vocabulary = sorted(vocabulary, key=lambda x: x["added_timestamp"])[::-1]
-
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        data["vocabulary"] = vocabulary
+        data["sorting"] = options.group_add_words_sort_options[message.text]
+        data["cursor"] = None
+        data["batch_number"] = 0
     bot.set_state(
         message.from_user.id, states.AddGroupWordsState.choose_words, message.chat.id
     )
-    process_choose_words_batch_for_group(message, bot, pool)
+    send_words_batch_to_add_to_group(message, bot, pool)
+
+
+def get_words_to_add_markup(batch, chosen_words, has_next):
+    additional_commands = ["/cancel", "/exit"]
+    if has_next:
+        additional_commands.append("/next")
+    mask = [int(entry["word"] in chosen_words) for entry in batch]
+    return keyboards.get_masked_choices(
+        batch, mask, additional_commands=additional_commands
+    )
+
+
+@logged_execution
+def send_words_batch_to_add_to_group(message, bot, pool):
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        language = data["language"]
+        group_id = data["group_id"]
+        group_name = data["group_name"]
+        sorting = data["sorting"]
+        cursor = data["cursor"]
+        batch_number = data["batch_number"]
+        n_words = data["n_words"]
+        chosen_words = data["chosen_words"]
+
+    # one extra word tells whether there is a next batch
+    words = db_model.get_group_candidates_page(
+        pool,
+        message.chat.id,
+        language,
+        group_id,
+        sorting,
+        cursor,
+        constants.GROUP_ADD_WORDS_BATCH_SIZE + 1,
+    )
+    batch = [
+        {
+            "word": entry["word"],
+            "translation": entry["translation"],
+            "sort_key": entry["sort_key"],
+        }
+        for entry in words[: constants.GROUP_ADD_WORDS_BATCH_SIZE]
+    ]
+    has_next = len(words) > constants.GROUP_ADD_WORDS_BATCH_SIZE
+
+    if len(batch) == 0:
+        # the words have been added to the group or deleted meanwhile
+        bot.send_message(message.chat.id, texts.group_edit_no_more_words)
+        process_save_words_to_add_to_group(message, bot, pool)
+        return
+
+    # the words may have changed since they were counted
+    n_batches = max(
+        utils.get_number_of_batches(constants.GROUP_ADD_WORDS_BATCH_SIZE, n_words),
+        batch_number + 1 + has_next,
+    )
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data["batch"] = batch
+        data["has_next"] = has_next
+
+    bot.send_message(
+        message.chat.id,
+        texts.group_edit_choose.format("add", group_name, batch_number + 1, n_batches),
+        reply_markup=get_words_to_add_markup(batch, chosen_words, has_next),
+    )
+
+
+@logged_execution
+def process_choose_words_to_add_to_group(message, bot, pool):
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        batch = data["batch"]
+        has_next = data["has_next"]
+        chosen_words = set(data["chosen_words"])
+
+    word = None
+    if " - " in message.text:
+        word = word_utils.get_word_from_group_action(message.text)
+
+    if word not in [entry["word"] for entry in batch]:
+        logger.debug(f"word clicked: {word}")
+        bot.send_message(
+            message.chat.id,
+            texts.group_edit_unknown_word,
+            reply_markup=get_words_to_add_markup(batch, chosen_words, has_next),
+        )
+        return
+
+    chosen_words ^= {word}
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data["chosen_words"] = sorted(chosen_words)
+
+    bot.send_message(
+        message.chat.id,
+        texts.group_edit_confirm,
+        reply_markup=get_words_to_add_markup(batch, chosen_words, has_next),
+    )
+
+
+@logged_execution
+def process_choose_words_to_add_to_group_next(message, bot, pool):
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        batch = data["batch"]
+        has_next = data["has_next"]
+
+    if not has_next:
+        # the words have ended
+        bot.send_message(message.chat.id, texts.group_edit_no_more_words)
+        process_save_words_to_add_to_group(message, bot, pool)
+        return
+
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data["cursor"] = [batch[-1]["sort_key"], batch[-1]["word"]]
+        data["batch_number"] += 1
+    send_words_batch_to_add_to_group(message, bot, pool)
+
+
+@logged_execution
+def process_save_words_to_add_to_group(message, bot, pool):
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        language = data["language"]
+        chosen_words = data["chosen_words"]
+        group_id = data["group_id"]
+        group_name = data["group_name"]
+
+    bot.delete_state(message.from_user.id, message.chat.id)
+
+    n_edited_words = utils.save_words_edit_to_group(
+        pool, message.chat.id, language, group_id, chosen_words, "add"
+    )
+    logger.debug(f"n_edited_words: {n_edited_words}")
+
+    bot.reply_to(
+        message,
+        texts.group_edit_finished.format(
+            group_name, "add", n_edited_words, "\n".join(chosen_words)
+        ),
+        reply_markup=keyboards.empty,
+    )
 
 
 @logged_execution
@@ -1151,7 +1449,7 @@ def handle_train(message, bot, pool):
         utils.handle_language_not_set(message, bot)
         return
     
-    if len(db_model.get_full_vocab(pool, message.chat.id, language)) == 0:
+    if db_model.get_vocabulary_stats(pool, message.chat.id, language)["n_words"] == 0:
         bot.send_message(
             message.chat.id, texts.training_no_words, reply_markup=keyboards.empty
         )
@@ -1295,33 +1593,31 @@ def process_choose_hints(message, bot, pool):
         group_name = data.get("group_name")
         init_message = data["init_message"]
 
-    db_model.init_training_session(
-        pool,
-        message.chat.id,
-        session_id,
-        strategy,
-        language,
-        direction,
-        duration,
-        hints,
-    )
-    if strategy != "group":
-        db_model.create_training_session(
-            pool, message.chat.id, session_id, strategy, language, direction, duration
-        )
-    else:
-        db_model.create_group_training_session(
-            pool,
+    with db_model.Batch(pool) as batch:
+        batch.init_training_session(
             message.chat.id,
             session_id,
             strategy,
             language,
             direction,
             duration,
-            group_id,
+            hints,
         )
-
-    words = db_model.get_training_words(pool, message.chat.id, session_id)
+        if strategy != "group":
+            words = batch.create_training_session(
+                message.chat.id, session_id, strategy, language, direction, duration
+            )
+        else:
+            words = batch.create_group_training_session(
+                message.chat.id,
+                session_id,
+                strategy,
+                language,
+                direction,
+                duration,
+                group_id,
+            )
+    words = words.value
 
     if len(words) == 0:
         bot.delete_state(message.from_user.id, message.chat.id)
@@ -1352,9 +1648,10 @@ def process_choose_hints(message, bot, pool):
 
     bot.set_state(message.from_user.id, states.TrainState.train, message.chat.id)
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        data["words"] = words
+        # the words stay in the database, they are read one by one by their index
+        data["n_words"] = len(words)
         data["step"] = 0
-        data["scores"] = []
+        data["scores"] = 0  # bit i is set if the answer for word i + 1 is correct
 
     handle_train_step(message, bot, pool)
 
@@ -1370,8 +1667,9 @@ def handle_train_step_stop(message, bot, pool):
 @logged_execution
 def handle_train_step(message, bot, pool):
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        word_utils.upgrade_train_state(data)
         step = data["step"]
-        words = data["words"]
+        n_words = data["n_words"]
         scores = data["scores"]
         hints = data["hints"]
         direction = data["direction"]
@@ -1379,38 +1677,41 @@ def handle_train_step(message, bot, pool):
         language = data["language"]
 
     logger.debug(
-        f"step: {step}, words: {words}, scores: {scores}, hints: {hints}, direction: {direction}"
+        "step: %s, n_words: %s, scores: %s, hints: %s, direction: %s",
+        step,
+        n_words,
+        scores,
+        hints,
+        direction,
     )
 
+    # the answered word and the next one are read in one query, along with
+    # the words the wrong options of the test hints are chosen among
+    candidates = None
+    with db_model.Batch(pool) as batch:
+        words = batch.get_training_words_by_idx(
+            message.chat.id, session_id, common.get_train_step_word_idxs(step, n_words)
+        )
+        if hints == "test" and step < n_words:
+            candidates = batch.get_random_words(message.chat.id, language)
+    words = {word["word_idx"]: word for word in words.value}
+    candidates = () if candidates is None else candidates.value
+
     if step != 0:  # not a first iteration
-        word = words[step - 1]
-        is_correct = word_utils.compare_user_input_with_db(
-            message.text, word, hints, direction
+        is_correct, reply = common.check_train_answer(
+            message.text, words[step], hints, direction
         )
-        scores.append(int(is_correct))
-        if is_correct:
-            bot.send_message(
-                message.chat.id,
-                texts.train_correct_answer,
-                reply_markup=keyboards.empty,
-            )
-        else:
-            bot.send_message(
-                message.chat.id,
-                texts.train_wrong_answer.format(
-                    word_utils.get_translation(word, direction)
-                ),
-                reply_markup=keyboards.empty,
-            )
+        scores |= int(is_correct) << (step - 1)
+        bot.send_message(message.chat.id, reply, reply_markup=keyboards.empty)
 
-    if step == len(words):  # training complete
+    if step == n_words:  # training complete
         if hints == "no hints":
             db_model.set_training_scores(
                 pool,
                 message.chat.id,
                 session_id,
-                list(range(1, len(words) + 1)),
-                scores,
+                list(range(1, n_words + 1)),
+                word_utils.get_scores_from_bitmap(scores, n_words),
             )
             db_model.update_final_scores(
                 pool, message.chat.id, session_id, language, direction
@@ -1419,35 +1720,18 @@ def handle_train_step(message, bot, pool):
             bot.send_message(message.chat.id, texts.training_no_scores)
         bot.delete_state(message.from_user.id, message.chat.id)
 
-        reaction = None
-        for score, current_reaction in sorted(
-            options.train_reactions.items(), key=lambda x: x[0]
-        ):
-            if sum(scores) / len(words) >= score:
-                reaction = current_reaction
-
         bot.send_message(
             message.chat.id,
-            texts.training_results.format(sum(scores), len(words), reaction),
+            common.format_training_results(scores, n_words),
             reply_markup=keyboards.empty,
         )
         return
 
-    next_word = words[step]
-    hint_words = word_utils.sample_hints(next_word, words, 3)
+    text, markup = common.format_train_step(
+        words[step + 1], hints, direction, candidates
+    )
     bot.send_message(
-        message.chat.id,
-        word_utils.format_train_message(
-            word_utils.get_word(next_word, direction),
-            word_utils.get_translation(next_word, direction),
-            hints,
-        ),
-        reply_markup=keyboards.format_train_buttons(
-            word_utils.get_translation(next_word, direction),
-            [word_utils.get_translation(hint, direction) for hint in hint_words],
-            hints,
-        ),
-        parse_mode="MarkdownV2",
+        message.chat.id, text, reply_markup=markup, parse_mode="MarkdownV2"
     )
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
         data["step"] += 1
@@ -0,0 +1,127 @@
+import csv
+import html
+import io
+import json
+import re
+
+# a row of the file: word, translations, anything after them is ignored
+DELIMITERS = ["\t", "=", ";", ","]
+# e.g. '#separator:tab', only the lines at the top of the file are headers
+ANKI_HEADER = re.compile(r"#\w+:")
+HTML_TAG = re.compile(r"<[^>]+>")
+
+
+class LineError:
+    def __init__(self, line_number, line, reason):
+        self.line_number = line_number
+        self.line = line
+        self.reason = reason
+
+    def __str__(self):
+        return "line {}: {} ({})".format(self.line_number, self.reason, self.line)
+
+
+def decode(content):
+    """
+    Decodes the whole uploaded file before anything is saved, so that
+    a file in another encoding is rejected instead of half imported.
+    Raises UnicodeDecodeError.
+    """
+    return content.decode("utf-8-sig")
+
+
+def read_lines(text):
+    """
+    Yields the non-empty lines. Anki text exports start with '#key:value'
+    header lines, they are skipped; any other line starting with '#' is a word.
+    """
+    is_header = True
+    for line_number, line in enumerate(io.StringIO(text, newline=None), 1):
+        line = line.rstrip("\n")
+        is_header = is_header and ANKI_HEADER.match(line) is not None
+        if line.strip() == "" or is_header:
+            continue
+        yield line_number, line
+
+
+def detect_delimiter(line):
+    # the first delimiter found in the first line is used for the whole file
+    for delimiter in DELIMITERS:
+        if delimiter in line:
+            return delimiter
+    return None
+
+
+def split_lines(lines):
+    """
+    CSV/TSV/Anki rows and the `word = translation` format of /add_words.
+    Yields (line_number, line, fields).
+    """
+    delimiter = None
+    for line_number, line in lines:
+        if delimiter is None:
+            delimiter = detect_delimiter(line)
+        if delimiter is None or delimiter == "=":
+            fields = line.split("=") if delimiter else [line]
+        else:
+            fields = next(csv.reader([line], delimiter=delimiter))
+        yield line_number, line, fields
+
+
+def clean_field(field):
+    # Anki exports may contain html
+    return html.unescape(HTML_TAG.sub(" ", field)).strip().lower()
+
+
+def validate(rows, errors):
+    """
+    Yields (line_number, line, word, translations json) and appends
+    a LineError for every bad row.
+    """
+    for line_number, line, fields in rows:
+        if len(fields) < 2:
+            errors.append(LineError(line_number, line, "no translation"))
+            continue
+
+        word = clean_field(fields[0])
+        translations = [t.strip() for t in clean_field(fields[1]).split("/")]
+        translations = [t for t in translations if len(t) > 0]
+        if len(word) == 0:
+            errors.append(LineError(line_number, line, "empty word"))
+            continue
+        if len(translations) == 0:
+            errors.append(LineError(line_number, line, "empty translation"))
+            continue
+
+        yield line_number, line, word, json.dumps(translations)
+
+
+def deduplicate(entries, errors):
+    seen = set()
+    for line_number, line, word, translation in entries:
+        if word in seen:
+            errors.append(LineError(line_number, line, "duplicate word"))
+            continue
+        seen.add(word)
+        yield word, translation
+
+
+def batched(entries, batch_size):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def parse_import_file(content, batch_size, errors):
+    """
+    The whole pipeline: yields batches of (word, translation) pairs ready
+    to be saved, parsing errors are appended to `errors` on the go.
+    Raises UnicodeDecodeError right away if the file is not in UTF-8.
+    """
+    rows = split_lines(read_lines(decode(content)))
+    return batched(deduplicate(validate(rows, errors), errors), batch_size)
@@ -0,0 +1,111 @@
+from telebot import TeleBot, util
+from telebot.handler_backends import State
+
+# a handler without a state or a command filter
+ANY = object()
+# the filters resolved by the table rather than by TeleBot
+INDEXED_FILTERS = ("state", "commands")
+
+
+def get_state_keys(filter_value):
+    if filter_value is None or filter_value == "*":
+        return [ANY]
+    values = filter_value if isinstance(filter_value, list) else [filter_value]
+    return [value.name if isinstance(value, State) else value for value in values]
+
+
+def get_command_keys(filter_value):
+    return [ANY] if filter_value is None else list(filter_value)
+
+
+class HandlerTable:
+    """
+    Message handlers indexed by (state, command). The candidates for a pair are
+    the handlers registered for it, for its state with any command, for its
+    command in any state and for anything, in the order of registration:
+    the first one whose other filters pass wins, as with a linear scan.
+    """
+
+    def __init__(self, handlers):
+        self.buckets = {}
+        self.commands = set()
+        for priority, handler in enumerate(handlers):
+            filters = handler["filters"]
+            for state in get_state_keys(filters.get("state")):
+                for command in get_command_keys(filters.get("commands")):
+                    self.commands.add(command)
+                    self.buckets.setdefault((state, command), []).append(
+                        (priority, handler)
+                    )
+        self.candidates = {}
+
+    def get_candidates(self, state, command):
+        # any text may look like a command, the unknown ones share an entry
+        if command not in self.commands:
+            command = None
+        key = (state, command)
+        if key not in self.candidates:
+            pairs = set([(state, command), (state, ANY), (ANY, command), (ANY, ANY)])
+            self.candidates[key] = [
+                handler
+                for _, handler in sorted(
+                    (entry for pair in pairs for entry in self.buckets.get(pair, [])),
+                    key=lambda entry: entry[0],
+                )
+            ]
+        return self.candidates[key]
+
+
+class StateIndexedTeleBot(TeleBot):
+    """
+    TeleBot that reads the chat state once per message and picks the handler
+    from a HandlerTable, instead of testing every handler with StateFilter,
+    which reads the state again for each one.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.handler_table = None
+
+    def add_message_handler(self, handler_dict):
+        super().add_message_handler(handler_dict)
+        self.handler_table = None  # rebuilt on the next message
+
+    def get_state_of(self, message):
+        chat_id, user_id = message.chat.id, message.from_user.id
+        # keeps the argument order of custom_filters.StateFilter for groups
+        if message.chat.type == "group":
+            return self.current_states.get_state(user_id, chat_id)
+        return self.current_states.get_state(chat_id, user_id)
+
+    def find_handler(self, message):
+        if self.handler_table is None:
+            self.handler_table = HandlerTable(self.message_handlers)
+
+        state = self.get_state_of(message)
+        command = None
+        if message.content_type == "text":
+            command = util.extract_command(message.text)
+
+        for handler in self.handler_table.get_candidates(state, command):
+            if all(
+                self._test_filter(message_filter, filter_value, message)
+                for message_filter, filter_value in handler["filters"].items()
+                if message_filter not in INDEXED_FILTERS
+            ):
+                return handler
+        return None
+
+    def _notify_command_handlers(self, handlers, new_messages, update_type):
+        if update_type != "message" or self.use_class_middlewares:
+            return super()._notify_command_handlers(handlers, new_messages, update_type)
+
+        for message in new_messages:
+            handler = self.find_handler(message)
+            if handler is not None:
+                self._exec_task(
+                    handler["function"],
+                    message,
+                    pass_bot=handler["pass_bot"],
+                    task_type="handler",
+                )
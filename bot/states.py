@@ -1,7 +1,12 @@
+import copy
+import threading
+from contextlib import contextmanager
+
 from telebot.handler_backends import State, StatesGroup
 from telebot.storage.base_storage import StateContext, StateStorageBase
 
 import database.model as db_model
+import metrics
 from logs import logger
 
 # https://github.com/eternnoir/pyTelegramBotAPI/blob/0f52ca688ffb7af6176d2f73fca92335dc3560eb/telebot/handler_backends.py#L163
@@ -18,78 +23,137 @@ from logs import logger
 class StateYDBStorage(StateStorageBase):
     """
     This class is for YDB storage to be used by the bot to track user states.
+
+    Inside `unit_of_work()` every chat's state is read from YDB once, all changes
+    are kept in memory and written back with one query per chat when the block
+    exits. Outside of it every call goes to YDB directly.
+
+    A write is dropped if another update of the chat has saved the state since
+    it was read: the conflict is logged, not retried, and the user isn't told,
+    so the state of the other update wins and the user may have to repeat
+    the last step.
     """
 
     def __init__(self, ydb_pool):
         super().__init__()
         self.pool = ydb_pool
+        self.local = threading.local()
+
+    @contextmanager
+    def unit_of_work(self):
+        self.local.entries = {}
+        try:
+            yield
+        finally:
+            entries, self.local.entries = self.local.entries, None
+            self.flush(entries)
+
+    def flush(self, entries):
+        for chat_id, entry in entries.items():
+            if not entry["is_changed"]:
+                continue
+
+            try:
+                metrics.count("state.writes")
+                db_model.set_state_if_version(
+                    self.pool, chat_id, entry["state"], entry["version"]
+                )
+            except db_model.StateConflictError:
+                # another update for this chat has been saved since we read the state
+                logger.error(
+                    f"Lost state update for chat_id {chat_id}: "
+                    f"state was changed by a concurrent update"
+                )
+
+    def read_state(self, chat_id):
+        entries = getattr(self.local, "entries", None)
+        if entries is None:
+            metrics.count("state.reads")
+            return db_model.get_state(self.pool, chat_id)
+
+        if chat_id not in entries:
+            metrics.count("state.reads")
+            state, version = db_model.get_state_with_version(self.pool, chat_id)
+            entries[chat_id] = {"state": state, "version": version, "is_changed": False}
+        return entries[chat_id]["state"]
+
+    def write_state(self, chat_id, full_state):
+        entries = getattr(self.local, "entries", None)
+        if entries is None:
+            metrics.count("state.writes")
+            if full_state is None:
+                db_model.clear_state(self.pool, chat_id)
+            else:
+                db_model.set_state(self.pool, chat_id, full_state)
+            return
+
+        self.read_state(chat_id)  # the version has to be known before writing
+        entries[chat_id]["state"] = full_state
+        entries[chat_id]["is_changed"] = True
 
     def set_data(self, chat_id, user_id, key, value):
         """
         Set data for a user in a particular chat.
         """
-        if db_model.get_state(self.pool, chat_id) is None:
+        full_state = self.read_state(chat_id)
+        if full_state is None:
             return False
 
-        full_state = db_model.get_state(self.pool, chat_id)
-        data = full_state["data"]
-        data[key] = value
-        full_state["data"] = data
-
-        db_model.set_state(self.pool, chat_id, full_state)
+        full_state = copy.deepcopy(full_state)
+        full_state["data"][key] = value
+        self.write_state(chat_id, full_state)
         return True
 
     def get_data(self, chat_id, user_id):
         """
         Get data for a user in a particular chat.
         """
-        full_state = db_model.get_state(self.pool, chat_id)
+        full_state = self.read_state(chat_id)
         if full_state:
             return full_state.get("data", {})
 
         return {}
 
     def set_state(self, chat_id, user_id, state):
-        logger.debug(f"SET STATE chat_id: {chat_id}, state: {state}")
+        logger.debug("SET STATE chat_id: %s, state: %s", chat_id, state)
         if hasattr(state, "name"):
             state = state.name
 
-        data = self.get_data(chat_id, user_id)
+        data = copy.deepcopy(self.get_data(chat_id, user_id))
         full_state = {"state": state, "data": data}
-        db_model.set_state(self.pool, chat_id, full_state)
+        self.write_state(chat_id, full_state)
         return True
 
     def delete_state(self, chat_id, user_id):
         """
         Delete state for a particular user.
         """
-        if db_model.get_state(self.pool, chat_id) is None:
+        if self.read_state(chat_id) is None:
             return False
 
-        db_model.clear_state(self.pool, chat_id)
+        self.write_state(chat_id, None)
         return True
 
     def reset_data(self, chat_id, user_id):
         """
         Reset data for a particular user in a chat.
         """
-        full_state = db_model.get_state(self.pool, chat_id)
+        full_state = self.read_state(chat_id)
         if full_state:
-            full_state["data"] = {}
-            db_model.set_state(self.pool, chat_id, full_state)
+            self.write_state(chat_id, {"state": full_state.get("state"), "data": {}})
             return True
         return False
 
     def get_state(self, chat_id, user_id):
-        logger.debug(f"GET STATE chat_id: {chat_id}")
-        states = db_model.get_state(self.pool, chat_id)
-        logger.debug("states: {}".format(states))
+        logger.debug("GET STATE chat_id: %s", chat_id)
+        states = self.read_state(chat_id)
+        logger.debug("states: %s", states)
         if states is None:
             return None
         logger.debug(
-            "GET STATE FINISH {}, type {}".format(
-                states.get("state"), type(states.get("state"))
-            )
+            "GET STATE FINISH %s, type %s",
+            states.get("state"),
+            type(states.get("state")),
         )
         return states.get("state")
 
@@ -97,10 +161,11 @@ class StateYDBStorage(StateStorageBase):
         return StateContext(self, chat_id, user_id)
 
     def save(self, chat_id, user_id, data):
-        full_state = db_model.get_state(self.pool, chat_id)
+        full_state = self.read_state(chat_id)
         if full_state:
-            full_state["data"] = data
-            db_model.set_state(self.pool, chat_id, full_state)
+            self.write_state(
+                chat_id, {"state": full_state.get("state"), "data": copy.deepcopy(data)}
+            )
             return False
 
 
@@ -126,6 +191,15 @@ class AddWordsState(StatesGroup):
     add_words_together = State()
 
 
+class ImportWordsState(StatesGroup):
+    wait_file = State()
+
+
+class ExportWordsState(StatesGroup):
+    choose_format = State()
+    choose_group = State()
+
+
 class ShowWordsState(StatesGroup):
     choose_sort = State()
     show_words = State()
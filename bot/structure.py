@@ -1,11 +1,14 @@
 import os
 from functools import partial
 
-from telebot import TeleBot, custom_filters
+from telebot import custom_filters
 
+import metrics
 import tests.handlers as test_handlers
+from bot import dispatcher
 from bot import handlers as handlers
 from bot import states as bot_states
+from bot.routing import StateIndexedTeleBot
 
 
 class Handler:
@@ -108,6 +111,48 @@ def get_add_words_handlers():
     ]
 
 
+def get_import_handlers():
+    return [
+        Handler(handlers.handle_import, commands=["import"]),
+        Handler(
+            handlers.process_cancel,
+            commands=["cancel"],
+            state=bot_states.ImportWordsState.wait_file,
+        ),
+        Handler(
+            handlers.process_import_file,
+            content_types=["document"],
+            state=bot_states.ImportWordsState.wait_file,
+        ),
+        Handler(
+            handlers.process_import_not_a_file,
+            state=bot_states.ImportWordsState.wait_file,
+        ),
+    ]
+
+
+def get_export_handlers():
+    return [
+        Handler(handlers.handle_export, commands=["export"]),
+        Handler(
+            handlers.process_cancel,
+            commands=["cancel"],
+            state=[
+                bot_states.ExportWordsState.choose_format,
+                bot_states.ExportWordsState.choose_group,
+            ],
+        ),
+        Handler(
+            handlers.process_choose_export_format,
+            state=bot_states.ExportWordsState.choose_format,
+        ),
+        Handler(
+            handlers.process_choose_export_group,
+            state=bot_states.ExportWordsState.choose_group,
+        ),
+    ]
+
+
 def get_show_words_handlers():
     return [
         Handler(handlers.handle_show_words, commands=["show_words"]),
@@ -243,17 +288,17 @@ def get_group_add_words_handlers():
             state=bot_states.AddGroupWordsState.choose_words,
         ),
         Handler(
-            handlers.process_save_group_edit,
+            handlers.process_save_words_to_add_to_group,
             commands=["exit"],
             state=bot_states.AddGroupWordsState.choose_words,
         ),
         Handler(
-            handlers.process_choose_words_batch_for_group_next,
+            handlers.process_choose_words_to_add_to_group_next,
             commands=["next"],
             state=bot_states.AddGroupWordsState.choose_words,
         ),
         Handler(
-            handlers.process_choose_words_batch_for_group,
+            handlers.process_choose_words_to_add_to_group,
             state=bot_states.AddGroupWordsState.choose_words,
         ),
     ]
@@ -374,10 +419,8 @@ def get_unknown_handler():
     ]
 
 
-def create_bot(bot_token, pool):
-    state_storage = bot_states.StateYDBStorage(pool)
-    bot = TeleBot(bot_token, state_storage=state_storage)
-
+def get_handlers():
+    # in the order of priority: the first matching handler processes the message
     handlers = []
 
     if os.getenv("IS_TESTING") is not None:
@@ -389,6 +432,8 @@ def create_bot(bot_token, pool):
     handlers.extend(get_forget_me_handlers())
     handlers.extend(get_set_language_handlers())
     handlers.extend(get_add_words_handlers())
+    handlers.extend(get_import_handlers())
+    handlers.extend(get_export_handlers())
     handlers.extend(get_show_words_handlers())
     handlers.extend(get_show_languages_handlers())
     handlers.extend(get_delete_language_handlers())
@@ -401,10 +446,23 @@ def create_bot(bot_token, pool):
     handlers.extend(get_train_handlers())
 
     handlers.extend(get_unknown_handler())
+    return handlers
+
+
+def create_bot(bot_token, pool):
+    dispatcher.install()
+    state_storage = bot_states.StateYDBStorage(pool)
+    # not threaded: the update has to be fully processed before the invocation
+    # returns, otherwise a bot reused by a warm instance may be frozen mid-handler
+    bot = StateIndexedTeleBot(bot_token, state_storage=state_storage, threaded=False)
 
-    for handler in handlers:
+    for handler in get_handlers():
         bot.register_message_handler(
-            partial(handler.callback, pool=pool), **handler.kwargs, pass_bot=True
+            metrics.timed_handler(
+                partial(handler.callback, pool=pool), handler.callback.__name__
+            ),
+            **handler.kwargs,
+            pass_bot=True,
         )
 
     bot.add_custom_filter(custom_filters.StateFilter(bot))
@@ -4,6 +4,7 @@ import emojis
 
 import database.model as db_model
 from bot import keyboards
+from bot.dispatcher import dispatcher
 from logs import logged_execution
 from user_interaction import texts
 
@@ -37,7 +38,7 @@ def suggest_group_choices(message, bot, pool, next_state):
     return bot.send_message(message.chat.id, texts.group_choose, reply_markup=markup)
 
 
-@logged_execution
+@logged_execution(sample_rate=0.0)
 def get_number_of_batches(batch_size, total_number):
     n_batches = total_number // batch_size
     if total_number % batch_size > 0:
@@ -45,7 +46,7 @@ def get_number_of_batches(batch_size, total_number):
     return n_batches
 
 
-@logged_execution
+@logged_execution(sample_rate=0.0)
 def check_language_name(name):
     return (  # emoji
         len(emojis.get(name)) == 1
@@ -56,7 +57,7 @@ def check_language_name(name):
     ) is not None
 
 
-@logged_execution
+@logged_execution(sample_rate=0.0)
 def check_group_name(name):
     return re.fullmatch("[0-9a-z_]+", name) is not None
 
@@ -74,5 +75,4 @@ def save_words_edit_to_group(pool, chat_id, language, group_id, words, action):
 
 @logged_execution
 def clear_history(bot, chat_id, from_message_id, to_message_id):
-    for message_id in range(from_message_id, to_message_id):
-        bot.delete_message(chat_id, message_id)
+    dispatcher.delete_messages(bot, chat_id, range(from_message_id, to_message_id))
@@ -0,0 +1,159 @@
+"""
+Async counterparts of the database.model functions used by bot.async_handlers
+and bot.async_states. Queries and result parsing are shared with database.model.
+"""
+
+import asyncio
+import json
+
+import ydb
+
+import database.model as db_model
+import database.queries as queries
+from database.async_utils import execute_read_query, execute_update_query
+from database.command_log import command_log
+from database.utils import ONLINE
+from database.vocab_cache import vocab_cache
+
+
+async def get_state_with_version(pool, chat_id):
+    results = await execute_read_query(
+        pool, queries.get_user_state, ONLINE, chat_id=chat_id
+    )
+    if len(results) == 0:
+        return None, 0
+
+    version = results[0]["version"] or 0
+    if results[0]["state"] is None:
+        return None, version
+    return json.loads(results[0]["state"]), version
+
+
+async def get_state(pool, chat_id):
+    return (await get_state_with_version(pool, chat_id))[0]
+
+
+async def set_state(pool, chat_id, state):
+    await execute_update_query(
+        pool, queries.set_user_state, chat_id=chat_id, state=json.dumps(state)
+    )
+
+
+async def clear_state(pool, chat_id):
+    await execute_update_query(
+        pool, queries.set_user_state, chat_id=chat_id, state=None
+    )
+
+
+async def set_state_if_version(pool, chat_id, state, version):
+    try:
+        await execute_update_query(
+            pool,
+            queries.set_user_state_if_version,
+            chat_id=chat_id,
+            state=None if state is None else json.dumps(state),
+            version=version,
+        )
+    except ydb.Error as e:
+        if queries.STATE_CONFLICT_MESSAGE in str(e):
+            raise db_model.StateConflictError(str(e)) from e
+        raise
+
+
+async def log_command(pool, chat_id, command):
+    # the buffer is written by the sync pool given to command_log.set_pool
+    if command_log.append(None, chat_id, db_model.get_current_time(), command):
+        await asyncio.to_thread(command_log.flush)
+
+
+async def get_current_language(pool, chat_id):
+    result = await execute_read_query(
+        pool, queries.get_current_language, ONLINE, chat_id=chat_id
+    )
+    return db_model.parse_current_language(result)
+
+
+async def get_available_languages(pool, chat_id):
+    result = await execute_read_query(
+        pool, queries.get_available_languages, ONLINE, chat_id=chat_id
+    )
+    return db_model.parse_available_languages(result)
+
+
+async def get_vocabulary_stats(pool, chat_id, language):
+    result = await execute_read_query(
+        pool,
+        queries.get_vocabulary_stats,
+        chat_id=chat_id,
+        language=language.encode(),
+    )
+    return db_model.parse_vocabulary_stats(result)
+
+
+async def get_all_vocabulary_stats(pool, chat_id):
+    result = await execute_read_query(
+        pool, queries.get_all_vocabulary_stats, chat_id=chat_id
+    )
+    return db_model.parse_all_vocabulary_stats(result)
+
+
+async def get_vocab_page(
+    pool, chat_id, language, sorting, cursor, limit, group_id=None
+):
+    cursor_key, cursor_word = (None, None) if cursor is None else cursor
+    return await execute_read_query(
+        pool,
+        queries.get_vocab_page[sorting],
+        chat_id=chat_id,
+        language=language.encode(),
+        group_id=None if group_id is None else group_id.encode(),
+        cursor_key=cursor_key,
+        cursor_word=cursor_word,
+        limit=limit,
+    )
+
+
+async def get_training_words_by_idx(pool, chat_id, session_id, word_idxs):
+    return await execute_read_query(
+        pool,
+        queries.get_training_words_by_idx,
+        chat_id=chat_id,
+        session_id=session_id,
+        word_idxs=word_idxs,
+    )
+
+
+async def get_random_words(
+    pool, chat_id, language, limit=db_model.DISTRACTOR_CANDIDATES_NUMBER
+):
+    return await execute_read_query(
+        pool,
+        queries.get_random_words,
+        chat_id=chat_id,
+        language=language.encode(),
+        random_start=db_model.get_random_start(),
+        limit=limit,
+    )
+
+
+async def set_training_scores(pool, chat_id, session_id, word_idxs, scores):
+    await execute_update_query(
+        pool,
+        queries.set_training_scores,
+        chat_id=chat_id,
+        session_id=session_id,
+        word_idxs=word_idxs,
+        scores=scores,
+    )
+
+
+async def update_final_scores(pool, chat_id, session_id, language, direction):
+    with vocab_cache.invalidating(chat_id, language):
+        await execute_update_query(
+            pool,
+            queries.update_final_scores,
+            chat_id=chat_id,
+            session_id=session_id,
+            language=language.encode(),
+            direction=direction.encode(),
+        )
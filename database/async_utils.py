@@ -0,0 +1,60 @@
+"""
+Async counterparts of database.utils for ydb.aio session pools.
+"""
+
+import ydb
+
+import metrics
+from database.utils import (
+    READ_TX_MODES,
+    SERIALIZABLE,
+    SNAPSHOT,
+    format_kwargs,
+    merge_queries,
+    prepared_queries,
+)
+
+
+async def execute_update_query(pool, query, **kwargs):
+    async def callee(session):
+        with prepared_queries.session_scope(session):
+            prepared_query = await prepared_queries.prepare_async(session, query)
+            await session.transaction(ydb.SerializableReadWrite()).execute(
+                prepared_query, format_kwargs(kwargs), commit_tx=True
+            )
+
+    with metrics.track("ydb"):
+        return await pool.retry_operation(callee)
+
+
+async def execute_read_query(pool, query, tx_mode=SNAPSHOT, **kwargs):
+    async def callee(session):
+        with prepared_queries.session_scope(session):
+            prepared_query = await prepared_queries.prepare_async(session, query)
+            result_sets = await session.transaction(READ_TX_MODES[tx_mode]()).execute(
+                prepared_query, format_kwargs(kwargs), commit_tx=True
+            )
+        return result_sets[0].rows
+
+    with metrics.track("ydb"):
+        return await pool.retry_operation(callee)
+
+
+async def execute_select_query(pool, query, **kwargs):
+    return await execute_read_query(pool, query, SERIALIZABLE, **kwargs)
+
+
+async def execute_batch(pool, queries_with_kwargs, is_read_only=False):
+    query, parameters = merge_queries(queries_with_kwargs)
+    tx_mode = ydb.SnapshotReadOnly if is_read_only else ydb.SerializableReadWrite
+
+    async def callee(session):
+        with prepared_queries.session_scope(session):
+            prepared_query = await prepared_queries.prepare_async(session, query)
+            result_sets = await session.transaction(tx_mode()).execute(
+                prepared_query, format_kwargs(parameters), commit_tx=True
+            )
+        return [result_set.rows for result_set in result_sets]
+
+    with metrics.track("ydb"):
+        return await pool.retry_operation(callee)
@@ -0,0 +1,98 @@
+import atexit
+import threading
+import time
+
+import database.queries as queries
+from database.utils import execute_update_query
+from logs import logger
+
+MAX_BUFFER_SIZE = 1000
+FLUSH_SIZE = 100
+FLUSH_AGE_S = 30
+
+
+class CommandLogBuffer:
+    """
+    Keeps command log rows in memory and writes them with a single query.
+    The buffer is flushed after every update by index.handler, when it gets
+    FLUSH_SIZE rows or its oldest row is FLUSH_AGE_S old, and on exit.
+    Rows that don't fit into the buffer are dropped and counted.
+    """
+
+    def __init__(
+        self, max_size=MAX_BUFFER_SIZE, flush_size=FLUSH_SIZE, flush_age_s=FLUSH_AGE_S
+    ):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_age_s = flush_age_s
+        self.lock = threading.Lock()
+        self.pool = None
+        self.rows = []
+        self.oldest_row_time = None
+        self.n_flushed = 0
+        self.n_dropped = 0
+
+    def add(self, pool, chat_id, timestamp, command):
+        if self.append(pool, chat_id, timestamp, command):
+            self.flush()
+
+    def append(self, pool, chat_id, timestamp, command):
+        """
+        Buffers the row, returns whether the buffer has to be flushed.
+        The asyncio mode flushes it in a thread, with the pool set by set_pool.
+        """
+        with self.lock:
+            if pool is not None:
+                self.pool = pool
+            if len(self.rows) >= self.max_size:
+                self.n_dropped += 1
+                return False
+
+            if len(self.rows) == 0:
+                self.oldest_row_time = time.monotonic()
+            self.rows.append(
+                {"chat_id": chat_id, "timestamp": timestamp, "command": command}
+            )
+            should_flush = (
+                len(self.rows) >= self.flush_size
+                or time.monotonic() - self.oldest_row_time >= self.flush_age_s
+            )
+        return should_flush
+
+    def set_pool(self, pool):
+        with self.lock:
+            self.pool = pool
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+            pool = self.pool
+
+        if len(rows) == 0:
+            return
+
+        try:
+            execute_update_query(pool, queries.log_commands, rows=rows)
+        except Exception as e:
+            logger.error(f"Failed to flush {len(rows)} command log rows: {e}")
+            with self.lock:  # keep them for the next flush, as many as fit
+                n_kept = max(self.max_size - len(self.rows), 0)
+                self.n_dropped += max(len(rows) - n_kept, 0)
+                self.rows = rows[:n_kept] + self.rows
+                self.oldest_row_time = time.monotonic()
+            return
+
+        with self.lock:
+            self.n_flushed += len(rows)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "buffered": len(self.rows),
+                "flushed": self.n_flushed,
+                "dropped": self.n_dropped,
+            }
+
+
+command_log = CommandLogBuffer()
+atexit.register(command_log.flush)
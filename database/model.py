@@ -1,24 +1,50 @@
 import datetime
 import json
+import random
+
+import ydb
 
 import database.queries as queries
-from database.utils import execute_select_query, execute_update_query
+from database.command_log import command_log
+from database.utils import (
+    ONLINE,
+    SERIALIZABLE,
+    execute_batch,
+    execute_read_query,
+    execute_scan_query,
+    execute_update_query,
+)
+from database.vocab_cache import VocabEntry, vocab_cache
 
 WORDS_UPDATE_BUCKET_SIZE = 20
+# words of an imported file are written in fewer, larger transactions
+WORDS_IMPORT_BUCKET_SIZE = 1000
 GROUPS_UPDATE_BUCKET_SIZE = 20
+# the wrong options of a test hint are chosen among this many random words
+DISTRACTOR_CANDIDATES_NUMBER = 100
 
 
 def get_current_time():
     return int(datetime.datetime.timestamp(datetime.datetime.now()))
 
 
-def get_state(pool, chat_id):
-    results = execute_select_query(pool, queries.get_user_state, chat_id=chat_id)
+class StateConflictError(Exception):
+    pass
+
+
+def get_state_with_version(pool, chat_id):
+    results = execute_read_query(pool, queries.get_user_state, ONLINE, chat_id=chat_id)
     if len(results) == 0:
-        return None
+        return None, 0
+
+    version = results[0]["version"] or 0
     if results[0]["state"] is None:
-        return None
-    return json.loads(results[0]["state"])
+        return None, version
+    return json.loads(results[0]["state"]), version
+
+
+def get_state(pool, chat_id):
+    return get_state_with_version(pool, chat_id)[0]
 
 
 def set_state(pool, chat_id, state):
@@ -31,15 +57,45 @@ def clear_state(pool, chat_id):
     execute_update_query(pool, queries.set_user_state, chat_id=chat_id, state=None)
 
 
+def set_state_if_version(pool, chat_id, state, version):
+    """
+    Saves the state only if nobody has saved it since `version` was read,
+    raises StateConflictError otherwise. The caller decides what to do with
+    the conflict, the state storages drop the write.
+    """
+    try:
+        execute_update_query(
+            pool,
+            queries.set_user_state_if_version,
+            chat_id=chat_id,
+            state=None if state is None else json.dumps(state),
+            version=version,
+        )
+    except ydb.Error as e:
+        if queries.STATE_CONFLICT_MESSAGE in str(e):
+            raise StateConflictError(str(e)) from e
+        raise
+
+
 def create_user(pool, chat_id):
     execute_update_query(pool, queries.create_user, chat_id=chat_id)
 
 
 def get_user_info(pool, chat_id):
-    return execute_select_query(pool, queries.get_user_info, chat_id=chat_id)
+    # decides whether the user has to be created
+    return execute_read_query(
+        pool, queries.get_user_info, SERIALIZABLE, chat_id=chat_id
+    )
 
 
-def update_vocab(pool, chat_id, language, words, translations):
+def update_vocab(
+    pool,
+    chat_id,
+    language,
+    words,
+    translations,
+    bucket_size=WORDS_UPDATE_BUCKET_SIZE,
+):
     assert len(words) == len(
         translations
     ), "words and translations should have the same length. len(words) = {}, len(translations) = {}".format(
@@ -47,58 +103,183 @@ def update_vocab(pool, chat_id, language, words, translations):
     )
     added_timestamp = get_current_time()
 
-    for i in range(0, len(words), WORDS_UPDATE_BUCKET_SIZE):
-        execute_update_query(
-            pool,
-            queries.bulk_update_words,
-            chat_id=chat_id,
-            language=language.encode(),
-            words=words[i : i + WORDS_UPDATE_BUCKET_SIZE],
-            translations=translations[i : i + WORDS_UPDATE_BUCKET_SIZE],
-            added_timestamp=added_timestamp,
-        )
+    with vocab_cache.invalidating(chat_id, language):
+        for i in range(0, len(words), bucket_size):
+            execute_update_query(
+                pool,
+                queries.bulk_update_words,
+                chat_id=chat_id,
+                language=language.encode(),
+                words=words[i : i + bucket_size],
+                translations=translations[i : i + bucket_size],
+                added_timestamp=added_timestamp,
+            )
+
+
+def add_new_words(
+    pool,
+    chat_id,
+    language,
+    words,
+    translations,
+    bucket_size=WORDS_IMPORT_BUCKET_SIZE,
+):
+    """
+    Adds the words that aren't in the vocabulary yet, the others keep their
+    translations and training history. Returns the words that were skipped.
+    """
+    added_timestamp = get_current_time()
+    existing_words = []
+
+    with vocab_cache.invalidating(chat_id, language):
+        for i in range(0, len(words), bucket_size):
+            bucket_words = words[i : i + bucket_size]
+            existing_words.extend(
+                row["word"]
+                for row in get_words_from_vocab(pool, chat_id, language, bucket_words)
+            )
+            execute_update_query(
+                pool,
+                queries.bulk_add_new_words,
+                chat_id=chat_id,
+                language=language.encode(),
+                words=bucket_words,
+                translations=translations[i : i + bucket_size],
+                added_timestamp=added_timestamp,
+            )
+    return existing_words
 
 
 def delete_user(pool, chat_id):
-    execute_update_query(pool, queries.delete_user, chat_id=chat_id)
+    with vocab_cache.invalidating(chat_id):
+        execute_update_query(pool, queries.delete_user, chat_id=chat_id)
 
 
 def delete_language(pool, chat_id, language):
-    execute_update_query(
-        pool, queries.delete_language, chat_id=chat_id, language=language.encode()
-    )
+    with vocab_cache.invalidating(chat_id, language):
+        execute_update_query(
+            pool, queries.delete_language, chat_id=chat_id, language=language.encode()
+        )
 
 
 def get_user_vocabs(pool, chat_id):
-    return execute_select_query(pool, queries.get_user_vocabs, chat_id=chat_id)
+    return execute_read_query(pool, queries.get_user_vocabs, chat_id=chat_id)
 
 
 def get_full_vocab(pool, chat_id, language):
-    return execute_select_query(
+    """
+    Returns a tuple of VocabEntry, served from the in-process cache when possible.
+    """
+    key = (chat_id, language)
+    snapshot = vocab_cache.get(key)
+    if snapshot is not None:
+        return snapshot
+
+    version = vocab_cache.get_version(key)
+    rows = execute_read_query(
         pool, queries.get_full_vocab, chat_id=chat_id, language=language.encode()
     )
+    snapshot = tuple(VocabEntry(row) for row in rows)
+    vocab_cache.put(key, version, snapshot)
+    return snapshot
 
 
-def get_words_from_vocab(pool, chat_id, language, words):
-    return execute_select_query(
+def count_vocab_words(pool, chat_id, language, group_id=None):
+    results = execute_read_query(
         pool,
-        queries.get_words_from_vocab,
+        queries.count_vocab_words,
         chat_id=chat_id,
         language=language.encode(),
-        words=words,
+        group_id=None if group_id is None else group_id.encode(),
+    )
+    return results[0]["n_words"]
+
+
+def get_vocab_page(pool, chat_id, language, sorting, cursor, limit, group_id=None):
+    """
+    Returns up to `limit` words in `sorting` order (a key of
+    queries.VOCAB_SORTINGS) that go after `cursor`, a [sort_key, word] pair
+    of the last shown word or None for the first page.
+    Every row has `score`, `n_trains` and `sort_key`.
+    """
+    cursor_key, cursor_word = (None, None) if cursor is None else cursor
+    return execute_read_query(
+        pool,
+        queries.get_vocab_page[sorting],
+        chat_id=chat_id,
+        language=language.encode(),
+        group_id=None if group_id is None else group_id.encode(),
+        cursor_key=cursor_key,
+        cursor_word=cursor_word,
+        limit=limit,
     )
 
 
-def delete_words_from_vocab(pool, chat_id, language, words):
-    execute_update_query(
+def export_vocab(pool, chat_id, language, group_id=None):
+    # a generator of rows, the vocabulary is never loaded as a whole
+    return execute_scan_query(
         pool,
-        queries.delete_words_from_vocab,
+        queries.export_vocab,
+        {
+            "chat_id": ydb.PrimitiveType.Int64,
+            "language": ydb.PrimitiveType.String,
+            "group_id": ydb.OptionalType(ydb.PrimitiveType.String),
+        },
+        chat_id=chat_id,
+        language=language.encode(),
+        group_id=None if group_id is None else group_id.encode(),
+    )
+
+
+def get_vocabulary_stats(pool, chat_id, language):
+    result = execute_read_query(
+        pool,
+        queries.get_vocabulary_stats,
+        chat_id=chat_id,
+        language=language.encode(),
+    )
+    return parse_vocabulary_stats(result)
+
+
+def parse_vocabulary_stats(result):
+    # a language that never had words has no stats row
+    if len(result) == 0:
+        return {column: 0 for column in queries.VOCABULARY_STATS_COLUMNS}
+    return {
+        column: result[0][column] or 0 for column in queries.VOCABULARY_STATS_COLUMNS
+    }
+
+
+def get_all_vocabulary_stats(pool, chat_id):
+    result = execute_read_query(pool, queries.get_all_vocabulary_stats, chat_id=chat_id)
+    return parse_all_vocabulary_stats(result)
+
+
+def parse_all_vocabulary_stats(result):
+    return {row["language"].decode(): parse_vocabulary_stats([row]) for row in result}
+
+
+def get_words_from_vocab(pool, chat_id, language, words):
+    return execute_read_query(
+        pool,
+        queries.get_words_from_vocab,
         chat_id=chat_id,
         language=language.encode(),
         words=words,
     )
 
 
+def delete_words_from_vocab(pool, chat_id, language, words):
+    with vocab_cache.invalidating(chat_id, language):
+        execute_update_query(
+            pool,
+            queries.delete_words_from_vocab,
+            chat_id=chat_id,
+            language=language.encode(),
+            words=words,
+        )
+
+
 def update_current_lang(pool, chat_id, language):
     execute_update_query(
         pool, queries.update_current_lang, chat_id=chat_id, language=language.encode()
@@ -106,9 +287,13 @@ def update_current_lang(pool, chat_id, language):
 
 
 def get_available_languages(pool, chat_id):
-    result = execute_select_query(
-        pool, queries.get_available_languages, chat_id=chat_id
+    result = execute_read_query(
+        pool, queries.get_available_languages, ONLINE, chat_id=chat_id
     )
+    return parse_available_languages(result)
+
+
+def parse_available_languages(result):
     return [row["language"].decode() for row in result]
 
 
@@ -119,7 +304,13 @@ def user_add_language(pool, chat_id, language):
 
 
 def get_current_language(pool, chat_id):
-    result = execute_select_query(pool, queries.get_current_language, chat_id=chat_id)
+    result = execute_read_query(
+        pool, queries.get_current_language, ONLINE, chat_id=chat_id
+    )
+    return parse_current_language(result)
+
+
+def parse_current_language(result):
     if len(result) != 1:
         return None
 
@@ -146,23 +337,36 @@ def init_training_session(
 
 
 def get_session_info(pool, chat_id, session_id):
-    return execute_select_query(
+    return execute_read_query(
         pool, queries.get_session_info, chat_id=chat_id, session_id=session_id
     )
 
 
+def get_random_start():
+    # a point of the random key index where sampling of the session words starts
+    return random.getrandbits(64)
+
+
+def get_training_session_query(strategy):
+    # "due" words come from the next review index, the others are sampled randomly
+    if strategy == "due":
+        return queries.create_due_training_session
+    return queries.create_training_session
+
+
 def create_training_session(
     pool, chat_id, session_id, strategy, language, direction, duration
 ):
     execute_update_query(
         pool,
-        queries.create_training_session,
+        get_training_session_query(strategy),
         chat_id=chat_id,
         session_id=session_id,
         strategy=strategy.encode(),
         language=language.encode(),
         direction=direction.encode(),
         duration=duration,
+        random_start=get_random_start(),
     )
 
 
@@ -183,37 +387,62 @@ def create_group_training_session(
 
 
 def get_training_words(pool, chat_id, session_id):
-    return execute_select_query(
+    return execute_read_query(
         pool, queries.get_training_words, chat_id=chat_id, session_id=session_id
     )
 
 
-def set_training_scores(pool, chat_id, session_id, word_idxs, scores):
-    execute_update_query(
+def get_training_words_by_idx(pool, chat_id, session_id, word_idxs):
+    # point reads by the primary key of the session words
+    return execute_read_query(
         pool,
-        queries.set_training_scores,
+        queries.get_training_words_by_idx,
         chat_id=chat_id,
         session_id=session_id,
         word_idxs=word_idxs,
-        scores=scores,
     )
 
 
-def update_final_scores(pool, chat_id, session_id, language, direction):
+def get_random_words(pool, chat_id, language, limit=DISTRACTOR_CANDIDATES_NUMBER):
+    return execute_read_query(
+        pool,
+        queries.get_random_words,
+        chat_id=chat_id,
+        language=language.encode(),
+        random_start=get_random_start(),
+        limit=limit,
+    )
+
+
+def set_training_scores(pool, chat_id, session_id, word_idxs, scores):
     execute_update_query(
         pool,
-        queries.update_final_scores,
+        queries.set_training_scores,
         chat_id=chat_id,
         session_id=session_id,
-        language=language.encode(),
-        direction=direction.encode(),
+        word_idxs=word_idxs,
+        scores=scores,
     )
 
 
+def update_final_scores(pool, chat_id, session_id, language, direction):
+    with vocab_cache.invalidating(chat_id, language):
+        execute_update_query(
+            pool,
+            queries.update_final_scores,
+            chat_id=chat_id,
+            session_id=session_id,
+            language=language.encode(),
+            direction=direction.encode(),
+        )
+
+
 def get_group_by_name(pool, chat_id, language, group_name):
-    return execute_select_query(
+    # checked for name collisions before a group is added
+    return execute_read_query(
         pool,
         queries.get_group_by_name,
+        SERIALIZABLE,
         chat_id=chat_id,
         language=language.encode(),
         group_name=group_name.encode(),
@@ -237,17 +466,49 @@ def delete_group(pool, group_id):
 
 
 def get_all_groups(pool, chat_id, language):
-    return execute_select_query(
+    return execute_read_query(
         pool, queries.get_all_groups, chat_id=chat_id, language=language.encode()
     )
 
 
 def get_group_contents(pool, group_id):
-    return execute_select_query(
+    return execute_read_query(
         pool, queries.get_group_contents, group_id=group_id.encode()
     )
 
 
+def count_group_candidates(pool, chat_id, language, group_id):
+    results = execute_read_query(
+        pool,
+        queries.count_group_candidates,
+        chat_id=chat_id,
+        language=language.encode(),
+        group_id=group_id.encode(),
+    )
+    return results[0]["n_words"]
+
+
+def get_group_candidates_page(
+    pool, chat_id, language, group_id, sorting, cursor, limit
+):
+    """
+    Returns up to `limit` words that are not in the group, in `sorting` order
+    (a key of queries.GROUP_CANDIDATES_SORTINGS) after `cursor`, as in
+    get_vocab_page.
+    """
+    cursor_key, cursor_word = (None, None) if cursor is None else cursor
+    return execute_read_query(
+        pool,
+        queries.get_group_candidates_page[sorting],
+        chat_id=chat_id,
+        language=language.encode(),
+        group_id=group_id.encode(),
+        cursor_key=cursor_key,
+        cursor_word=cursor_word,
+        limit=limit,
+    )
+
+
 def add_words_to_group(pool, chat_id, language, group_id, words):
     words_list = list(words)
     for i in range(0, len(words_list), GROUPS_UPDATE_BUCKET_SIZE):
@@ -275,16 +536,173 @@ def delete_words_from_group(pool, chat_id, language, group_id, words):
 
 
 def log_command(pool, chat_id, command):
-    timestamp = get_current_time()
-    execute_update_query(
-        pool,
-        queries.log_command,
-        chat_id=chat_id,
-        timestamp=timestamp,
-        command=command,
-    )
+    # buffered, written to the database after the update is processed
+    command_log.add(pool, chat_id, get_current_time(), command)
 
 
 def truncate_tables(pool):
-    for query in queries.truncate_tables_queries:
-        execute_update_query(pool, query)
+    try:
+        for query in queries.truncate_tables_queries:
+            execute_update_query(pool, query)
+    finally:
+        vocab_cache.clear()
+
+
+class BatchResult:
+    def __init__(self, parse=None):
+        self.parse = parse
+        self.is_ready = False
+        self.result = None
+
+    def set_rows(self, rows):
+        self.result = rows if self.parse is None else self.parse(rows)
+        self.is_ready = True
+
+    @property
+    def value(self):
+        assert self.is_ready, "the batch has not been executed yet"
+        return self.result
+
+
+class Batch:
+    """
+    Queues several operations and runs them as one multi-statement query
+    in a single transaction:
+
+        with db_model.Batch(pool) as batch:
+            languages = batch.get_available_languages(chat_id)
+            current_language = batch.get_current_language(chat_id)
+        print(languages.value, current_language.value)
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.queries = []
+        self.results = []
+        self.is_read_only = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.execute()
+
+    def add(self, query, has_result=False, is_read_only=False, parse=None, **kwargs):
+        self.queries.append((query, kwargs))
+        self.results.append(BatchResult(parse) if has_result else None)
+        self.is_read_only = self.is_read_only and is_read_only
+        return self.results[-1]
+
+    def execute(self):
+        if len(self.queries) == 0:
+            return
+
+        result_sets = iter(execute_batch(self.pool, self.queries, self.is_read_only))
+        for result in self.results:
+            if result is not None:
+                result.set_rows(next(result_sets))
+
+        self.queries, self.results, self.is_read_only = [], [], True
+
+    def get_current_language(self, chat_id):
+        return self.add(
+            queries.get_current_language,
+            has_result=True,
+            is_read_only=True,
+            parse=parse_current_language,
+            chat_id=chat_id,
+        )
+
+    def get_available_languages(self, chat_id):
+        return self.add(
+            queries.get_available_languages,
+            has_result=True,
+            is_read_only=True,
+            parse=parse_available_languages,
+            chat_id=chat_id,
+        )
+
+    def get_all_vocabulary_stats(self, chat_id):
+        return self.add(
+            queries.get_all_vocabulary_stats,
+            has_result=True,
+            is_read_only=True,
+            parse=parse_all_vocabulary_stats,
+            chat_id=chat_id,
+        )
+
+    def user_add_language(self, chat_id, language):
+        self.add(queries.user_add_language, chat_id=chat_id, language=language.encode())
+
+    def update_current_lang(self, chat_id, language):
+        self.add(
+            queries.update_current_lang, chat_id=chat_id, language=language.encode()
+        )
+
+    def init_training_session(
+        self, chat_id, session_id, strategy, language, direction, duration, hints
+    ):
+        self.add(
+            queries.init_training_session,
+            chat_id=chat_id,
+            session_id=session_id,
+            strategy=strategy.encode(),
+            language=language.encode(),
+            direction=direction.encode(),
+            duration=duration,
+            hints=hints.encode(),
+        )
+
+    def create_training_session(
+        self, chat_id, session_id, strategy, language, direction, duration
+    ):
+        # returns the words of the session
+        return self.add(
+            get_training_session_query(strategy),
+            has_result=True,
+            chat_id=chat_id,
+            session_id=session_id,
+            strategy=strategy.encode(),
+            language=language.encode(),
+            direction=direction.encode(),
+            duration=duration,
+            random_start=get_random_start(),
+        )
+
+    def get_training_words_by_idx(self, chat_id, session_id, word_idxs):
+        return self.add(
+            queries.get_training_words_by_idx,
+            has_result=True,
+            is_read_only=True,
+            chat_id=chat_id,
+            session_id=session_id,
+            word_idxs=word_idxs,
+        )
+
+    def get_random_words(self, chat_id, language, limit=DISTRACTOR_CANDIDATES_NUMBER):
+        return self.add(
+            queries.get_random_words,
+            has_result=True,
+            is_read_only=True,
+            chat_id=chat_id,
+            language=language.encode(),
+            random_start=get_random_start(),
+            limit=limit,
+        )
+
+    def create_group_training_session(
+        self, chat_id, session_id, strategy, language, direction, duration, group_id
+    ):
+        # returns the words of the session
+        return self.add(
+            queries.create_group_training_session,
+            has_result=True,
+            chat_id=chat_id,
+            session_id=session_id,
+            strategy=strategy.encode(),
+            language=language.encode(),
+            direction=direction.encode(),
+            duration=duration,
+            group_id=group_id.encode(),
+        )
@@ -6,6 +6,20 @@ LANGUAGES_TABLE_PATH = "languages"
 TRAINING_SESSIONS_TABLE_PATH = "training_sessions"
 TRAINING_SESSIONS_INFO_TABLE_PATH = "training_session_info"
 STATES_TABLE_PATH = "user_states"
+VOCABULARY_STATS_TABLE_PATH = "vocabulary_stats"
+
+VOCABS_RANDOM_INDEX = "vocabularies_random_idx"
+VOCABS_REVIEW_INDEX = "vocabularies_review_idx"
+VOCABS_ADDED_INDEX = "vocabularies_added_idx"
+VOCABS_SCORE_INDEX = "vocabularies_score_idx"
+VOCABS_N_TRAINS_INDEX = "vocabularies_n_trains_idx"
+
+# SM-2 spaced repetition parameters, a correct answer has quality 4 and a wrong one 1
+SM2_DEFAULT_EASINESS = 2.5
+SM2_MIN_EASINESS = 1.3
+SM2_EASINESS_DELTA_CORRECT = 0.0
+SM2_EASINESS_DELTA_WRONG = -0.54
+SECONDS_IN_DAY = 86400
 
 
 # Manage tables queries
@@ -24,9 +38,73 @@ truncate_tables_queries = [
         TRAINING_SESSIONS_TABLE_PATH,
         TRAINING_SESSIONS_INFO_TABLE_PATH,
         STATES_TABLE_PATH,
+        VOCABULARY_STATS_TABLE_PATH,
     ]
 ]
 
+VOCABULARY_STATS_COLUMNS = [
+    "n_words",
+    "n_trained_words",
+    "score_from_sum",
+    "score_to_sum",
+    "n_trains_from_sum",
+    "n_trains_to_sum",
+]
+
+
+def aggregate_vocabulary_stats(rows):
+    # the stats columns of a set of vocabulary rows, a single row even if the set is empty
+    return f"""(
+        SELECT
+            COUNT(DISTINCT word) AS n_words,
+            COUNT_IF(
+                n_trains_from IS NOT NULL OR n_trains_to IS NOT NULL
+            ) AS n_trained_words,
+            NVL(SUM(score_from), 0ul) AS score_from_sum,
+            NVL(SUM(score_to), 0ul) AS score_to_sum,
+            NVL(SUM(n_trains_from), 0ul) AS n_trains_from_sum,
+            NVL(SUM(n_trains_to), 0ul) AS n_trains_to_sum,
+        FROM {rows}
+    )"""
+
+
+def update_vocabulary_stats(added_rows=None, removed_rows=None):
+    """
+    Adds the stats of `added_rows` to the stats of ($chat_id, $language)
+    and subtracts the stats of `removed_rows`. The rows have to be read before
+    the vocabulary is modified, so the statement goes first in a query.
+    The sums are computed in Int64 and clamped at zero: without a stats row,
+    e.g. for a language that is older than the table and wasn't filled in,
+    the subtraction would wrap around Uint64.
+    """
+    empty_rows = f"(SELECT * FROM `{VOCABS_TABLE_PATH}` WHERE false)"
+    columns = "\n        ".join(
+        f"CAST(MAX_OF(CAST(s.{column} AS Int64) + CAST(added.{column} AS Int64)"
+        f" - CAST(removed.{column} AS Int64), 0l) AS Uint64) AS {column},"
+        for column in VOCABULARY_STATS_COLUMNS
+    )
+    current = ",\n            ".join(
+        f"NVL(MAX({column}), 0ul) AS {column}" for column in VOCABULARY_STATS_COLUMNS
+    )
+    return f"""
+    UPSERT INTO `{VOCABULARY_STATS_TABLE_PATH}`
+    SELECT
+        $chat_id AS chat_id,
+        CAST($language AS String) AS language,
+        {columns}
+    FROM (
+        SELECT
+            {current}
+        FROM `{VOCABULARY_STATS_TABLE_PATH}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+    ) AS s
+    CROSS JOIN {aggregate_vocabulary_stats(added_rows or empty_rows)} AS added
+    CROSS JOIN {aggregate_vocabulary_stats(removed_rows or empty_rows)} AS removed;
+"""
+
+
 # Data manipulation queries
 create_user = f"""
     DECLARE $chat_id AS Int64;
@@ -44,7 +122,7 @@ get_user_info = f"""
 get_user_state = f"""
     DECLARE $chat_id AS Int64;
 
-    SELECT state
+    SELECT state, version
     FROM `{STATES_TABLE_PATH}`
     WHERE chat_id == $chat_id;
 """
@@ -53,8 +131,34 @@ set_user_state = f"""
     DECLARE $chat_id AS Int64;
     DECLARE $state AS Utf8?;
 
-    UPSERT INTO `{STATES_TABLE_PATH}` (`chat_id`, `state`) VALUES
-        ($chat_id, $state);
+    UPSERT INTO `{STATES_TABLE_PATH}`
+    SELECT
+        $chat_id AS chat_id,
+        $state AS state,
+        NVL(MAX(version), 0) + 1 AS version,
+    FROM `{STATES_TABLE_PATH}`
+    WHERE chat_id == $chat_id;
+"""
+
+STATE_CONFLICT_MESSAGE = "user state was changed by a concurrent update"
+
+set_user_state_if_version = f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $state AS Utf8?;
+    DECLARE $version AS Uint64;
+
+    $current_version = (
+        SELECT NVL(MAX(version), 0) AS version
+        FROM `{STATES_TABLE_PATH}`
+        WHERE chat_id == $chat_id
+    );
+
+    DISCARD SELECT
+        Ensure(version, version == $version, "{STATE_CONFLICT_MESSAGE}")
+    FROM $current_version;
+
+    UPSERT INTO `{STATES_TABLE_PATH}` (`chat_id`, `state`, `version`) VALUES
+        ($chat_id, $state, $version + 1);
 """
 
 delete_user = f"""
@@ -71,6 +175,9 @@ delete_user = f"""
     DELETE FROM `{VOCABS_TABLE_PATH}`
     WHERE chat_id == $chat_id;
 
+    DELETE FROM `{VOCABULARY_STATS_TABLE_PATH}`
+    WHERE chat_id == $chat_id;
+
     DELETE FROM `{USERS_TABLE_PATH}`
     WHERE chat_id == $chat_id;
 
@@ -121,6 +228,11 @@ delete_language = f"""
     WHERE
         chat_id == $chat_id
         AND language == $language;
+
+    DELETE FROM `{VOCABULARY_STATS_TABLE_PATH}`
+    WHERE
+        chat_id == $chat_id
+        AND language == $language;
         
     UPDATE `{USERS_TABLE_PATH}`
     SET current_lang = NULL
@@ -183,6 +295,262 @@ get_full_vocab = f"""
         AND language == $language
 """
 
+# (sort key expression, its type, is descending) for vocabulary listings,
+# words without a score go last in both directions
+VOCAB_SORTINGS = {
+    "word_asc": ("word", "Utf8", False),
+    "word_desc": ("word", "Utf8", True),
+    "score_desc": ("NVL(score, -1.0)", "Double", True),
+    "score_asc": ("NVL(score, 2.0)", "Double", False),
+    "n_trains_desc": ("n_trains", "Uint64", True),
+    "n_trains_asc": ("n_trains", "Uint64", False),
+    "added_timestamp_desc": ("added_timestamp", "Uint64", True),
+    "added_timestamp_asc": ("added_timestamp", "Uint64", False),
+}
+
+
+# The sort keys are columns, kept up to date by the queries that change the
+# words: a page is a range read of the primary key or of an index that starts
+# after the cursor and stops after $limit rows.
+# sort key -> (column, index, the sort key of the words where the column is NULL)
+INDEXED_SORT_KEYS = {
+    "word": ("word", None, None),
+    "added_timestamp": ("added_timestamp", VOCABS_ADDED_INDEX, None),
+    "n_trains": ("n_trains", VOCABS_N_TRAINS_INDEX, None),
+    "NVL(score, -1.0)": ("score", VOCABS_SCORE_INDEX, "-1.0"),
+    "NVL(score, 2.0)": ("score", VOCABS_SCORE_INDEX, "2.0"),
+}
+
+# the sort key columns of a vocabulary row, computed from its scores
+WORD_SCORE = (
+    "(NVL($score_from, $score_to) + NVL($score_to, $score_from)) / 2.0".replace(
+        "$score_from", "CAST(score_from AS Double) / CAST(n_trains_from AS Double)"
+    ).replace("$score_to", "CAST(score_to AS Double) / CAST(n_trains_to AS Double)")
+)
+WORD_N_TRAINS = "NVL(n_trains_from, 0) + NVL(n_trains_to, 0)"
+
+
+def make_indexed_vocab_page_query(sort_key, sort_key_type, is_descending):
+    comparison = "<" if is_descending else ">"
+    order = "DESC" if is_descending else "ASC"
+    column, index, null_sort_key = INDEXED_SORT_KEYS[sort_key]
+    view = "" if index is None else f"VIEW `{index}`"
+    columns = """
+            word,
+            translation,
+            added_timestamp,
+            score,
+            n_trains,"""
+
+    pages = ["$with_key"]
+    without_key = ""
+    if null_sort_key is not None:
+        # the words without the column go after the others, in the order of words
+        pages.append("$without_key")
+        without_key = f"""
+    $without_key = (
+        SELECT{columns}
+            {null_sort_key} AS sort_key,
+            1 AS part,
+        FROM `{VOCABS_TABLE_PATH}` {view}
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND {column} IS NULL
+            AND (
+                $cursor_word IS NULL
+                OR $cursor_key != {null_sort_key}
+                OR word {comparison} $cursor_word
+            )
+            AND ($group_id IS NULL OR word IN $group_words)
+        ORDER BY word {order}
+        LIMIT $limit
+    );
+"""
+
+    return f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $language AS String;
+    DECLARE $group_id AS String?;
+    DECLARE $cursor_key AS {sort_key_type}?;
+    DECLARE $cursor_word AS Utf8?;
+    DECLARE $limit AS Uint64;
+
+    $group_words = (
+        SELECT word
+        FROM `{GROUPS_CONTENTS_TABLE_PATH}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND group_id == $group_id
+    );
+
+    $with_key = (
+        SELECT{columns}
+            {column} AS sort_key,
+            0 AS part,
+        FROM `{VOCABS_TABLE_PATH}` {view}
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND {column} IS NOT NULL
+            AND ($cursor_word IS NULL OR {column} {comparison}= $cursor_key)
+            AND (
+                $cursor_word IS NULL
+                OR {column} != $cursor_key
+                OR word {comparison} $cursor_word
+            )
+            AND ($group_id IS NULL OR word IN $group_words)
+        ORDER BY
+            {column} {order},
+            word {order}
+        LIMIT $limit
+    );
+{without_key}
+    SELECT *
+    FROM ({" UNION ALL ".join(f"SELECT * FROM {page}" for page in pages)})
+    ORDER BY
+        part,
+        sort_key {order},
+        word {order}
+    LIMIT $limit;
+"""
+
+
+get_vocab_page = {
+    sorting: make_indexed_vocab_page_query(*params)
+    for sorting, params in VOCAB_SORTINGS.items()
+}
+
+count_vocab_words = f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $language AS String;
+    DECLARE $group_id AS String?;
+
+    $group_words = (
+        SELECT word
+        FROM `{GROUPS_CONTENTS_TABLE_PATH}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND group_id == $group_id
+    );
+
+    SELECT COUNT(*) AS n_words
+    FROM `{VOCABS_TABLE_PATH}`
+    WHERE
+        chat_id == $chat_id
+        AND language == $language
+        AND ($group_id IS NULL OR word IN $group_words);
+"""
+
+# (sort key column, its type, is descending) for the words to add to a group
+GROUP_CANDIDATES_SORTINGS = {
+    "translation_asc": ("translation", "Utf8", False),
+    "added_timestamp_desc": ("added_timestamp", "Uint64", True),
+}
+
+# the words of the vocabulary that are not in the group yet
+GROUP_CANDIDATES = f"""
+    $vocab = (
+        SELECT word, translation, added_timestamp
+        FROM `{VOCABS_TABLE_PATH}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+    );
+
+    $group_words = (
+        SELECT word
+        FROM `{GROUPS_CONTENTS_TABLE_PATH}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND group_id == $group_id
+    );
+
+    $candidates = (
+        SELECT vocab.*
+        FROM $vocab AS vocab
+        LEFT ONLY JOIN $group_words AS group_words
+        ON vocab.word == group_words.word
+    );
+"""
+
+count_group_candidates = f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $language AS String;
+    DECLARE $group_id AS String;
+    {GROUP_CANDIDATES}
+    SELECT COUNT(*) AS n_words FROM $candidates;
+"""
+
+
+def make_group_candidates_page_query(sort_key, sort_key_type, is_descending):
+    # keyset pagination, as in make_indexed_vocab_page_query; the candidates
+    # aren't a range of an index, every page sorts them
+    return f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $language AS String;
+    DECLARE $group_id AS String;
+    DECLARE $cursor_key AS {sort_key_type}?;
+    DECLARE $cursor_word AS Utf8?;
+    DECLARE $limit AS Uint64;
+    {GROUP_CANDIDATES}
+    SELECT *
+    FROM (
+        SELECT c.*, {sort_key} AS sort_key
+        FROM $candidates AS c
+    )
+    WHERE
+        $cursor_word IS NULL
+        OR sort_key {"<" if is_descending else ">"} $cursor_key
+        OR (
+            sort_key == $cursor_key
+            AND word {"<" if is_descending else ">"} $cursor_word
+        )
+    ORDER BY
+        sort_key {"DESC" if is_descending else "ASC"},
+        word {"DESC" if is_descending else "ASC"}
+    LIMIT $limit;
+"""
+
+
+get_group_candidates_page = {
+    sorting: make_group_candidates_page_query(*params)
+    for sorting, params in GROUP_CANDIDATES_SORTINGS.items()
+}
+
+# for a scan query, it streams the result
+export_vocab = f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $language AS String;
+    DECLARE $group_id AS String?;
+
+    $group_words = (
+        SELECT word
+        FROM `{GROUPS_CONTENTS_TABLE_PATH}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND group_id == $group_id
+    );
+
+    SELECT
+        word,
+        translation,
+        added_timestamp,
+        score_from,
+        score_to,
+        n_trains_from,
+        n_trains_to,
+    FROM `{VOCABS_TABLE_PATH}`
+    WHERE
+        chat_id == $chat_id
+        AND language == $language
+        AND ($group_id IS NULL OR word IN $group_words);
+"""
+
 get_words_from_vocab = f"""
     DECLARE $chat_id AS Int64;
     DECLARE $language AS String;
@@ -199,6 +567,17 @@ delete_words_from_vocab = f"""
     DECLARE $chat_id AS Int64;
     DECLARE $language AS String;
     DECLARE $words AS List<Utf8>;
+
+    $deleted_words = (
+        SELECT *
+        FROM `{VOCABS_TABLE_PATH}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND word IN $words
+    );
+
+    {update_vocabulary_stats(removed_rows="$deleted_words")}
      
     DELETE FROM `{VOCABS_TABLE_PATH}`
     WHERE
@@ -267,6 +646,22 @@ get_session_info = f"""
     WHERE chat_id == $chat_id AND session_id == $session_id
 """
 
+# words of the "new" and "bad" strategies, true for the others
+TRAINING_STRATEGY_FILTER = """CASE
+                WHEN $strategy == "new" AND $direction == "to"
+                    THEN NVL(n_trains_to, 0) <= 2
+                WHEN $strategy == "new" AND $direction == "from"
+                    THEN NVL(n_trains_from, 0) <= 2
+                WHEN $strategy == "bad" AND $direction == "to"
+                    THEN n_trains_to >= 1 AND 1.0 * score_to / n_trains_to <= 0.7
+                WHEN $strategy == "bad" AND $direction == "from"
+                    THEN n_trains_from >= 1 AND 1.0 * score_from / n_trains_from <= 0.7
+                ELSE True
+            END"""
+
+# Words are sampled with a range read of the random key index: $duration words
+# starting from a random point, wrapping around to the beginning of the index.
+# The words added before the random key existed are taken after them.
 create_training_session = f"""
     DECLARE $chat_id AS Int64;
     DECLARE $session_id AS Uint64;
@@ -274,6 +669,61 @@ create_training_session = f"""
     DECLARE $direction AS String;
     DECLARE $duration AS Uint64;
     DECLARE $strategy AS String;
+    DECLARE $random_start AS Uint64;
+
+    $after_start = (
+        SELECT word, translation, random_key, 0 AS part,
+        FROM `{VOCABS_TABLE_PATH}` VIEW `{VOCABS_RANDOM_INDEX}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND random_key >= $random_start
+            AND {TRAINING_STRATEGY_FILTER}
+        ORDER BY random_key
+        LIMIT $duration
+    );
+
+    $before_start = (
+        SELECT word, translation, random_key, 1 AS part,
+        FROM `{VOCABS_TABLE_PATH}` VIEW `{VOCABS_RANDOM_INDEX}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND random_key < $random_start
+            AND {TRAINING_STRATEGY_FILTER}
+        ORDER BY random_key
+        LIMIT $duration
+    );
+
+    -- the words added before the random key existed come last
+    $without_key = (
+        SELECT word, translation, random_key, 2 AS part,
+        FROM `{VOCABS_TABLE_PATH}` VIEW `{VOCABS_RANDOM_INDEX}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND random_key IS NULL
+            AND {TRAINING_STRATEGY_FILTER}
+        LIMIT $duration
+    );
+
+    $selected_words = (
+        SELECT word, translation
+        FROM (
+            SELECT
+                word,
+                translation,
+                ROW_NUMBER() OVER (ORDER BY part, random_key) AS rank,
+            FROM (
+                SELECT * FROM $after_start
+                UNION ALL
+                SELECT * FROM $before_start
+                UNION ALL
+                SELECT * FROM $without_key
+            )
+        )
+        WHERE rank <= $duration
+    );
 
     $words_sample = (
         SELECT
@@ -282,29 +732,88 @@ create_training_session = f"""
             word,
             translation,
             ROW_NUMBER() OVER w AS word_idx,
-        FROM `{VOCABS_TABLE_PATH}`
+        FROM $selected_words
+        WINDOW w AS (
+            ORDER BY RandomNumber(CAST($session_id AS String) || word)
+        )
+    );
+
+    UPSERT INTO `{TRAINING_SESSIONS_TABLE_PATH}`
+    SELECT * FROM $words_sample;
+
+    SELECT * FROM $words_sample
+    ORDER BY word_idx;
+"""
+
+# The most overdue words first, then the words that have never been reviewed
+# in the order they were added, both read from the next review index.
+create_due_training_session = f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $session_id AS Uint64;
+    DECLARE $language AS Utf8;
+    DECLARE $direction AS String;
+    DECLARE $duration AS Uint64;
+    DECLARE $strategy AS String;
+    DECLARE $random_start AS Uint64;
+
+    $overdue = (
+        SELECT word, translation, next_review, added_timestamp, 0 AS part,
+        FROM `{VOCABS_TABLE_PATH}` VIEW `{VOCABS_REVIEW_INDEX}`
         WHERE
             chat_id == $chat_id
             AND language == $language
-            AND CASE
-                WHEN $strategy == "new" AND $direction == "to"
-                    THEN NVL(n_trains_to, 0) <= 2
-                WHEN $strategy == "new" AND $direction == "from"
-                    THEN NVL(n_trains_from, 0) <= 2
-                WHEN $strategy == "bad" AND $direction == "to"
-                    THEN n_trains_to >= 1 AND 1.0 * score_to / n_trains_to <= 0.7
-                WHEN $strategy == "bad" AND $direction == "from"
-                    THEN n_trains_from >= 1 AND 1.0 * score_from / n_trains_from <= 0.7
-                ELSE True
-            END
+            AND next_review <= $session_id
+        ORDER BY next_review
+        LIMIT $duration
+    );
+
+    $never_reviewed = (
+        SELECT word, translation, next_review, added_timestamp, 1 AS part,
+        FROM `{VOCABS_TABLE_PATH}` VIEW `{VOCABS_REVIEW_INDEX}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND next_review IS NULL
+        ORDER BY added_timestamp, word
+        LIMIT $duration
+    );
+
+    $selected_words = (
+        SELECT word, translation
+        FROM (
+            SELECT
+                word,
+                translation,
+                ROW_NUMBER() OVER (
+                    ORDER BY part, next_review, added_timestamp, word
+                ) AS rank,
+            FROM (
+                SELECT * FROM $overdue
+                UNION ALL
+                SELECT * FROM $never_reviewed
+            )
+        )
+        WHERE rank <= $duration
+    );
+
+    $words_sample = (
+        SELECT
+            CAST($chat_id AS Uint64) AS chat_id,
+            $session_id AS session_id,
+            word,
+            translation,
+            ROW_NUMBER() OVER w AS word_idx,
+        FROM $selected_words
         WINDOW w AS (
             ORDER BY RandomNumber(CAST($session_id AS String) || word)
         )
     );
 
     UPSERT INTO `{TRAINING_SESSIONS_TABLE_PATH}`
+    SELECT * FROM $words_sample;
+
     SELECT * FROM $words_sample
-    WHERE word_idx <= $duration;
+    ORDER BY word_idx;
 """
 
 create_group_training_session = f"""
@@ -336,6 +845,10 @@ create_group_training_session = f"""
     UPSERT INTO `{TRAINING_SESSIONS_TABLE_PATH}`
     SELECT * FROM $words_sample
     WHERE word_idx <= $duration;
+
+    SELECT * FROM $words_sample
+    WHERE word_idx <= $duration
+    ORDER BY word_idx;
 """
 
 get_training_words = f"""
@@ -349,6 +862,70 @@ get_training_words = f"""
     ORDER BY word_idx;
 """
 
+get_training_words_by_idx = f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $session_id AS Uint64;
+    DECLARE $word_idxs AS List<Uint64>;
+
+    SELECT * FROM `{TRAINING_SESSIONS_TABLE_PATH}`
+    WHERE
+        chat_id == CAST($chat_id AS Uint64)
+        AND session_id == $session_id
+        AND word_idx IN $word_idxs;
+"""
+
+# A sample of the vocabulary read from the random key index like the words of
+# a training session, the wrong options of the test hints are chosen from it.
+get_random_words = f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $language AS Utf8;
+    DECLARE $random_start AS Uint64;
+    DECLARE $limit AS Uint64;
+
+    $after_start = (
+        SELECT word, translation, random_key, 0 AS part,
+        FROM `{VOCABS_TABLE_PATH}` VIEW `{VOCABS_RANDOM_INDEX}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND random_key >= $random_start
+        ORDER BY random_key
+        LIMIT $limit
+    );
+
+    $before_start = (
+        SELECT word, translation, random_key, 1 AS part,
+        FROM `{VOCABS_TABLE_PATH}` VIEW `{VOCABS_RANDOM_INDEX}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND random_key < $random_start
+        ORDER BY random_key
+        LIMIT $limit
+    );
+
+    $without_key = (
+        SELECT word, translation, random_key, 2 AS part,
+        FROM `{VOCABS_TABLE_PATH}` VIEW `{VOCABS_RANDOM_INDEX}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND random_key IS NULL
+        LIMIT $limit
+    );
+
+    SELECT word, translation
+    FROM (
+        SELECT * FROM $after_start
+        UNION ALL
+        SELECT * FROM $before_start
+        UNION ALL
+        SELECT * FROM $without_key
+    )
+    ORDER BY part, random_key
+    LIMIT $limit;
+"""
+
 set_training_scores = f"""
     DECLARE $chat_id AS Int64;
     DECLARE $session_id AS Uint64;
@@ -395,6 +972,30 @@ update_final_scores = f"""
             AND session_id == $session_id
     );
 
+    -- SM-2: the next interval in days after an answer
+    $next_interval = ($is_correct, $repetitions, $interval_days, $easiness) -> (
+        CASE
+            WHEN NOT $is_correct OR $repetitions == 0 THEN 1ul
+            WHEN $repetitions == 1 THEN 6ul
+            ELSE CAST(Math::Round($interval_days * $easiness) AS Uint64)
+        END
+    );
+    $next_easiness = ($is_correct, $easiness) -> (
+        MAX_OF(
+            {SM2_MIN_EASINESS},
+            $easiness + IF($is_correct, {SM2_EASINESS_DELTA_CORRECT}, {SM2_EASINESS_DELTA_WRONG})
+        )
+    );
+
+    $old_scores = (
+        SELECT v.*
+        FROM `{VOCABS_TABLE_PATH}` AS v
+        INNER JOIN $current_words AS cw ON v.word == cw.word
+        WHERE
+            v.chat_id == $chat_id
+            AND v.language == $language
+    );
+
     $new_scores = (
         SELECT
             v.*,
@@ -404,13 +1005,31 @@ update_final_scores = f"""
             IF($direction == "from", NVL(v.n_trains_from, 0) + 1, v.n_trains_from) AS n_trains_from,
             IF($direction == "to", NVL(v.score_to, 0) + cw.score, v.score_to) AS score_to,
             IF($direction == "from", NVL(v.score_from, 0) + cw.score, v.score_from) AS score_from,
+            IF(NVL(cw.score, 0) > 0, NVL(v.repetitions, 0) + 1, 0ul) AS repetitions,
+            $next_interval(
+                NVL(cw.score, 0) > 0,
+                NVL(v.repetitions, 0),
+                NVL(v.interval_days, 1),
+                NVL(v.easiness, {SM2_DEFAULT_EASINESS})
+            ) AS interval_days,
+            $next_easiness(NVL(cw.score, 0) > 0, NVL(v.easiness, {SM2_DEFAULT_EASINESS})) AS easiness,
+            $session_id + {SECONDS_IN_DAY}ul * $next_interval(
+                NVL(cw.score, 0) > 0,
+                NVL(v.repetitions, 0),
+                NVL(v.interval_days, 1),
+                NVL(v.easiness, {SM2_DEFAULT_EASINESS})
+            ) AS next_review,
         WITHOUT
             v.last_train_from,
             v.last_train_to,
             v.n_trains_from,
             v.n_trains_to,
             v.score_from,
-            v.score_to
+            v.score_to,
+            v.repetitions,
+            v.interval_days,
+            v.easiness,
+            v.next_review
         FROM `{VOCABS_TABLE_PATH}` AS v
         INNER JOIN $current_words AS cw ON v.word == cw.word
         WHERE
@@ -418,8 +1037,20 @@ update_final_scores = f"""
             AND v.language == $language
     );
 
+    -- the sort keys of the vocabulary listings follow the new scores
+    $new_rows = (
+        SELECT
+            s.*,
+            {WORD_SCORE} AS score,
+            {WORD_N_TRAINS} AS n_trains,
+        WITHOUT s.score, s.n_trains
+        FROM $new_scores AS s
+    );
+
+    {update_vocabulary_stats(added_rows="$new_rows", removed_rows="$old_scores")}
+
     UPDATE `{VOCABS_TABLE_PATH}` ON
-    SELECT * FROM $new_scores;
+    SELECT * FROM $new_rows;
 
     UPDATE `{USERS_TABLE_PATH}`
     SET session_id = NULL
@@ -491,18 +1122,15 @@ get_group_contents = f"""
         group_contents.group_id == $group_id
 """
 
-bulk_update_words = f"""
-    DECLARE $chat_id AS Int64;
-    DECLARE $language AS String;
-    DECLARE $words AS List<Utf8>;
-    DECLARE $translations AS List<Utf8>;
-    DECLARE $added_timestamp AS Uint64;
-    
-    $update_table = (
+# The rows of the words $words with the translations $translations that are
+# added to the vocabulary, without any training history.
+NEW_VOCAB_ROWS = f"""
         SELECT
             t.*,
             t.word_info.0 AS word,
             t.word_info.1 AS translation,
+            -- sort key of the random sampling index
+            RandomNumber(t.word_info.0, $added_timestamp) AS random_key,
         WITHOUT t.word_info
         FROM (
             SELECT
@@ -514,12 +1142,71 @@ bulk_update_words = f"""
                 CAST(NULL AS Uint64?) AS score_to,
                 CAST(NULL AS Uint64?) AS n_trains_from,
                 CAST(NULL AS Uint64?) AS n_trains_to,
+                CAST(NULL AS Uint64?) AS repetitions,
+                CAST(NULL AS Uint64?) AS interval_days,
+                CAST(NULL AS Double?) AS easiness,
+                CAST(NULL AS Uint64?) AS next_review,
+                -- sort keys of the vocabulary listings
+                CAST(NULL AS Double?) AS score,
+                0ul AS n_trains,
                 $added_timestamp AS added_timestamp,
                 ListZip($words, $translations) AS word_info,
         ) AS t
         FLATTEN LIST BY word_info
+"""
+
+bulk_update_words = f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $language AS String;
+    DECLARE $words AS List<Utf8>;
+    DECLARE $translations AS List<Utf8>;
+    DECLARE $added_timestamp AS Uint64;
+    
+    $update_table = ({NEW_VOCAB_ROWS}    );
+
+    $overwritten_words = (
+        SELECT *
+        FROM `{VOCABS_TABLE_PATH}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND word IN $words
     );
 
+    {update_vocabulary_stats(added_rows="$update_table", removed_rows="$overwritten_words")}
+
+    UPSERT INTO `vocabularies`
+    SELECT * FROM $update_table;
+"""
+
+# Imported words that are already in the vocabulary keep their training history.
+bulk_add_new_words = f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $language AS String;
+    DECLARE $words AS List<Utf8>;
+    DECLARE $translations AS List<Utf8>;
+    DECLARE $added_timestamp AS Uint64;
+
+    $existing_words = (
+        SELECT word
+        FROM `{VOCABS_TABLE_PATH}`
+        WHERE
+            chat_id == $chat_id
+            AND language == $language
+            AND word IN $words
+    );
+
+    $new_rows = ({NEW_VOCAB_ROWS}    );
+
+    $update_table = (
+        SELECT new_rows.*
+        FROM $new_rows AS new_rows
+        LEFT ONLY JOIN $existing_words AS existing_words
+        USING (word)
+    );
+
+    {update_vocabulary_stats(added_rows="$update_table")}
+
     UPSERT INTO `vocabularies`
     SELECT * FROM $update_table;
 """
@@ -560,14 +1247,43 @@ bulk_update_group_delete = f"""
         AND word IN $words;
 """
 
-log_command = f"""
-    DECLARE $chat_id AS Int64;
-    DECLARE $timestamp AS Uint64;
-    DECLARE $command AS Utf8;
-    
+log_commands = f"""
+    DECLARE $rows AS List<Struct<
+        chat_id: Int64,
+        timestamp: Uint64,
+        command: Utf8
+    >>;
+
     UPSERT INTO `command_log`
-    SELECT
-        $chat_id AS chat_id,
-        $timestamp AS timestamp,
-        $command AS command;
+    SELECT chat_id, timestamp, command
+    FROM AS_TABLE($rows);
+"""
+
+
+get_vocabulary_stats = f"""
+    DECLARE $chat_id AS Int64;
+    DECLARE $language AS String;
+
+    SELECT *
+    FROM `{VOCABULARY_STATS_TABLE_PATH}`
+    WHERE
+        chat_id == $chat_id
+        AND language == $language;
+"""
+
+get_all_vocabulary_stats = f"""
+    DECLARE $chat_id AS Int64;
+
+    SELECT *
+    FROM `{VOCABULARY_STATS_TABLE_PATH}`
+    WHERE chat_id == $chat_id;
 """
+
+
+# run by almost every update, prepared as soon as a session is created
+HOT_QUERIES = [
+    get_user_state,
+    set_user_state_if_version,
+    get_current_language,
+    log_commands,
+]
@@ -0,0 +1,175 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import database.sqlite_queries as sqlite_queries
+import metrics
+from database.utils import StorageBackend
+from logs import logger
+
+POOL_SIZE = 8
+# how long a write waits for the lock held by another one
+BUSY_TIMEOUT_S = 5
+SCAN_PART_SIZE = 1000
+
+# kept between warm invocations of the serverless function
+_cached = {
+    "path": None,
+    "backend": None,
+}
+
+
+class ConnectionPool:
+    """
+    Up to `size` connections to a database file, opened on demand and reused.
+    In WAL mode readers see a snapshot and don't block the writer, which
+    holds the database lock only for the length of its transaction.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        # every connection to ":memory:" would open a database of its own
+        self.size = 1 if path == ":memory:" else size
+        self.semaphore = threading.BoundedSemaphore(self.size)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.n_opened = 0
+
+    def connect(self):
+        connection = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT_S,
+            isolation_level=None,  # transactions are started explicitly
+            check_same_thread=False,
+        )
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode = WAL")
+        # with WAL it stays consistent, only the last commits may be lost on power loss
+        connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    def acquire(self):
+        self.semaphore.acquire()
+        try:
+            with self.lock:
+                if self.idle:
+                    return self.idle.pop()
+            connection = self.connect()
+        except BaseException:
+            self.semaphore.release()
+            raise
+        with self.lock:
+            self.n_opened += 1
+        return connection
+
+    def release(self, connection):
+        with self.lock:
+            self.idle.append(connection)
+        self.semaphore.release()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    @contextmanager
+    def transaction(self, is_read_only):
+        with self.connection() as connection:
+            # a writer takes the lock upfront rather than failing to upgrade a read
+            connection.execute("BEGIN" if is_read_only else "BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def close(self):
+        with self.lock:
+            connections, self.idle = self.idle, []
+        for connection in connections:
+            connection.close()
+
+    def get_stats(self):
+        with self.lock:
+            return {"opened": self.n_opened, "idle": len(self.idle)}
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Runs the queries of database.queries on a local SQLite database, through
+    their implementations in database.sqlite_queries. The tables are created
+    if they don't exist.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.pool = ConnectionPool(path, pool_size)
+        self.create_tables()
+
+    def create_tables(self):
+        with self.pool.transaction(is_read_only=False) as connection:
+            for statement in sqlite_queries.SCHEMA:
+                connection.execute(statement)
+
+    def run(self, connection, query, kwargs):
+        implementation = sqlite_queries.IMPLEMENTATIONS.get(query)
+        if implementation is None:
+            raise NotImplementedError(
+                "The query has no SQLite implementation:\n{}".format(query)
+            )
+        return implementation(connection, **kwargs)
+
+    def execute_update_query(self, query, **kwargs):
+        with self.pool.transaction(is_read_only=False) as connection:
+            self.run(connection, query, kwargs)
+
+    def execute_read_query(self, query, tx_mode, **kwargs):
+        # any read transaction of a WAL database sees a consistent snapshot
+        with self.pool.transaction(is_read_only=True) as connection:
+            return self.run(connection, query, kwargs)
+
+    def execute_scan_query(self, query, parameters_types, **kwargs):
+        with self.pool.transaction(is_read_only=True) as connection:
+            cursor = connection.execute(sqlite_queries.SCAN_QUERIES[query], kwargs)
+            while True:
+                rows = cursor.fetchmany(SCAN_PART_SIZE)
+                if len(rows) == 0:
+                    return
+                metrics.count("sqlite.scan_parts")
+                yield from rows
+
+    def execute_batch(self, queries_with_kwargs, is_read_only):
+        result_sets = []
+        with self.pool.transaction(is_read_only) as connection:
+            for query, kwargs in queries_with_kwargs:
+                rows = self.run(connection, query, kwargs)
+                if rows is not None:
+                    result_sets.append(rows)
+        return result_sets
+
+    def close(self):
+        self.pool.close()
+
+    def get_stats(self):
+        return self.pool.get_stats()
+
+
+def get_cached_sqlite_backend(path):
+    """
+    Returns (backend, is_new), the backend is reused while the path is the same.
+    """
+    if _cached["backend"] is not None:
+        if _cached["path"] == path:
+            return _cached["backend"], False
+
+        logger.info("Rebuilding SQLite backend: the database path has changed")
+        _cached["backend"].close()
+
+    backend = SQLiteBackend(path)
+    _cached.update(path=path, backend=backend)
+    return backend, True
@@ -0,0 +1,1053 @@
+"""
+The queries of database.queries for the SQLite backend. Every YQL query is
+mapped to an implementation that runs it on a connection inside a transaction
+and returns its rows, or None if the query doesn't select anything.
+
+Column types follow the YDB tables: String columns are stored as BLOBs, so
+they are written and read as bytes like with YDB, and Utf8 ones as TEXT.
+List parameters are passed to the statements as JSON and read with json_each.
+"""
+
+import datetime
+import hashlib
+import json
+import math
+import zlib
+
+import database.queries as queries
+from database.model import StateConflictError
+
+VOCABS = queries.VOCABS_TABLE_PATH
+USERS = queries.USERS_TABLE_PATH
+GROUPS = queries.GROUPS_TABLE_PATH
+GROUP_CONTENTS = queries.GROUPS_CONTENTS_TABLE_PATH
+LANGUAGES = queries.LANGUAGES_TABLE_PATH
+SESSIONS = queries.TRAINING_SESSIONS_TABLE_PATH
+SESSIONS_INFO = queries.TRAINING_SESSIONS_INFO_TABLE_PATH
+STATES = queries.STATES_TABLE_PATH
+STATS = queries.VOCABULARY_STATS_TABLE_PATH
+COMMAND_LOG = "command_log"
+
+# Uint64 random keys of YDB don't fit into SQLite integers
+RANDOM_KEY_SHIFT = 1
+
+TABLES = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {USERS} (
+        chat_id INTEGER PRIMARY KEY,
+        current_lang BLOB,
+        session_id INTEGER,
+        state TEXT
+    )""",
+    f"""
+    CREATE TABLE IF NOT EXISTS {STATES} (
+        chat_id INTEGER PRIMARY KEY,
+        state TEXT,
+        version INTEGER
+    )""",
+    f"""
+    CREATE TABLE IF NOT EXISTS {LANGUAGES} (
+        chat_id INTEGER,
+        language BLOB,
+        PRIMARY KEY (chat_id, language)
+    ) WITHOUT ROWID""",
+    f"""
+    CREATE TABLE IF NOT EXISTS {VOCABS} (
+        chat_id INTEGER,
+        language BLOB,
+        word TEXT,
+        added_timestamp INTEGER,
+        last_train_from BLOB,
+        last_train_to BLOB,
+        n_trains_from INTEGER,
+        n_trains_to INTEGER,
+        score_from INTEGER,
+        score_to INTEGER,
+        translation TEXT,
+        random_key INTEGER,
+        repetitions INTEGER,
+        interval_days INTEGER,
+        easiness REAL,
+        next_review INTEGER,
+        score REAL,
+        n_trains INTEGER,
+        PRIMARY KEY (chat_id, language, word)
+    ) WITHOUT ROWID""",
+    f"""
+    CREATE TABLE IF NOT EXISTS {STATS} (
+        chat_id INTEGER,
+        language BLOB,
+        n_words INTEGER,
+        n_trained_words INTEGER,
+        score_from_sum INTEGER,
+        score_to_sum INTEGER,
+        n_trains_from_sum INTEGER,
+        n_trains_to_sum INTEGER,
+        PRIMARY KEY (chat_id, language)
+    ) WITHOUT ROWID""",
+    f"""
+    CREATE TABLE IF NOT EXISTS {GROUPS} (
+        chat_id INTEGER,
+        language BLOB,
+        group_id BLOB,
+        group_name BLOB,
+        is_creator INTEGER,
+        PRIMARY KEY (chat_id, language, group_id)
+    ) WITHOUT ROWID""",
+    f"""
+    CREATE TABLE IF NOT EXISTS {GROUP_CONTENTS} (
+        chat_id INTEGER,
+        language BLOB,
+        group_id BLOB,
+        word TEXT,
+        PRIMARY KEY (chat_id, language, group_id, word)
+    ) WITHOUT ROWID""",
+    f"""
+    CREATE TABLE IF NOT EXISTS {SESSIONS_INFO} (
+        chat_id INTEGER,
+        session_id INTEGER,
+        direction BLOB,
+        duration INTEGER,
+        hints BLOB,
+        language BLOB,
+        strategy BLOB,
+        PRIMARY KEY (chat_id, session_id)
+    ) WITHOUT ROWID""",
+    f"""
+    CREATE TABLE IF NOT EXISTS {SESSIONS} (
+        chat_id INTEGER,
+        session_id INTEGER,
+        word_idx INTEGER,
+        hint TEXT,
+        mistake INTEGER,
+        score INTEGER,
+        translation TEXT,
+        word TEXT,
+        distractors TEXT,
+        PRIMARY KEY (chat_id, session_id, word_idx)
+    ) WITHOUT ROWID""",
+    f"""
+    CREATE TABLE IF NOT EXISTS {COMMAND_LOG} (
+        chat_id INTEGER,
+        timestamp INTEGER,
+        command TEXT,
+        PRIMARY KEY (chat_id, timestamp)
+    ) WITHOUT ROWID""",
+]
+
+# the secondary indexes of the YDB tables, and the lookups by group_id
+# that YDB does with full scans
+INDEXES = [
+    f"""
+    CREATE INDEX IF NOT EXISTS {queries.VOCABS_RANDOM_INDEX}
+    ON {VOCABS} (chat_id, language, random_key)""",
+    f"""
+    CREATE INDEX IF NOT EXISTS {queries.VOCABS_REVIEW_INDEX}
+    ON {VOCABS} (chat_id, language, next_review)""",
+    f"""
+    CREATE INDEX IF NOT EXISTS {queries.VOCABS_ADDED_INDEX}
+    ON {VOCABS} (chat_id, language, added_timestamp)""",
+    f"""
+    CREATE INDEX IF NOT EXISTS {queries.VOCABS_SCORE_INDEX}
+    ON {VOCABS} (chat_id, language, score)""",
+    f"""
+    CREATE INDEX IF NOT EXISTS {queries.VOCABS_N_TRAINS_INDEX}
+    ON {VOCABS} (chat_id, language, n_trains)""",
+    f"""
+    CREATE INDEX IF NOT EXISTS groups_name_idx
+    ON {GROUPS} (chat_id, language, group_name)""",
+    f"""
+    CREATE INDEX IF NOT EXISTS groups_group_id_idx
+    ON {GROUPS} (group_id)""",
+    f"""
+    CREATE INDEX IF NOT EXISTS group_contents_group_id_idx
+    ON {GROUP_CONTENTS} (group_id)""",
+]
+
+# what a vocabulary row adds to every column of the stats of its language
+ROW_STATS = {
+    "n_words": "1",
+    "n_trained_words": "({row}.n_trains_from IS NOT NULL OR {row}.n_trains_to IS NOT NULL)",
+    "score_from_sum": "IFNULL({row}.score_from, 0)",
+    "score_to_sum": "IFNULL({row}.score_to, 0)",
+    "n_trains_from_sum": "IFNULL({row}.n_trains_from, 0)",
+    "n_trains_to_sum": "IFNULL({row}.n_trains_to, 0)",
+}
+
+
+def make_stats_triggers():
+    # maintain vocabulary_stats like queries.update_vocabulary_stats does
+    columns = queries.VOCABULARY_STATS_COLUMNS
+    added = ", ".join(ROW_STATS[column].format(row="NEW") for column in columns)
+    on_insert = ", ".join(
+        f"{column} = {column} + excluded.{column}" for column in columns
+    )
+    # clamped at zero like in queries.update_vocabulary_stats
+    on_delete = ", ".join(
+        f"{column} = MAX({column} - {ROW_STATS[column].format(row='OLD')}, 0)"
+        for column in columns
+    )
+    on_update = ", ".join(
+        f"{column} = MAX({column} - {ROW_STATS[column].format(row='OLD')}"
+        f" + {ROW_STATS[column].format(row='NEW')}, 0)"
+        for column in columns
+    )
+    where = "chat_id = {row}.chat_id AND language = {row}.language"
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS vocabularies_insert_stats
+        AFTER INSERT ON {VOCABS}
+        BEGIN
+            INSERT INTO {STATS} (chat_id, language, {", ".join(columns)})
+            VALUES (NEW.chat_id, NEW.language, {added})
+            ON CONFLICT (chat_id, language) DO UPDATE SET {on_insert};
+        END""",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS vocabularies_delete_stats
+        AFTER DELETE ON {VOCABS}
+        BEGIN
+            UPDATE {STATS} SET {on_delete}
+            WHERE {where.format(row="OLD")};
+        END""",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS vocabularies_update_stats
+        AFTER UPDATE ON {VOCABS}
+        BEGIN
+            UPDATE {STATS} SET {on_update}
+            WHERE {where.format(row="NEW")};
+        END""",
+    ]
+
+
+SCHEMA = TABLES + INDEXES + make_stats_triggers()
+
+
+def format_parameters(kwargs):
+    return {
+        key: json.dumps(value) if isinstance(value, (list, tuple)) else value
+        for key, value in kwargs.items()
+    }
+
+
+def statements(*sql):
+    # an implementation running `sql` in order, the last SELECT gives the rows
+    def run(connection, **kwargs):
+        parameters = format_parameters(kwargs)
+        rows = None
+        for statement in sql:
+            cursor = connection.execute(statement, parameters)
+            if cursor.description is not None:
+                rows = cursor.fetchall()
+        return rows
+
+    return run
+
+
+def in_list(parameter):
+    return f"(SELECT value FROM json_each(:{parameter}))"
+
+
+def get_random_key(word, added_timestamp):
+    # a stable pseudo random key, like RandomNumber(word, added_timestamp)
+    digest = hashlib.blake2b(
+        "{}{}".format(word, added_timestamp).encode(), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "big") >> RANDOM_KEY_SHIFT
+
+
+def get_shuffle_key(session_id, word):
+    # the order of the words of a session, like RandomNumber(session_id || word)
+    return zlib.crc32("{}{}".format(session_id, word).encode())
+
+
+def get_direction(direction):
+    # it goes into column names
+    direction = direction.decode()
+    assert direction in ("to", "from"), "unknown direction {}".format(direction)
+    return direction
+
+
+GROUP_WORDS_FILTER = f"""(
+            :group_id IS NULL
+            OR word IN (
+                SELECT word
+                FROM {GROUP_CONTENTS}
+                WHERE
+                    chat_id = :chat_id
+                    AND language = :language
+                    AND group_id = :group_id
+            )
+        )"""
+
+
+def set_user_state_if_version(connection, chat_id, state, version):
+    row = connection.execute(
+        f"SELECT version FROM {STATES} WHERE chat_id = :chat_id", {"chat_id": chat_id}
+    ).fetchone()
+    current_version = 0 if row is None else row["version"] or 0
+    if current_version != version:
+        raise StateConflictError(queries.STATE_CONFLICT_MESSAGE)
+
+    connection.execute(
+        f"""
+        INSERT OR REPLACE INTO {STATES} (chat_id, state, version)
+        VALUES (:chat_id, :state, :version)""",
+        {"chat_id": chat_id, "state": state, "version": version + 1},
+    )
+
+
+SCORE_FROM = "CAST(score_from AS REAL) / n_trains_from"
+SCORE_TO = "CAST(score_to AS REAL) / n_trains_to"
+# queries.WORD_SCORE and queries.WORD_N_TRAINS
+WORD_SCORE = (
+    f"(IFNULL({SCORE_FROM}, {SCORE_TO}) + IFNULL({SCORE_TO}, {SCORE_FROM})) / 2.0"
+)
+WORD_N_TRAINS = "IFNULL(n_trains_from, 0) + IFNULL(n_trains_to, 0)"
+
+
+def make_vocab_page_query(sort_key, sort_key_type, is_descending):
+    # queries.make_indexed_vocab_page_query
+    comparison = "<" if is_descending else ">"
+    order = "DESC" if is_descending else "ASC"
+    column, _, null_sort_key = queries.INDEXED_SORT_KEYS[sort_key]
+    columns = "word, translation, added_timestamp, score, n_trains"
+
+    without_key = ""
+    if null_sort_key is not None:
+        without_key = f"""
+            UNION ALL
+            SELECT * FROM (
+                SELECT {columns}, {null_sort_key} AS sort_key, 1 AS part
+                FROM {VOCABS}
+                WHERE
+                    chat_id = :chat_id
+                    AND language = :language
+                    AND {column} IS NULL
+                    AND (
+                        :cursor_word IS NULL
+                        OR :cursor_key != {null_sort_key}
+                        OR word {comparison} :cursor_word
+                    )
+                    AND {GROUP_WORDS_FILTER}
+                ORDER BY word {order}
+                LIMIT :limit
+            )"""
+
+    return statements(f"""
+        SELECT *
+        FROM (
+            SELECT * FROM (
+                SELECT {columns}, {column} AS sort_key, 0 AS part
+                FROM {VOCABS}
+                WHERE
+                    chat_id = :chat_id
+                    AND language = :language
+                    AND {column} IS NOT NULL
+                    AND (:cursor_word IS NULL OR {column} {comparison}= :cursor_key)
+                    AND (
+                        :cursor_word IS NULL
+                        OR {column} != :cursor_key
+                        OR word {comparison} :cursor_word
+                    )
+                    AND {GROUP_WORDS_FILTER}
+                ORDER BY {column} {order}, word {order}
+                LIMIT :limit
+            ){without_key}
+        )
+        ORDER BY part, sort_key {order}, word {order}
+        LIMIT :limit""")
+
+
+# queries.GROUP_CANDIDATES, LEFT ONLY JOIN is a LEFT JOIN without a match
+GROUP_CANDIDATES = f"""
+            SELECT vocab.word, vocab.translation, vocab.added_timestamp
+            FROM {VOCABS} AS vocab
+            LEFT JOIN {GROUP_CONTENTS} AS group_words ON
+                group_words.chat_id = vocab.chat_id
+                AND group_words.language = vocab.language
+                AND group_words.group_id = :group_id
+                AND group_words.word = vocab.word
+            WHERE
+                vocab.chat_id = :chat_id
+                AND vocab.language = :language
+                AND group_words.word IS NULL"""
+
+
+def make_group_candidates_page_query(sort_key, sort_key_type, is_descending):
+    comparison = "<" if is_descending else ">"
+    order = "DESC" if is_descending else "ASC"
+    return statements(f"""
+        SELECT *
+        FROM (
+            SELECT c.*, {sort_key} AS sort_key
+            FROM ({GROUP_CANDIDATES}) AS c
+        )
+        WHERE
+            :cursor_word IS NULL
+            OR sort_key {comparison} :cursor_key
+            OR (sort_key = :cursor_key AND word {comparison} :cursor_word)
+        ORDER BY sort_key {order}, word {order}
+        LIMIT :limit""")
+
+
+def get_strategy_filter(strategy, direction):
+    # queries.TRAINING_STRATEGY_FILTER
+    strategy = strategy.decode()
+    if strategy == "new":
+        return f"IFNULL(n_trains_{direction}, 0) <= 2"
+    if strategy == "bad":
+        return (
+            f"n_trains_{direction} >= 1"
+            f" AND 1.0 * score_{direction} / n_trains_{direction} <= 0.7"
+        )
+    return "1"
+
+
+def save_session_words(connection, chat_id, session_id, rows, duration):
+    words = sorted(rows, key=lambda row: get_shuffle_key(session_id, row["word"]))
+    session_words = [
+        {
+            "chat_id": chat_id,
+            "session_id": session_id,
+            "word": row["word"],
+            "translation": row["translation"],
+            "word_idx": word_idx,
+        }
+        for word_idx, row in enumerate(words[:duration], 1)
+    ]
+    connection.executemany(
+        f"""
+        INSERT INTO {SESSIONS} (chat_id, session_id, word_idx, word, translation)
+        VALUES (:chat_id, :session_id, :word_idx, :word, :translation)
+        ON CONFLICT (chat_id, session_id, word_idx) DO UPDATE SET
+            word = excluded.word,
+            translation = excluded.translation""",
+        session_words,
+    )
+    return session_words
+
+
+def select_random_words(connection, where, params, limit, random_start):
+    # a range read of the random key index from a random point, wrapping around,
+    # then the words added before the random key existed
+    return connection.execute(
+        f"""
+        SELECT word, translation
+        FROM (
+            SELECT * FROM (
+                SELECT word, translation, random_key, 0 AS part
+                FROM {VOCABS}
+                WHERE {where} AND random_key >= :random_start
+                ORDER BY random_key
+                LIMIT :limit
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT word, translation, random_key, 1 AS part
+                FROM {VOCABS}
+                WHERE {where} AND random_key < :random_start
+                ORDER BY random_key
+                LIMIT :limit
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT word, translation, random_key, 2 AS part
+                FROM {VOCABS}
+                WHERE {where} AND random_key IS NULL
+                LIMIT :limit
+            )
+        )
+        ORDER BY part, random_key
+        LIMIT :limit""",
+        dict(
+            params,
+            limit=limit,
+            random_start=random_start >> RANDOM_KEY_SHIFT,
+        ),
+    ).fetchall()
+
+
+def create_training_session(
+    connection,
+    chat_id,
+    session_id,
+    strategy,
+    language,
+    direction,
+    duration,
+    random_start,
+):
+    where = """
+                chat_id = :chat_id
+                AND language = :language
+                AND {}""".format(
+        get_strategy_filter(strategy, get_direction(direction))
+    )
+    rows = select_random_words(
+        connection,
+        where,
+        {"chat_id": chat_id, "language": language},
+        duration,
+        random_start,
+    )
+    return save_session_words(connection, chat_id, session_id, rows, duration)
+
+
+def get_random_words(connection, chat_id, language, random_start, limit):
+    return select_random_words(
+        connection,
+        "chat_id = :chat_id AND language = :language",
+        {"chat_id": chat_id, "language": language},
+        limit,
+        random_start,
+    )
+
+
+def create_due_training_session(
+    connection, chat_id, session_id, language, duration, **_
+):
+    # the most overdue words first, then the ones never reviewed, oldest first
+    rows = connection.execute(
+        f"""
+        SELECT word, translation
+        FROM (
+            SELECT * FROM (
+                SELECT word, translation, next_review, added_timestamp, 0 AS part
+                FROM {VOCABS}
+                WHERE
+                    chat_id = :chat_id
+                    AND language = :language
+                    AND next_review <= :session_id
+                ORDER BY next_review
+                LIMIT :duration
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT word, translation, next_review, added_timestamp, 1 AS part
+                FROM {VOCABS}
+                WHERE
+                    chat_id = :chat_id
+                    AND language = :language
+                    AND next_review IS NULL
+                ORDER BY added_timestamp, word
+                LIMIT :duration
+            )
+        )
+        ORDER BY part, next_review, added_timestamp, word
+        LIMIT :duration""",
+        {
+            "chat_id": chat_id,
+            "session_id": session_id,
+            "language": language,
+            "duration": duration,
+        },
+    ).fetchall()
+    return save_session_words(connection, chat_id, session_id, rows, duration)
+
+
+def create_group_training_session(
+    connection, chat_id, session_id, language, duration, group_id, **_
+):
+    rows = connection.execute(
+        f"""
+        SELECT v.word AS word, v.translation AS translation
+        FROM {GROUP_CONTENTS} AS g
+        INNER JOIN {VOCABS} AS v ON
+            v.chat_id = g.chat_id
+            AND v.language = g.language
+            AND v.word = g.word
+        WHERE
+            g.chat_id = :chat_id
+            AND g.language = :language
+            AND g.group_id = :group_id""",
+        {"chat_id": chat_id, "language": language, "group_id": group_id},
+    ).fetchall()
+    return save_session_words(connection, chat_id, session_id, rows, duration)
+
+
+def set_training_scores(connection, chat_id, session_id, word_idxs, scores):
+    connection.executemany(
+        f"""
+        INSERT INTO {SESSIONS} (chat_id, session_id, word_idx, score)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (chat_id, session_id, word_idx) DO UPDATE SET
+            score = excluded.score""",
+        [
+            (chat_id, session_id, word_idx, score)
+            for word_idx, score in zip(word_idxs, scores)
+        ],
+    )
+
+
+def get_next_interval(is_correct, repetitions, interval_days, easiness):
+    # SM-2: the next interval in days after an answer
+    if not is_correct or repetitions == 0:
+        return 1
+    if repetitions == 1:
+        return 6
+    return math.floor(interval_days * easiness + 0.5)
+
+
+def get_next_easiness(is_correct, easiness):
+    delta = (
+        queries.SM2_EASINESS_DELTA_CORRECT
+        if is_correct
+        else queries.SM2_EASINESS_DELTA_WRONG
+    )
+    return max(queries.SM2_MIN_EASINESS, easiness + delta)
+
+
+def update_final_scores(connection, chat_id, session_id, language, direction):
+    direction = get_direction(direction)
+    rows = connection.execute(
+        f"""
+        SELECT v.*, cw.score AS session_score
+        FROM {SESSIONS} AS cw
+        INNER JOIN {VOCABS} AS v ON
+            v.chat_id = :chat_id
+            AND v.language = :language
+            AND v.word = cw.word
+        WHERE
+            cw.chat_id = :chat_id
+            AND cw.session_id = :session_id""",
+        {"chat_id": chat_id, "session_id": session_id, "language": language},
+    ).fetchall()
+
+    last_train = (
+        datetime.datetime.fromtimestamp(session_id, datetime.timezone.utc)
+        .strftime("%Y-%m-%d %H:%M:%S")
+        .encode()
+    )
+    updates = []
+    for row in rows:
+        score = row["session_score"]
+        is_correct = (score or 0) > 0
+        repetitions = row["repetitions"] or 0
+        easiness = row["easiness"]
+        if easiness is None:
+            easiness = queries.SM2_DEFAULT_EASINESS
+        interval_days = get_next_interval(
+            is_correct, repetitions, row["interval_days"] or 1, easiness
+        )
+        updates.append(
+            {
+                "chat_id": chat_id,
+                "language": language,
+                "word": row["word"],
+                "last_train": last_train,
+                "n_trains": (row[f"n_trains_{direction}"] or 0) + 1,
+                "score": (
+                    None if score is None else (row[f"score_{direction}"] or 0) + score
+                ),
+                "repetitions": repetitions + 1 if is_correct else 0,
+                "interval_days": interval_days,
+                "easiness": get_next_easiness(is_correct, easiness),
+                "next_review": session_id + queries.SECONDS_IN_DAY * interval_days,
+            }
+        )
+
+    connection.executemany(
+        f"""
+        UPDATE {VOCABS} SET
+            last_train_{direction} = :last_train,
+            n_trains_{direction} = :n_trains,
+            score_{direction} = :score,
+            repetitions = :repetitions,
+            interval_days = :interval_days,
+            easiness = :easiness,
+            next_review = :next_review
+        WHERE
+            chat_id = :chat_id
+            AND language = :language
+            AND word = :word""",
+        updates,
+    )
+    # the sort keys of the vocabulary listings follow the new scores
+    connection.execute(
+        f"""
+        UPDATE {VOCABS} SET
+            score = {WORD_SCORE},
+            n_trains = {WORD_N_TRAINS}
+        WHERE
+            chat_id = :chat_id
+            AND language = :language
+            AND word IN (
+                SELECT word
+                FROM {SESSIONS}
+                WHERE chat_id = :chat_id AND session_id = :session_id
+            )""",
+        {"chat_id": chat_id, "session_id": session_id, "language": language},
+    )
+    connection.execute(
+        f"UPDATE {USERS} SET session_id = NULL WHERE chat_id = :chat_id",
+        {"chat_id": chat_id},
+    )
+
+
+def bulk_update_words(
+    connection, chat_id, language, words, translations, added_timestamp
+):
+    # an overwritten word loses its training history, as with UPSERT in YDB
+    connection.executemany(
+        f"""
+        INSERT INTO {VOCABS} (
+            chat_id, language, word, translation, added_timestamp, random_key, n_trains
+        )
+        VALUES (?, ?, ?, ?, ?, ?, 0)
+        ON CONFLICT (chat_id, language, word) DO UPDATE SET
+            translation = excluded.translation,
+            added_timestamp = excluded.added_timestamp,
+            random_key = excluded.random_key,
+            score = NULL,
+            n_trains = 0,
+            last_train_from = NULL,
+            last_train_to = NULL,
+            score_from = NULL,
+            score_to = NULL,
+            n_trains_from = NULL,
+            n_trains_to = NULL,
+            repetitions = NULL,
+            interval_days = NULL,
+            easiness = NULL,
+            next_review = NULL""",
+        [
+            (
+                chat_id,
+                language,
+                word,
+                translation,
+                added_timestamp,
+                get_random_key(word, added_timestamp),
+            )
+            for word, translation in zip(words, translations)
+        ],
+    )
+
+
+def bulk_add_new_words(
+    connection, chat_id, language, words, translations, added_timestamp
+):
+    # the words that are already in the vocabulary keep their training history
+    connection.executemany(
+        f"""
+        INSERT INTO {VOCABS} (
+            chat_id, language, word, translation, added_timestamp, random_key, n_trains
+        )
+        VALUES (?, ?, ?, ?, ?, ?, 0)
+        ON CONFLICT (chat_id, language, word) DO NOTHING""",
+        [
+            (
+                chat_id,
+                language,
+                word,
+                translation,
+                added_timestamp,
+                get_random_key(word, added_timestamp),
+            )
+            for word, translation in zip(words, translations)
+        ],
+    )
+
+
+def bulk_update_group(connection, chat_id, language, group_id, words):
+    connection.executemany(
+        f"""
+        INSERT OR IGNORE INTO {GROUP_CONTENTS} (chat_id, language, group_id, word)
+        VALUES (?, ?, ?, ?)""",
+        [(chat_id, language, group_id, word) for word in words],
+    )
+
+
+class QueryMap:
+    """
+    Maps the query constants of database.queries to their implementations by
+    identity rather than by text: a query is found as long as it is passed as
+    the constant, however its text is edited, and a string built elsewhere
+    is never taken for one of them.
+    """
+
+    def __init__(self, implementations=()):
+        self.items = {}
+        for query, implementation in dict(implementations).items():
+            self[query] = implementation
+
+    def __setitem__(self, query, implementation):
+        # the constants live as long as the module, so do their ids
+        self.items[id(query)] = (query, implementation)
+
+    def get(self, query):
+        item = self.items.get(id(query))
+        if item is None or item[0] is not query:
+            return None
+        return item[1]
+
+    def __getitem__(self, query):
+        implementation = self.get(query)
+        if implementation is None:
+            raise KeyError(query)
+        return implementation
+
+    def __contains__(self, query):
+        return self.get(query) is not None
+
+
+def log_commands(connection, rows):
+    connection.executemany(
+        f"""
+        INSERT OR REPLACE INTO {COMMAND_LOG} (chat_id, timestamp, command)
+        VALUES (:chat_id, :timestamp, :command)""",
+        rows,
+    )
+
+
+IMPLEMENTATIONS = {
+    queries.create_user: statements(f"INSERT INTO {USERS} (chat_id) VALUES (:chat_id)"),
+    queries.get_user_info: statements(
+        f"SELECT * FROM {USERS} WHERE chat_id = :chat_id"
+    ),
+    queries.get_user_state: statements(
+        f"SELECT state, version FROM {STATES} WHERE chat_id = :chat_id"
+    ),
+    queries.set_user_state: statements(f"""
+        INSERT INTO {STATES} (chat_id, state, version)
+        VALUES (:chat_id, :state, 1)
+        ON CONFLICT (chat_id) DO UPDATE SET
+            state = excluded.state,
+            version = IFNULL(version, 0) + 1"""),
+    queries.set_user_state_if_version: set_user_state_if_version,
+    # the group contents go first, they are found through the groups
+    queries.delete_user: statements(
+        f"DELETE FROM {VOCABS} WHERE chat_id = :chat_id",
+        f"DELETE FROM {STATS} WHERE chat_id = :chat_id",
+        f"DELETE FROM {USERS} WHERE chat_id = :chat_id",
+        f"DELETE FROM {LANGUAGES} WHERE chat_id = :chat_id",
+        f"DELETE FROM {SESSIONS_INFO} WHERE chat_id = :chat_id",
+        f"DELETE FROM {SESSIONS} WHERE chat_id = :chat_id",
+        f"DELETE FROM {STATES} WHERE chat_id = :chat_id",
+        f"""
+        DELETE FROM {GROUP_CONTENTS}
+        WHERE
+            chat_id = :chat_id
+            OR group_id IN (
+                SELECT group_id FROM {GROUPS} WHERE chat_id = :chat_id AND is_creator
+            )""",
+        f"""
+        DELETE FROM {GROUPS}
+        WHERE
+            chat_id = :chat_id
+            OR group_id IN (
+                SELECT group_id FROM {GROUPS} WHERE chat_id = :chat_id AND is_creator
+            )""",
+    ),
+    queries.delete_language: statements(
+        f"DELETE FROM {VOCABS} WHERE chat_id = :chat_id AND language = :language",
+        f"DELETE FROM {STATS} WHERE chat_id = :chat_id AND language = :language",
+        f"UPDATE {USERS} SET current_lang = NULL WHERE chat_id = :chat_id",
+        f"DELETE FROM {LANGUAGES} WHERE chat_id = :chat_id AND language = :language",
+        f"""
+        DELETE FROM {SESSIONS}
+        WHERE
+            chat_id = :chat_id
+            AND session_id IN (
+                SELECT session_id
+                FROM {SESSIONS_INFO}
+                WHERE chat_id = :chat_id AND language = :language
+            )""",
+        f"""
+        DELETE FROM {SESSIONS_INFO}
+        WHERE chat_id = :chat_id AND language = :language""",
+        f"""
+        DELETE FROM {GROUP_CONTENTS}
+        WHERE
+            (chat_id = :chat_id AND language = :language)
+            OR group_id IN (
+                SELECT group_id
+                FROM {GROUPS}
+                WHERE chat_id = :chat_id AND language = :language AND is_creator
+            )""",
+        f"""
+        DELETE FROM {GROUPS}
+        WHERE
+            (chat_id = :chat_id AND language = :language)
+            OR group_id IN (
+                SELECT group_id
+                FROM {GROUPS}
+                WHERE chat_id = :chat_id AND language = :language AND is_creator
+            )""",
+    ),
+    queries.get_user_vocabs: statements(
+        f"SELECT * FROM {VOCABS} WHERE chat_id = :chat_id"
+    ),
+    queries.get_full_vocab: statements(f"""
+        SELECT
+            word,
+            score_from,
+            score_to,
+            n_trains_from,
+            n_trains_to,
+            translation,
+            added_timestamp
+        FROM {VOCABS}
+        WHERE chat_id = :chat_id AND language = :language"""),
+    queries.count_vocab_words: statements(f"""
+        SELECT COUNT(*) AS n_words
+        FROM {VOCABS}
+        WHERE
+            chat_id = :chat_id
+            AND language = :language
+            AND {GROUP_WORDS_FILTER}"""),
+    queries.count_group_candidates: statements(
+        f"SELECT COUNT(*) AS n_words FROM ({GROUP_CANDIDATES})"
+    ),
+    queries.get_words_from_vocab: statements(f"""
+        SELECT word
+        FROM {VOCABS}
+        WHERE
+            chat_id = :chat_id
+            AND language = :language
+            AND word IN {in_list("words")}"""),
+    queries.delete_words_from_vocab: statements(f"""
+        DELETE FROM {VOCABS}
+        WHERE
+            chat_id = :chat_id
+            AND language = :language
+            AND word IN {in_list("words")}"""),
+    queries.update_current_lang: statements(
+        f"UPDATE {USERS} SET current_lang = :language WHERE chat_id = :chat_id"
+    ),
+    queries.get_available_languages: statements(
+        f"SELECT language FROM {LANGUAGES} WHERE chat_id = :chat_id"
+    ),
+    queries.user_add_language: statements(
+        f"INSERT INTO {LANGUAGES} (chat_id, language) VALUES (:chat_id, :language)"
+    ),
+    queries.get_current_language: statements(
+        f"SELECT current_lang FROM {USERS} WHERE chat_id = :chat_id"
+    ),
+    queries.init_training_session: statements(
+        f"UPDATE {USERS} SET session_id = :session_id WHERE chat_id = :chat_id",
+        f"""
+        INSERT OR REPLACE INTO {SESSIONS_INFO}
+            (chat_id, session_id, strategy, language, direction, duration, hints)
+        VALUES
+            (:chat_id, :session_id, :strategy, :language, :direction, :duration, :hints)""",
+    ),
+    queries.get_session_info: statements(f"""
+        SELECT *
+        FROM {SESSIONS_INFO}
+        WHERE chat_id = :chat_id AND session_id = :session_id"""),
+    queries.create_training_session: create_training_session,
+    queries.create_due_training_session: create_due_training_session,
+    queries.create_group_training_session: create_group_training_session,
+    queries.get_training_words: statements(f"""
+        SELECT *
+        FROM {SESSIONS}
+        WHERE chat_id = :chat_id AND session_id = :session_id
+        ORDER BY word_idx"""),
+    queries.get_training_words_by_idx: statements(f"""
+        SELECT *
+        FROM {SESSIONS}
+        WHERE
+            chat_id = :chat_id
+            AND session_id = :session_id
+            AND word_idx IN {in_list("word_idxs")}"""),
+    queries.get_random_words: get_random_words,
+    queries.set_training_scores: set_training_scores,
+    queries.update_final_scores: update_final_scores,
+    queries.get_group_by_name: statements(f"""
+        SELECT group_id, group_name, is_creator
+        FROM {GROUPS}
+        WHERE
+            chat_id = :chat_id
+            AND language = :language
+            AND group_name = :group_name"""),
+    queries.add_group: statements(f"""
+        INSERT INTO {GROUPS} (chat_id, language, group_id, group_name, is_creator)
+        VALUES (:chat_id, :language, :group_id, :group_name, :is_creator)"""),
+    queries.delete_group: statements(
+        f"DELETE FROM {GROUP_CONTENTS} WHERE group_id = :group_id",
+        f"DELETE FROM {GROUPS} WHERE group_id = :group_id",
+    ),
+    queries.get_all_groups: statements(f"""
+        SELECT group_name, group_id
+        FROM {GROUPS}
+        WHERE chat_id = :chat_id AND language = :language"""),
+    queries.get_group_contents: statements(f"""
+        SELECT
+            group_contents.word AS word,
+            translation,
+            score_from,
+            score_to,
+            n_trains_from,
+            n_trains_to,
+            added_timestamp
+        FROM {GROUP_CONTENTS} AS group_contents
+        INNER JOIN {VOCABS} AS vocabs ON
+            group_contents.chat_id = vocabs.chat_id
+            AND group_contents.language = vocabs.language
+            AND group_contents.word = vocabs.word
+        WHERE group_contents.group_id = :group_id"""),
+    queries.bulk_update_words: bulk_update_words,
+    queries.bulk_add_new_words: bulk_add_new_words,
+    queries.bulk_update_group: bulk_update_group,
+    queries.bulk_update_group_delete: statements(f"""
+        DELETE FROM {GROUP_CONTENTS}
+        WHERE
+            chat_id = :chat_id
+            AND language = :language
+            AND group_id = :group_id
+            AND word IN {in_list("words")}"""),
+    queries.log_commands: log_commands,
+    queries.get_vocabulary_stats: statements(
+        f"SELECT * FROM {STATS} WHERE chat_id = :chat_id AND language = :language"
+    ),
+    queries.get_all_vocabulary_stats: statements(
+        f"SELECT * FROM {STATS} WHERE chat_id = :chat_id"
+    ),
+}
+
+for sorting, params in queries.VOCAB_SORTINGS.items():
+    IMPLEMENTATIONS[queries.get_vocab_page[sorting]] = make_vocab_page_query(*params)
+
+for sorting, params in queries.GROUP_CANDIDATES_SORTINGS.items():
+    IMPLEMENTATIONS[queries.get_group_candidates_page[sorting]] = (
+        make_group_candidates_page_query(*params)
+    )
+
+for table_name, query in zip(
+    [
+        USERS,
+        VOCABS,
+        GROUPS,
+        GROUP_CONTENTS,
+        LANGUAGES,
+        SESSIONS,
+        SESSIONS_INFO,
+        STATES,
+        STATS,
+    ],
+    queries.truncate_tables_queries,
+):
+    IMPLEMENTATIONS[query] = statements(f"DELETE FROM {table_name}")
+
+# scan queries are streamed from a cursor
+SCAN_QUERIES = {
+    queries.export_vocab: f"""
+        SELECT
+            word,
+            translation,
+            added_timestamp,
+            score_from,
+            score_to,
+            n_trains_from,
+            n_trains_to
+        FROM {VOCABS}
+        WHERE
+            chat_id = :chat_id
+            AND language = :language
+            AND {GROUP_WORDS_FILTER}""",
+}
+
+# looked up by the identity of the query constants, see QueryMap
+IMPLEMENTATIONS = QueryMap(IMPLEMENTATIONS)
+SCAN_QUERIES = QueryMap(SCAN_QUERIES)
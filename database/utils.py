@@ -1,30 +1,295 @@
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import ydb
 
+import database.queries as queries
+import metrics
+from logs import logger
+
+PREPARED_QUERIES_CACHE_SIZE = 1000
+DECLARED_PARAMETER = re.compile(r"DECLARE\s+\$(\w+)")
+NAMED_EXPRESSION = re.compile(r"^\s*\$(\w+)\s*=", re.MULTILINE)
+STRING_LITERAL = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""")
+# the session is gone for good, the pool discards it
+SESSION_CLOSED_ERRORS = (ydb.BadSession, ydb.SessionExpired)
+
+# transaction modes for read-only queries
+# https://ydb.tech/en/docs/concepts/transactions#modes
+SERIALIZABLE = "serializable"
+SNAPSHOT = "snapshot"
+ONLINE = "online"
+READ_TX_MODES = {
+    SERIALIZABLE: ydb.SerializableReadWrite,
+    SNAPSHOT: ydb.SnapshotReadOnly,
+    ONLINE: ydb.OnlineReadOnly,
+}
+
 
 def format_kwargs(kwargs):
     return {"${}".format(key): value for key, value in kwargs.items()}
 
 
-# using prepared statements
-# https://ydb.tech/en/docs/reference/ydb-sdk/example/python/#param-prepared-queries
-def execute_update_query(pool, query, **kwargs):
-    def callee(session):
-        prepared_query = session.prepare(query)
-        session.transaction(ydb.SerializableReadWrite()).execute(
-            prepared_query, format_kwargs(kwargs), commit_tx=True
+class PreparedQueriesCache:
+    """
+    LRU cache of prepared queries keyed by (session_id, query text).
+    The entries of a session are dropped when YDB reports it closed or the pool
+    is stopped, those of sessions closed otherwise are evicted as LRU.
+    """
+
+    def __init__(self, max_size=PREPARED_QUERIES_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session, query):
+        key = (session.session_id, query)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, session, query, prepared_query):
+        with self.lock:
+            self.entries[(session.session_id, query)] = prepared_query
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def prepare(self, session, query):
+        prepared_query = self.get(session, query)
+        if prepared_query is None:
+            prepared_query = session.prepare(query)
+            self.put(session, query, prepared_query)
+        return prepared_query
+
+    async def prepare_async(self, session, query):
+        # the same for the sessions of ydb.aio pools
+        prepared_query = self.get(session, query)
+        if prepared_query is None:
+            prepared_query = await session.prepare(query)
+            self.put(session, query, prepared_query)
+        return prepared_query
+
+    def drop_session(self, session_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == session_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    @contextmanager
+    def session_scope(self, session):
+        # the id is reset once the session is invalidated
+        session_id = session.session_id
+        try:
+            yield
+        except SESSION_CLOSED_ERRORS:
+            self.drop_session(session_id)
+            raise
+
+    def get_stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+prepared_queries = PreparedQueriesCache()
+
+
+def warm_up_session(session):
+    """
+    Session pool initializer: prepares queries.HOT_QUERIES, which almost every
+    update runs. The others are prepared on first use in a session, a cold
+    start doesn't wait for the queries it doesn't run.
+    """
+    for query in queries.HOT_QUERIES:
+        try:
+            prepared_queries.prepare(session, query)
+        except ydb.Error as e:
+            # a failing initializer makes the pool recreate the session forever
+            logger.warning(f"Failed to prepare query on warm up: {e}")
+
+
+def prefix_names(query, prefix):
+    """
+    Prefixes the declared parameters and the named expressions of the query,
+    string literals are left as they are.
+    """
+    names = set(DECLARED_PARAMETER.findall(query) + NAMED_EXPRESSION.findall(query))
+    if len(names) == 0:
+        return query
+
+    name_pattern = re.compile(
+        r"\$({})\b".format("|".join(re.escape(name) for name in names))
+    )
+    # the odd parts are the string literals
+    parts = STRING_LITERAL.split(query)
+    for i in range(0, len(parts), 2):
+        parts[i] = name_pattern.sub(lambda m: "$" + prefix + m.group(1), parts[i])
+    return "".join(parts)
+
+
+def merge_queries(queries_with_kwargs):
+    """
+    Glues several queries into one. Parameters and named expressions of the
+    i-th query get an `s{i}_` prefix so that the queries can't clash.
+    """
+    declarations, statements, parameters = [], [], {}
+
+    for i, (query, kwargs) in enumerate(queries_with_kwargs):
+        prefix = "s{}_".format(i)
+        query = prefix_names(query, prefix)
+
+        for line in query.strip().split("\n"):
+            if line.strip().startswith("DECLARE "):
+                declarations.append(line.strip())
+            else:
+                statements.append(line)
+        statements[-1] = statements[-1].rstrip().rstrip(";") + ";"
+
+        parameters.update(
+            {"{}{}".format(prefix, key): value for key, value in kwargs.items()}
         )
 
-    return pool.retry_operation_sync(callee)
+    return "\n".join(declarations + statements), parameters
+
+
+class StorageBackend(ABC):
+    """
+    What database.model needs from a database. The queries are the constants
+    of database.queries: a backend either runs them as they are or maps them
+    to its own implementation, and returns rows that support row["column"].
+    """
+
+    # the name the calls are counted under in the update metrics
+    name = None
+
+    def __repr__(self):
+        # logged with every handler call, see logs.NOT_RENDERED_TYPES
+        return "<{}>".format(type(self).__name__)
+
+    @abstractmethod
+    def execute_update_query(self, query, **kwargs):
+        pass
+
+    @abstractmethod
+    def execute_read_query(self, query, tx_mode, **kwargs):
+        pass
+
+    @abstractmethod
+    def execute_scan_query(self, query, parameters_types, **kwargs):
+        pass
+
+    @abstractmethod
+    def execute_batch(self, queries_with_kwargs, is_read_only):
+        pass
+
+
+class YdbBackend(StorageBackend):
+    name = "ydb"
+
+    def __init__(self, pool, driver=None):
+        self.pool = pool
+        # the driver the pool was created with, scan queries are run on it
+        self.driver = driver
+
+    # using prepared statements
+    # https://ydb.tech/en/docs/reference/ydb-sdk/example/python/#param-prepared-queries
+    def execute_update_query(self, query, **kwargs):
+        def callee(session):
+            with prepared_queries.session_scope(session):
+                prepared_query = prepared_queries.prepare(session, query)
+                session.transaction(ydb.SerializableReadWrite()).execute(
+                    prepared_query, format_kwargs(kwargs), commit_tx=True
+                )
+
+        return self.pool.retry_operation_sync(callee)
+
+    def execute_read_query(self, query, tx_mode, **kwargs):
+        def callee(session):
+            with prepared_queries.session_scope(session):
+                prepared_query = prepared_queries.prepare(session, query)
+                result_sets = session.transaction(READ_TX_MODES[tx_mode]()).execute(
+                    prepared_query, format_kwargs(kwargs), commit_tx=True
+                )
+            return result_sets[0].rows
+
+        return self.pool.retry_operation_sync(callee)
+
+    def execute_scan_query(self, query, parameters_types, **kwargs):
+        if self.driver is None:
+            raise ValueError("Scan queries need the driver the pool was created with")
+        scan_query = ydb.ScanQuery(query, format_kwargs(parameters_types))
+        parts = self.driver.table_client.scan_query(scan_query, format_kwargs(kwargs))
+        for part in parts:
+            metrics.count("ydb.scan_parts")
+            yield from part.result_set.rows
+
+    def execute_batch(self, queries_with_kwargs, is_read_only):
+        query, parameters = merge_queries(queries_with_kwargs)
+        tx_mode = ydb.SnapshotReadOnly if is_read_only else ydb.SerializableReadWrite
+
+        def callee(session):
+            with prepared_queries.session_scope(session):
+                prepared_query = prepared_queries.prepare(session, query)
+                result_sets = session.transaction(tx_mode()).execute(
+                    prepared_query, format_kwargs(parameters), commit_tx=True
+                )
+            return [result_set.rows for result_set in result_sets]
+
+        return self.pool.retry_operation_sync(callee)
+
+
+def get_backend(pool):
+    # a bare ydb.SessionPool is what the pool has always been, it can't scan
+    if isinstance(pool, StorageBackend):
+        return pool
+    return YdbBackend(pool)
+
+
+def execute_update_query(pool, query, **kwargs):
+    backend = get_backend(pool)
+    with metrics.track(backend.name):
+        return backend.execute_update_query(query, **kwargs)
+
+
+def execute_read_query(pool, query, tx_mode=SNAPSHOT, **kwargs):
+    """
+    Runs a SELECT in a read-only transaction, which takes no locks.
+    Use tx_mode=SERIALIZABLE for reads that a following write relies on.
+    """
+    backend = get_backend(pool)
+    with metrics.track(backend.name):
+        return backend.execute_read_query(query, tx_mode, **kwargs)
 
 
-# using prepared statements
-# https://ydb.tech/en/docs/reference/ydb-sdk/example/python/#param-prepared-queries
 def execute_select_query(pool, query, **kwargs):
-    def callee(session):
-        prepared_query = session.prepare(query)
-        result_sets = session.transaction(ydb.SerializableReadWrite()).execute(
-            prepared_query, format_kwargs(kwargs), commit_tx=True
-        )
-        return result_sets[0].rows
+    return execute_read_query(pool, query, SERIALIZABLE, **kwargs)
+
+
+def execute_scan_query(pool, query, parameters_types, **kwargs):
+    """
+    Streams the rows of a scan query: only one response part is held in memory.
+    `parameters_types` maps parameter names to ydb types, like kwargs do to values.
+    """
+    return get_backend(pool).execute_scan_query(query, parameters_types, **kwargs)
+
 
-    return pool.retry_operation_sync(callee)
+def execute_batch(pool, queries_with_kwargs, is_read_only=False):
+    """
+    Runs several queries as one multi-statement query in one transaction,
+    i.e. in a single round trip. Returns the rows of every result set in order.
+    Note that YDB doesn't allow reading a table after modifying it in the same query.
+    """
+    backend = get_backend(pool)
+    with metrics.track(backend.name):
+        return backend.execute_batch(queries_with_kwargs, is_read_only)
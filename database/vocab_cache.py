@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+MAX_CACHE_SIZE = 256
+# other instances of the function don't invalidate our snapshots
+CACHE_TTL_S = 60
+
+
+class VocabEntry:
+    """
+    A word of a vocabulary snapshot. Supports row-style access (entry["word"])
+    so that it can be used wherever a row of queries.get_full_vocab was.
+    """
+
+    __slots__ = (
+        "word",
+        "translation",
+        "translations",
+        "score_from",
+        "score_to",
+        "n_trains_from",
+        "n_trains_to",
+        "added_timestamp",
+    )
+    ROW_FIELDS = (
+        "word",
+        "translation",
+        "score_from",
+        "score_to",
+        "n_trains_from",
+        "n_trains_to",
+        "added_timestamp",
+    )
+
+    def __init__(self, row):
+        for field in self.ROW_FIELDS:
+            setattr(self, field, row[field])
+        self.translations = tuple(json.loads(row["translation"]))
+
+    def __getitem__(self, key):
+        if key not in self.ROW_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.ROW_FIELDS}
+
+
+class VocabCache:
+    """
+    LRU cache of vocabulary snapshots keyed by (chat_id, language).
+    Every write to a vocabulary bumps its version, so a snapshot read before
+    the write can neither be served nor stored afterwards.
+    At most max_size versions are kept: the least recently used one is evicted
+    together with its snapshot, and a read that was started before the eviction
+    can't store its snapshot anymore.
+    """
+
+    def __init__(self, max_size=MAX_CACHE_SIZE, ttl_s=CACHE_TTL_S):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (version, created_at, snapshot)
+        self.versions = OrderedDict()  # key -> version, in the order of use
+        # every new version is greater than all the versions evicted before it
+        self.last_version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                version, created_at, snapshot = self.entries[key]
+                if (
+                    version == self.versions.get(key)
+                    and time.monotonic() - created_at < self.ttl_s
+                ):
+                    self.entries.move_to_end(key)
+                    self.versions.move_to_end(key)
+                    self.hits += 1
+                    return snapshot
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def get_version(self, key):
+        with self.lock:
+            if key in self.versions:
+                self.versions.move_to_end(key)
+            else:
+                self.last_version += 1
+                self.versions[key] = self.last_version
+                self.evict_versions()
+            return self.versions[key]
+
+    def put(self, key, version, snapshot):
+        with self.lock:
+            if version != self.versions.get(key):
+                return  # the vocabulary has been changed while it was read
+
+            self.entries[key] = (version, time.monotonic(), snapshot)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def evict_versions(self):
+        while len(self.versions) > self.max_size:
+            key, _ = self.versions.popitem(last=False)
+            self.entries.pop(key, None)
+
+    def invalidate(self, chat_id, language=None):
+        """
+        Invalidates one vocabulary or, without a language, all vocabularies of the user.
+        """
+        with self.lock:
+            if language is not None:
+                keys = (
+                    [(chat_id, language)]
+                    if (chat_id, language) in self.versions
+                    else []
+                )
+            else:
+                keys = [key for key in self.versions if key[0] == chat_id]
+            for key in keys:
+                self.last_version += 1
+                self.versions[key] = self.last_version
+                self.entries.pop(key, None)
+
+    @contextmanager
+    def invalidating(self, chat_id, language=None):
+        # invalidates even if the write fails: it might have been partially applied
+        try:
+            yield
+        finally:
+            self.invalidate(chat_id, language)
+
+    def clear(self):
+        with self.lock:
+            self.versions.clear()
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+vocab_cache = VocabCache()
@@ -1,14 +1,119 @@
+import os
+
 import ydb
 
+from database.utils import YdbBackend, prepared_queries, warm_up_session
+from logs import logger
 
-def get_ydb_pool(ydb_endpoint, ydb_database, timeout=30):
-    ydb_driver_config = ydb.DriverConfig(
+# environment variables read by ydb.credentials_from_env_variables
+CREDENTIALS_ENV_VARIABLES = [
+    "YDB_SERVICE_ACCOUNT_KEY_FILE_CREDENTIALS",
+    "YDB_ANONYMOUS_CREDENTIALS",
+    "YDB_METADATA_CREDENTIALS",
+    "YDB_ACCESS_TOKEN_CREDENTIALS",
+]
+HEALTH_CHECK_TIMEOUT = 1
+# sessions of a ydb.aio pool, shared by all the updates processed concurrently
+ASYNC_POOL_SIZE = 50
+
+# kept between warm invocations of the serverless function
+_cached = {
+    "key": None,
+    "driver": None,
+    "pool": None,
+    "backend": None,
+}
+
+
+def get_ydb_driver_config(ydb_endpoint, ydb_database):
+    return ydb.DriverConfig(
         ydb_endpoint,
         ydb_database,
         credentials=ydb.credentials_from_env_variables(),
         root_certificates=ydb.load_ydb_root_certificate(),
     )
 
-    ydb_driver = ydb.Driver(ydb_driver_config)
+
+def get_ydb_driver(ydb_endpoint, ydb_database, timeout=30):
+    ydb_driver = ydb.Driver(get_ydb_driver_config(ydb_endpoint, ydb_database))
     ydb_driver.wait(fail_fast=True, timeout=timeout)
-    return ydb.SessionPool(ydb_driver)
+    return ydb_driver
+
+
+def get_ydb_pool(ydb_endpoint, ydb_database, timeout=30):
+    driver = get_ydb_driver(ydb_endpoint, ydb_database, timeout)
+    return YdbBackend(ydb.SessionPool(driver, initializer=warm_up_session), driver)
+
+
+async def get_ydb_async_pool(ydb_endpoint, ydb_database, timeout=30):
+    """
+    Returns (pool, driver) for the asyncio mode, both bound to the running event
+    loop. Queries are prepared on first use, ydb.aio pools have no session initializer.
+    """
+    driver = ydb.aio.Driver(get_ydb_driver_config(ydb_endpoint, ydb_database))
+    await driver.wait(fail_fast=True, timeout=timeout)
+    return ydb.aio.SessionPool(driver, size=ASYNC_POOL_SIZE), driver
+
+
+async def stop_ydb_async_pool(pool, driver, timeout=HEALTH_CHECK_TIMEOUT):
+    # has to run on the event loop they were created on
+    try:
+        await pool.stop(timeout=timeout)
+        await driver.stop(timeout=timeout)
+    except Exception as e:
+        logger.warning(f"Failed to stop YDB async pool: {e}")
+
+
+def get_connection_key(ydb_endpoint, ydb_database):
+    return (ydb_endpoint, ydb_database) + tuple(
+        os.getenv(name) for name in CREDENTIALS_ENV_VARIABLES
+    )
+
+
+def is_driver_healthy(driver, timeout=HEALTH_CHECK_TIMEOUT):
+    # returns immediately if the driver still has discovered endpoints
+    try:
+        driver.wait(fail_fast=True, timeout=timeout)
+    except Exception as e:
+        logger.warning(f"YDB driver is unhealthy: {e}")
+        return False
+    return True
+
+
+def close_cached_pool():
+    pool, driver = _cached["pool"], _cached["driver"]
+    _cached.update(key=None, driver=None, pool=None, backend=None)
+    # the sessions of the pool are closed with it
+    prepared_queries.clear()
+
+    try:
+        if pool is not None:
+            pool.stop(timeout=HEALTH_CHECK_TIMEOUT)
+        if driver is not None:
+            driver.stop(timeout=HEALTH_CHECK_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Failed to stop cached YDB pool: {e}")
+
+
+def get_cached_ydb_pool(ydb_endpoint, ydb_database, timeout=30):
+    """
+    Returns (pool, is_new), the pool is a YdbBackend. It is reused while the
+    endpoint, the database and the credentials stay the same and the driver
+    is healthy.
+    """
+    key = get_connection_key(ydb_endpoint, ydb_database)
+
+    if _cached["pool"] is not None:
+        if _cached["key"] == key and is_driver_healthy(_cached["driver"]):
+            return _cached["backend"], False
+
+        logger.info(
+            "Rebuilding YDB pool: connection settings changed or driver is unhealthy"
+        )
+        close_cached_pool()
+
+    driver = get_ydb_driver(ydb_endpoint, ydb_database, timeout)
+    pool = ydb.SessionPool(driver, initializer=warm_up_session)
+    backend = YdbBackend(pool, driver)
+    _cached.update(key=key, driver=driver, pool=pool, backend=backend)
+    return backend, True
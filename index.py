@@ -1,24 +1,82 @@
 import os
+import time
 
 import telebot
 
+import metrics
+from bot.dispatcher import dispatcher
 from bot.structure import create_bot
-from database.ydb_settings import get_ydb_pool
+from database.command_log import command_log
+from database.sqlite_backend import get_cached_sqlite_backend
+from database.utils import prepared_queries
+from database.vocab_cache import vocab_cache
+from database.ydb_settings import get_cached_ydb_pool
 from logs import logger
+from tracing import trace_recorder
 
 YDB_ENDPOINT = os.getenv("YDB_ENDPOINT")
 YDB_DATABASE = os.getenv("YDB_DATABASE")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# a local SQLite database file used instead of YDB if set
+SQLITE_PATH = os.getenv("SQLITE_PATH")
+
+# kept between warm invocations of the serverless function
+_cached = {
+    "key": None,
+    "pool": None,
+    "bot": None,
+}
+
+
+def get_cached_pool():
+    if SQLITE_PATH is not None:
+        return get_cached_sqlite_backend(SQLITE_PATH)
+    return get_cached_ydb_pool(YDB_ENDPOINT, YDB_DATABASE)
+
+
+def get_bot():
+    """
+    Returns the configured bot, building it (and the database pool) only on a cold start
+    or when the connection settings have changed.
+    """
+    start = time.perf_counter()
+    pool, is_new_pool = get_cached_pool()
+
+    key = (BOT_TOKEN, os.getenv("IS_TESTING"))
+    is_cold = is_new_pool or _cached["pool"] is not pool or _cached["key"] != key
+    if is_cold:
+        _cached.update(key=key, pool=pool, bot=create_bot(BOT_TOKEN, pool))
+
+    logger.info(
+        "{} start".format("Cold" if is_cold else "Warm"),
+        extra={
+            "is_cold_start": is_cold,
+            "is_new_pool": is_new_pool,
+            "setup_ms": round((time.perf_counter() - start) * 1000, 3),
+            "prepared_queries": prepared_queries.get_stats(),
+            "command_log": command_log.get_stats(),
+            "vocab_cache": vocab_cache.get_stats(),
+            "telegram": dispatcher.get_stats(),
+            "trace": trace_recorder.get_stats(),
+        },
+    )
+    return _cached["bot"]
 
 
 def handler(event, _):
-    logger.debug(f"New event: {event}")
+    logger.debug("New event: %s", event)
 
-    pool = get_ydb_pool(YDB_ENDPOINT, YDB_DATABASE)
-    bot = create_bot(BOT_TOKEN, pool)
+    bot = get_bot()
 
     message = telebot.types.Update.de_json(event["body"])
-    bot.process_new_updates([message])
+    trace_recorder.record(message)
+    with metrics.update_metrics(message.update_id):
+        try:
+            with bot.current_states.unit_of_work():
+                bot.process_new_updates([message])
+        finally:
+            # the reply has already been sent, the user doesn't wait for this
+            command_log.flush()
     return {
         "statusCode": 200,
         "body": "!",
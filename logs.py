@@ -1,7 +1,14 @@
+import inspect
 import logging
+import os
+import random
+import time
 import traceback
+from functools import wraps
 
+import ydb
 from pythonjsonlogger import jsonlogger
+from telebot import TeleBot
 from telebot.types import CallbackQuery, Message
 
 
@@ -15,17 +22,29 @@ class YcLoggingFormatter(jsonlogger.JsonFormatter):
         )
 
 
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+MAX_ARG_LENGTH = 200
+# too big to be rendered on every call, logged by type name only;
+# the storage backends of database.utils render themselves the same way
+NOT_RENDERED_TYPES = (
+    TeleBot,
+    ydb.SessionPool,
+    ydb.aio.SessionPool,
+    Message,
+    CallbackQuery,
+)
+
 logHandler = logging.StreamHandler()
 logHandler.setFormatter(YcLoggingFormatter("%(message)s %(level)s %(logger)s"))
 
 loggers = [logging.getLogger(name) for name in logging.root.manager.loggerDict]
 for logger in loggers:
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(LOG_LEVEL)
 
 logger = logging.getLogger("logger")
 logger.propagate = True
 logger.addHandler(logHandler)
-logger.setLevel(logging.DEBUG)
+logger.setLevel(LOG_LEVEL)
 
 
 def find_in_args(args, target_type):
@@ -50,7 +69,7 @@ def get_message_info(*args, **kwargs):
         call = find_in_args(args, CallbackQuery)
         chat_id, text = call.message.chat.id, call.message.text
     elif find_in_kwargs(kwargs, Message) is not None:
-        message = find_in_kwargs(args, Message)
+        message = find_in_kwargs(kwargs, Message)
         chat_id, text = message.chat.id, message.text
     elif find_in_kwargs(kwargs, CallbackQuery):
         call = find_in_kwargs(kwargs, CallbackQuery)
@@ -59,42 +78,111 @@ def get_message_info(*args, **kwargs):
     return chat_id, text
 
 
-def logged_execution(func):
-    def wrapper(*args, **kwargs):
-        chat_id, text = get_message_info(*args, **kwargs)
+def render_value(value):
+    if isinstance(value, NOT_RENDERED_TYPES):
+        return "<{}>".format(type(value).__name__)
+
+    rendered = repr(value)
+    if len(rendered) > MAX_ARG_LENGTH:
+        return rendered[:MAX_ARG_LENGTH] + "..."
+    return rendered
+
+
+def render_arguments(args, kwargs):
+    # only called when debug logging is enabled
+    return {
+        "arg": "({})".format(", ".join(render_value(arg) for arg in args)),
+        "kwarg": "{{{}}}".format(
+            ", ".join(
+                "{!r}: {}".format(key, render_value(value))
+                for key, value in kwargs.items()
+            )
+        ),
+    }
+
+
+class LoggedCall:
+    # one call of a function decorated with logged_execution
+    def __init__(self, func, sample_rate, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id, text = get_message_info(*args, **kwargs)
+        self.is_sampled = sample_rate >= 1.0 or random.random() < sample_rate
+        self.is_debug = logger.isEnabledFor(logging.DEBUG)
+        self.extra = {"text": text}
+        if self.is_debug and self.is_sampled:
+            self.extra.update(render_arguments(args, kwargs))
+
+        if self.is_sampled:
+            logger.info(
+                "[LOG] Starting {} - chat_id {}".format(func.__name__, self.chat_id),
+                extra=self.extra,
+            )
+        self.start = time.perf_counter()
 
-        logger.info(
-            "[LOG] Starting {} - chat_id {}".format(func.__name__, chat_id),
+    def finished(self, result):
+        if self.is_sampled:
+            self.extra["elapsed_ms"] = round(
+                (time.perf_counter() - self.start) * 1000, 3
+            )
+            if self.is_debug:
+                self.extra["result"] = render_value(result)
+            logger.info(
+                "[LOG] Finished {} - chat_id {}".format(
+                    self.func.__name__, self.chat_id
+                ),
+                extra=self.extra,
+            )
+        return result
+
+    def failed(self, e):
+        # called from the except block, the traceback is still available
+        if not self.is_sampled and self.is_debug:
+            self.extra.update(render_arguments(self.args, self.kwargs))
+        self.extra["elapsed_ms"] = round((time.perf_counter() - self.start) * 1000, 3)
+        logger.error(
+            "[LOG] Failed {} - chat_id {} - exception {}".format(
+                self.func.__name__, self.chat_id, e
+            ),
             extra={
-                "text": text,
-                "arg": "{}".format(args),
-                "kwarg": "{}".format(kwargs),
+                **self.extra,
+                "error": e,
+                "traceback": traceback.format_exc(),
             },
         )
+
+
+def logged_execution(func=None, sample_rate=1.0):
+    """
+    Logs start, finish (with elapsed time) and failure of the function.
+    Start and finish are logged for a `sample_rate` share of calls, failures always.
+    Arguments are rendered only if debug logging is enabled.
+    Coroutine functions are logged when they are awaited.
+
+    Use as `@logged_execution` or `@logged_execution(sample_rate=0.1)`.
+    """
+    if func is None:
+        return lambda func: logged_execution(func, sample_rate)
+
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            call = LoggedCall(func, sample_rate, args, kwargs)
+            try:
+                return call.finished(await func(*args, **kwargs))
+            except Exception as e:
+                call.failed(e)
+
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        call = LoggedCall(func, sample_rate, args, kwargs)
         try:
-            result = func(*args, **kwargs)
-            logger.info(
-                "[LOG] Finished {} - chat_id {}".format(func.__name__, chat_id),
-                extra={
-                    "text": text,
-                    "arg": "{}".format(args),
-                    "kwarg": "{}".format(kwargs),
-                    "result": str(result),
-                },
-            )
-            return result
+            return call.finished(func(*args, **kwargs))
         except Exception as e:
-            logger.error(
-                "[LOG] Failed {} - chat_id {} - exception {}".format(
-                    func.__name__, chat_id, e
-                ),
-                extra={
-                    "text": text,
-                    "arg": "{}".format(args),
-                    "kwarg": "{}".format(kwargs),
-                    "error": e,
-                    "traceback": traceback.format_exc(),
-                },
-            )
+            call.failed(e)
 
     return wrapper
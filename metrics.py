@@ -0,0 +1,206 @@
+import bisect
+import inspect
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse
+
+from telebot import apihelper
+
+from logs import logger
+
+# upper bounds of histogram buckets, ms
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+IS_HISTOGRAMS_ENABLED = os.getenv("METRICS_HISTOGRAMS") is not None
+
+
+class UpdateMetrics:
+    """
+    Everything measured while a single update is being processed.
+    """
+
+    def __init__(self, update_id):
+        self.update_id = update_id
+        self.start = time.perf_counter()
+        self.handlers_ms = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.durations_ms = defaultdict(float)
+
+    def observe(self, name, elapsed_ms):
+        self.counts[name] += 1
+        self.durations_ms[name] += elapsed_ms
+
+    def to_dict(self):
+        return {
+            "update_id": self.update_id,
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "handlers_ms": {k: round(v, 3) for k, v in self.handlers_ms.items()},
+            "counts": dict(self.counts),
+            "durations_ms": {k: round(v, 3) for k, v in self.durations_ms.items()},
+        }
+
+
+class Histogram:
+    def __init__(self, buckets=HISTOGRAM_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class HistogramRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(Histogram)
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.histograms[key].observe(value)
+
+    def render(self):
+        """
+        Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                labels_text = "".join('{}="{}",'.format(k, v) for k, v in labels)
+                cumulative = 0
+                for bound, bucket_count in zip(
+                    histogram.buckets + ["+Inf"], histogram.counts
+                ):
+                    cumulative += bucket_count
+                    lines.append(
+                        '{}_bucket{{{}le="{}"}} {}'.format(
+                            name, labels_text, bound, cumulative
+                        )
+                    )
+                labels_text = "{" + labels_text.rstrip(",") + "}"
+                lines.append("{}_sum{} {}".format(name, labels_text, histogram.sum))
+                lines.append("{}_count{} {}".format(name, labels_text, histogram.count))
+        return "\n".join(lines) + "\n"
+
+
+histograms = HistogramRegistry()
+# a context variable rather than a thread local: concurrent updates of the
+# asyncio mode share a thread, and asyncio.to_thread copies the context
+current_metrics = ContextVar("current_metrics", default=None)
+
+
+def get_current():
+    return current_metrics.get()
+
+
+@contextmanager
+def update_metrics(update_id):
+    """
+    Collects metrics of one update and logs them as one JSON line on exit.
+    """
+    current = UpdateMetrics(update_id)
+    token = current_metrics.set(current)
+    try:
+        yield current
+    finally:
+        current_metrics.reset(token)
+        result = current.to_dict()
+        logger.info("Update metrics", extra={"metrics": result})
+
+        if IS_HISTOGRAMS_ENABLED:
+            histograms.observe("update_duration_ms", {}, result["total_ms"])
+            for handler, elapsed_ms in result["handlers_ms"].items():
+                histograms.observe(
+                    "handler_duration_ms", {"handler": handler}, elapsed_ms
+                )
+
+
+@contextmanager
+def track(name):
+    """
+    Counts and times a call (a YDB query, a Telegram API request) if an
+    update is being measured.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        current = get_current()
+        if current is not None:
+            current.observe(name, elapsed_ms)
+        if IS_HISTOGRAMS_ENABLED:
+            histograms.observe("call_duration_ms", {"call": name}, elapsed_ms)
+
+
+def count(name, value=1):
+    current = get_current()
+    if current is not None:
+        current.counts[name] += value
+
+
+def observe_handler(name, start):
+    current = get_current()
+    if current is not None:
+        current.handlers_ms[name] += (time.perf_counter() - start) * 1000
+
+
+def timed_handler(func, name):
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                observe_handler(name, start)
+
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe_handler(name, start)
+
+    return wrapper
+
+
+def send_telegram_request(method, url, **kwargs):
+    # called by bot.dispatcher, which is telebot's apihelper.CUSTOM_REQUEST_SENDER
+    with track("telegram." + urlparse(url).path.rsplit("/", 1)[-1]):
+        return apihelper._get_req_session().request(method, url, **kwargs)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = histograms.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_histograms(port):
+    """
+    Exposes the histograms for a local scraper at http://localhost:{port}/.
+    """
+    server = HTTPServer(("localhost", port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
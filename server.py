@@ -0,0 +1,329 @@
+"""
+A long-running alternative to the serverless index.handler:
+
+    python server.py --mode webhook --port 8080
+    python server.py --mode polling
+
+Updates are dispatched to a pool of worker threads. The updates of one chat are
+processed one at a time in the order they came, as the chat state is read and
+written as a whole; different chats are processed in parallel.
+"""
+
+import argparse
+import os
+import signal
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import telebot
+from telebot import apihelper
+
+import metrics
+from bot.structure import create_bot
+from database.command_log import command_log
+from database.sqlite_backend import SQLiteBackend
+from database.ydb_settings import get_ydb_pool
+from logs import logger
+
+YDB_ENDPOINT = os.getenv("YDB_ENDPOINT")
+YDB_DATABASE = os.getenv("YDB_DATABASE")
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+# a local SQLite database file used instead of YDB if set
+SQLITE_PATH = os.getenv("SQLITE_PATH")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# e.g. a local stub of the Bot API for load tests, "http://localhost:8081/bot{0}/{1}"
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+N_WORKERS = 16
+# updates accepted but not processed yet; webhook requests are rejected above it
+MAX_PENDING = 1000
+SUBMIT_TIMEOUT_S = 1
+LONG_POLL_TIMEOUT_S = 30
+DRAIN_TIMEOUT_S = 30
+
+
+class ChatOrderedWorkerPool:
+    """
+    Every chat has a queue of its updates. A chat with pending updates is
+    handed to one worker at a time, which processes one update and reschedules
+    the chat if it has more: the updates of a chat keep their order, while
+    a long backlog of one chat doesn't hold the others back.
+    """
+
+    def __init__(self, process, n_workers=N_WORKERS, max_pending=MAX_PENDING):
+        self.process = process
+        self.n_workers = n_workers
+        self.max_pending = max_pending
+        self.condition = threading.Condition()
+        self.chat_queues = {}
+        self.ready_chats = deque()
+        # worker thread -> the update it is processing
+        self.in_progress = {}
+        self.n_pending = 0
+        self.n_processed = 0
+        self.n_rejected = 0
+        self.n_failed = 0
+        self.is_accepting = True
+        self.is_stopped = False
+        self.workers = []
+
+    def start(self):
+        for i in range(self.n_workers):
+            worker = threading.Thread(target=self.work, name="worker-{}".format(i))
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, chat_id, update, timeout=None):
+        """
+        Waits up to `timeout` seconds (forever if None) while the pool is full.
+        Returns False if the update was not accepted.
+        """
+        with self.condition:
+            has_room = self.condition.wait_for(
+                lambda: self.n_pending < self.max_pending or not self.is_accepting,
+                timeout,
+            )
+            if not has_room or not self.is_accepting:
+                self.n_rejected += 1
+                return False
+
+            if chat_id not in self.chat_queues:
+                self.chat_queues[chat_id] = deque()
+                self.ready_chats.append(chat_id)
+            self.chat_queues[chat_id].append(update)
+            self.n_pending += 1
+            self.condition.notify_all()
+        return True
+
+    def work(self):
+        worker = threading.get_ident()
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.ready_chats or self.is_stopped)
+                # once stopped, the updates left in the queues are not taken
+                if self.is_stopped:
+                    return
+                chat_id = self.ready_chats.popleft()
+                # the chat stays in chat_queues: new updates wait for this one
+                update = self.chat_queues[chat_id].popleft()
+                self.in_progress[worker] = update
+
+            try:
+                self.process(update)
+            except Exception as e:
+                logger.error(f"Failed to process update {update.update_id}: {e}")
+                with self.condition:
+                    self.n_failed += 1
+
+            with self.condition:
+                del self.in_progress[worker]
+                if self.chat_queues[chat_id]:
+                    self.ready_chats.append(chat_id)
+                else:
+                    del self.chat_queues[chat_id]
+                self.n_pending -= 1
+                self.n_processed += 1
+                self.condition.notify_all()
+
+    def drain(self, timeout=DRAIN_TIMEOUT_S):
+        """
+        Stops accepting updates, waits for the accepted ones to be processed
+        and stops the workers: after the timeout they finish the updates they
+        are processing and take no new ones. Returns the number of updates
+        left unprocessed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            self.is_accepting = False
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: self.n_pending == 0, timeout)
+            self.is_stopped = True
+            self.condition.notify_all()
+            n_left = self.n_pending
+
+        # one deadline for all the workers, not a timeout for each of them
+        for worker in self.workers:
+            worker.join(
+                None if deadline is None else max(0, deadline - time.monotonic())
+            )
+        return n_left
+
+    def get_unprocessed(self):
+        # the updates being processed and the ones that will never be
+        with self.condition:
+            return list(self.in_progress.values()) + [
+                update for queue in self.chat_queues.values() for update in queue
+            ]
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                "pending": self.n_pending,
+                "chats": len(self.chat_queues),
+                "processed": self.n_processed,
+                "rejected": self.n_rejected,
+                "failed": self.n_failed,
+            }
+
+
+def get_chat_id(update):
+    for message in [
+        update.message,
+        update.edited_message,
+        update.channel_post,
+        update.edited_channel_post,
+    ]:
+        if message is not None:
+            return message.chat.id
+    if update.callback_query is not None and update.callback_query.message:
+        return update.callback_query.message.chat.id
+    # the updates without a chat don't touch any state
+    return None
+
+
+def make_processor(bot):
+    def process(update):
+        with metrics.update_metrics(update.update_id):
+            with bot.current_states.unit_of_work():
+                bot.process_new_updates([update])
+
+    return process
+
+
+def make_webhook_handler(workers):
+    class WebhookRequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            secret = self.headers.get("X-Telegram-Bot-Api-Secret-Token")
+            if WEBHOOK_SECRET is not None and secret != WEBHOOK_SECRET:
+                self.reply(403)
+                return
+
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                update = telebot.types.Update.de_json(body.decode())
+            except (ValueError, KeyError) as e:
+                logger.warning(f"Bad webhook request: {e}")
+                self.reply(400)
+                return
+
+            # Telegram retries the update later if it is not accepted
+            if workers.submit(get_chat_id(update), update, SUBMIT_TIMEOUT_S):
+                self.reply(200)
+            else:
+                self.reply(503)
+
+        def reply(self, code):
+            self.send_response(code)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookRequestHandler
+
+
+def serve_webhook(workers, host, port, stop_event):
+    server = ThreadingHTTPServer((host, port), make_webhook_handler(workers))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Listening for webhook requests on {host}:{port}")
+    stop_event.wait()
+    server.shutdown()
+    server.server_close()
+
+
+def poll_updates(bot, workers, stop_event):
+    """
+    Long-polls getUpdates. The offset only moves past the updates handed
+    to the workers, a full pool makes the polling wait. Returns the offset
+    of the next update, None if there has been none.
+    """
+    offset = None
+    while not stop_event.is_set():
+        try:
+            updates = bot.get_updates(offset=offset, timeout=LONG_POLL_TIMEOUT_S)
+        except Exception as e:
+            logger.error(f"Failed to get updates: {e}")
+            stop_event.wait(1)
+            continue
+
+        for update in updates:
+            if not workers.submit(get_chat_id(update), update):
+                return offset  # draining
+            offset = update.update_id + 1
+    return offset
+
+
+def acknowledge_updates(bot, offset, unprocessed):
+    """
+    Confirms the processed updates to Telegram, which would send them again
+    to the next run otherwise. A getUpdates call confirms all the updates
+    before its offset, so the first unprocessed one and those after it are
+    left to the next run.
+    """
+    if unprocessed:
+        offset = min(update.update_id for update in unprocessed)
+    if offset is None:
+        return
+    try:
+        bot.get_updates(offset=offset, limit=1, timeout=0)
+    except Exception as e:
+        logger.error(f"Failed to acknowledge updates before {offset}: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["webhook", "polling"], default="webhook")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=N_WORKERS)
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING)
+    parser.add_argument(
+        "--delete-webhook",
+        action="store_true",
+        help="getUpdates doesn't work while a webhook is set",
+    )
+    args = parser.parse_args()
+
+    if TELEGRAM_API_URL is not None:
+        apihelper.API_URL = TELEGRAM_API_URL
+
+    if SQLITE_PATH is not None:
+        pool = SQLiteBackend(SQLITE_PATH, pool_size=args.workers)
+    else:
+        pool = get_ydb_pool(YDB_ENDPOINT, YDB_DATABASE)
+    bot = create_bot(BOT_TOKEN, pool)
+    workers = ChatOrderedWorkerPool(make_processor(bot), args.workers, args.max_pending)
+    workers.start()
+
+    stop_event = threading.Event()
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, lambda *_: stop_event.set())
+
+    offset = None
+    if args.mode == "webhook":
+        serve_webhook(workers, args.host, args.port, stop_event)
+    else:
+        if args.delete_webhook:
+            bot.remove_webhook()
+        offset = poll_updates(bot, workers, stop_event)
+
+    start = time.perf_counter()
+    n_left = workers.drain()
+    if args.mode == "polling":
+        acknowledge_updates(bot, offset, workers.get_unprocessed())
+    command_log.flush()
+    logger.info(
+        "Stopped",
+        extra={
+            "drain_ms": round((time.perf_counter() - start) * 1000, 3),
+            "unprocessed": n_left,
+            "workers": workers.get_stats(),
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import asyncio
+import sys
+
+import pytest
+from telebot import asyncio_helper
+
+sys.path.append("../")
+import metrics
+from bot import dispatcher as dispatcher_module
+from bot.dispatcher import PER_CHAT_BURST, Dispatcher, install_async
+
+CHAT_ID = 1
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    """
+    Replaces the aiohttp requests of AsyncTeleBot and the waits of the
+    dispatcher, returns the sent requests and the waits.
+    """
+    sent = []
+    sleeps = []
+    responses = []
+
+    async def process_request(token, url, method, params, files, request_timeout):
+        sent.append((url, params))
+        if responses:
+            raise responses.pop(0)
+        return {"message_id": len(sent)}
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(asyncio_helper, "_process_request", process_request)
+    monkeypatch.setattr(dispatcher_module.asyncio, "sleep", sleep)
+    monkeypatch.setattr(dispatcher_module, "dispatcher", Dispatcher())
+    install_async()
+    return sent, sleeps, responses
+
+
+def send_messages(n_messages):
+    async def send():
+        with metrics.update_metrics(update_id=1) as current:
+            for i in range(n_messages):
+                await asyncio_helper.send_message("token", CHAT_ID, str(i))
+        return current
+
+    return asyncio.run(send())
+
+
+def test_async_messages_are_throttled_and_counted(requests):
+    sent, sleeps, _ = requests
+    n_messages = PER_CHAT_BURST + 2
+
+    current = send_messages(n_messages)
+
+    assert len(sent) == n_messages
+    # the messages beyond the burst of the chat wait for its bucket
+    assert len(sleeps) == 2
+    assert current.counts["telegram.sendMessage"] == n_messages
+    assert current.counts["telegram.throttled_ms"] > 0
+    assert dispatcher_module.dispatcher.get_stats()["throttled_ms"] > 0
+
+
+def test_async_message_is_retried_after_429(requests):
+    sent, sleeps, responses = requests
+    result_json = {
+        "ok": False,
+        "error_code": 429,
+        "description": "Too Many Requests: retry after 2",
+        "parameters": {"retry_after": 2},
+    }
+    responses.append(
+        asyncio_helper.ApiTelegramException("sendMessage", None, result_json)
+    )
+
+    current = send_messages(1)
+
+    assert len(sent) == 2
+    assert sleeps == [2]
+    assert current.counts["telegram.retries"] == 1
+    assert current.counts["telegram.sendMessage"] == 2
+    assert dispatcher_module.dispatcher.get_stats()["retries"] == 1
@@ -0,0 +1,78 @@
+import json
+import sys
+import tracemalloc
+
+import pytest
+
+sys.path.append("../")
+import database.model as db_model
+from bot import exporting, importing
+from database.sqlite_backend import SQLiteBackend
+
+CHAT_ID = 1
+LANGUAGE = "spanish"
+
+
+def make_backend(path, n_words):
+    backend = SQLiteBackend(str(path))
+    db_model.update_vocab(
+        backend,
+        CHAT_ID,
+        LANGUAGE,
+        ["word{}".format(i) for i in range(n_words)],
+        [json.dumps(["translation{}".format(i), "other"]) for i in range(n_words)],
+        bucket_size=10000,
+    )
+    return backend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = make_backend(tmp_path / "export.sqlite", 10)
+    yield backend
+    backend.close()
+
+
+def test_export_memory_is_bounded(tmp_path):
+    backend = make_backend(tmp_path / "export.sqlite", 100000)
+    try:
+        tracemalloc.start()
+        rows = db_model.export_vocab(backend, CHAT_ID, LANGUAGE)
+        buffer, n_words = exporting.export_rows(
+            rows, "jsonl", max_in_memory_size=1024 * 1024
+        )
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        backend.close()
+
+    with buffer:
+        size = buffer.seek(0, 2)
+        assert n_words == 100000
+        assert size > 10 * 1024 * 1024
+        # neither the vocabulary nor the file are held in memory as a whole
+        assert peak < 5 * 1024 * 1024
+
+
+def test_export_csv_can_be_imported(backend):
+    rows = db_model.export_vocab(backend, CHAT_ID, LANGUAGE)
+    buffer, n_words = exporting.export_rows(rows, "csv")
+    with buffer:
+        content = buffer.read()
+
+    errors = []
+    batches = list(importing.parse_import_file(content, 100, errors))
+    assert n_words == 10
+    assert errors == []
+    assert ("word3", json.dumps(["translation3", "other"])) in batches[0]
+
+
+def test_export_jsonl(backend):
+    rows = db_model.export_vocab(backend, CHAT_ID, LANGUAGE)
+    buffer, _ = exporting.export_rows(rows, "jsonl")
+    with buffer:
+        lines = buffer.read().decode().strip().split("\n")
+
+    assert len(lines) == 10
+    words = {json.loads(line)["word"]: json.loads(line) for line in lines}
+    assert words["word1"]["translations"] == ["translation1", "other"]
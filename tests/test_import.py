@@ -0,0 +1,84 @@
+import json
+import sys
+
+import pytest
+
+sys.path.append("../")
+import database.model as db_model
+from bot import importing
+from database.sqlite_backend import SQLiteBackend
+
+CHAT_ID = 1
+LANGUAGE = "spanish"
+
+
+def test_import_rejects_other_encodings_before_the_first_batch():
+    content = "\n".join("слово{},word{}".format(i, i) for i in range(3000))
+    with pytest.raises(UnicodeDecodeError):
+        importing.parse_import_file(content.encode("cp1251"), 1000, [])
+
+
+def test_import_skips_only_leading_anki_headers():
+    content = (
+        "#separator:Comma\n#html:true\n#hashtag,#\n#tag:value,tag\nword,translation\n"
+    )
+    errors = []
+    batches = list(importing.parse_import_file(content.encode(), 100, errors))
+    assert errors == []
+    assert batches == [
+        [
+            ("#hashtag", json.dumps(["#"])),
+            ("#tag:value", json.dumps(["tag"])),
+            ("word", json.dumps(["translation"])),
+        ]
+    ]
+
+
+def import_file(backend, content):
+    existing_words = []
+    for batch in importing.parse_import_file(content.encode(), 100, []):
+        existing_words += db_model.add_new_words(
+            backend,
+            CHAT_ID,
+            LANGUAGE,
+            [word for word, _ in batch],
+            [translation for _, translation in batch],
+        )
+    return existing_words
+
+
+def get_vocab(backend):
+    return {
+        row["word"]: row for row in db_model.get_full_vocab(backend, CHAT_ID, LANGUAGE)
+    }
+
+
+def test_reimport_keeps_the_training_history(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "import.sqlite"))
+    try:
+        db_model.create_user(backend, CHAT_ID)
+        assert import_file(backend, "hola,hello\nadios,bye\n") == []
+
+        session_id = 1_700_000_000
+        db_model.create_training_session(
+            backend, CHAT_ID, session_id, "random", LANGUAGE, "to", 10
+        )
+        words = db_model.get_training_words(backend, CHAT_ID, session_id)
+        db_model.set_training_scores(
+            backend, CHAT_ID, session_id, [w["word_idx"] for w in words], [1, 1]
+        )
+        db_model.update_final_scores(backend, CHAT_ID, session_id, LANGUAGE, "to")
+        trained = get_vocab(backend)["hola"]
+
+        existing_words = import_file(backend, "hola,hi\nbuenas,good evening\n")
+        assert existing_words == ["hola"]
+
+        vocab = get_vocab(backend)
+        assert sorted(vocab) == ["adios", "buenas", "hola"]
+        assert vocab["hola"].to_dict() == trained.to_dict()
+        assert vocab["hola"]["n_trains_to"] == 1
+        assert vocab["buenas"]["n_trains_to"] is None
+        stats = db_model.get_vocabulary_stats(backend, CHAT_ID, LANGUAGE)
+        assert stats["n_words"] == 3
+    finally:
+        backend.close()
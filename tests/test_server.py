@@ -0,0 +1,70 @@
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.append("../")
+from server import ChatOrderedWorkerPool, acknowledge_updates
+
+
+def make_update(update_id):
+    return SimpleNamespace(update_id=update_id)
+
+
+def test_updates_of_a_chat_are_processed_in_order():
+    processed = {}
+    lock = threading.Lock()
+
+    def process(item):
+        chat_id, update = item
+        time.sleep(0.001 * (update.update_id % 3))
+        with lock:
+            processed.setdefault(chat_id, []).append(update.update_id)
+
+    workers = ChatOrderedWorkerPool(process, n_workers=8)
+    workers.start()
+    for update_id in range(200):
+        chat_id = update_id % 5
+        workers.submit(chat_id, (chat_id, make_update(update_id)))
+
+    assert workers.drain(10) == 0
+    assert workers.get_stats()["processed"] == 200
+    for chat_id, update_ids in processed.items():
+        assert update_ids == list(range(chat_id, 200, 5))
+
+
+def test_drain_stops_the_workers_at_one_deadline():
+    def process(update):
+        time.sleep(0.5)
+
+    workers = ChatOrderedWorkerPool(process, n_workers=4)
+    workers.start()
+    for update_id in range(40):
+        workers.submit(update_id % 4, make_update(update_id))
+
+    start = time.monotonic()
+    n_left = workers.drain(0.2)
+    elapsed = time.monotonic() - start
+
+    # the workers are not waited for one timeout after another
+    assert elapsed < 0.4
+    assert n_left == 40
+    assert len(workers.get_unprocessed()) == 40
+    assert not workers.submit(0, make_update(100))
+
+    # the updates in progress are finished, no new ones are taken
+    for worker in workers.workers:
+        worker.join()
+    assert workers.get_stats()["processed"] == 4
+    assert len(workers.get_unprocessed()) == 36
+
+
+def test_only_the_processed_updates_are_acknowledged():
+    calls = []
+    bot = SimpleNamespace(get_updates=lambda **kwargs: calls.append(kwargs))
+
+    acknowledge_updates(bot, 10, [make_update(7), make_update(5)])
+    acknowledge_updates(bot, 10, [])
+    acknowledge_updates(bot, None, [])
+
+    assert [call["offset"] for call in calls] == [5, 10]
@@ -49,7 +49,9 @@ def test_set_second_language(test_client, chat_id):
 
     with utils.CommandContext(test_client, chat_id, "/show_languages") as command:
         command.expect_next(
-            texts.available_languages.format(2, "💚 en->chinese\n🖤 rus->fi")
+            texts.available_languages.format(
+                2, "💚 en->chinese - 0 word(s)\n🖤 rus->fi - 0 word(s)"
+            )
         )
 
 
@@ -68,7 +70,10 @@ def test_set_third_language(test_client, chat_id):
 
     with utils.CommandContext(test_client, chat_id, "/show_languages") as command:
         command.expect_next(
-            texts.available_languages.format(3, "💚 cba->abc\n🖤 en->chinese\n🖤 rus->fi")
+            texts.available_languages.format(
+                3,
+                "💚 cba->abc - 0 word(s)\n🖤 en->chinese - 0 word(s)\n🖤 rus->fi - 0 word(s)",
+            )
         )
 
 
@@ -81,5 +86,7 @@ def test_delete_language(test_client, chat_id):
 
     with utils.CommandContext(test_client, chat_id, "/show_languages") as command:
         command.expect_next(
-            texts.available_languages.format(2, "🖤 en->chinese\n🖤 rus->fi")
+            texts.available_languages.format(
+                2, "🖤 en->chinese - 0 word(s)\n🖤 rus->fi - 0 word(s)"
+            )
         )
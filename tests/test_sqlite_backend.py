@@ -0,0 +1,214 @@
+import sys
+
+import pytest
+
+sys.path.append("../")
+import database.model as db_model
+from bot.states import StateYDBStorage
+from database import queries, sqlite_queries
+from database.sqlite_backend import SQLiteBackend
+from database.utils import StorageBackend
+
+CHAT_ID = 1
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "backend.sqlite"))
+    db_model.create_user(backend, CHAT_ID)
+    yield backend
+    backend.close()
+
+
+def get_queries():
+    for name, value in vars(queries).items():
+        if name.startswith("_") or name.isupper():
+            continue
+        if isinstance(value, str):
+            yield name, value
+        elif isinstance(value, dict):
+            for key, query in value.items():
+                yield "{}[{}]".format(name, key), query
+        elif isinstance(value, list):
+            for i, query in enumerate(value):
+                yield "{}[{}]".format(name, i), query
+
+
+@pytest.mark.parametrize("name,query", list(get_queries()))
+def test_every_query_has_an_implementation(name, query):
+    assert (
+        query in sqlite_queries.IMPLEMENTATIONS or query in sqlite_queries.SCAN_QUERIES
+    )
+
+
+def test_queries_are_found_by_identity():
+    query = queries.get_user_state
+    assert sqlite_queries.IMPLEMENTATIONS.get(query) is not None
+    # the same text built elsewhere is not one of the constants
+    assert sqlite_queries.IMPLEMENTATIONS.get("".join(list(query))) is None
+
+
+def test_backend_must_implement_every_method():
+    class PartialBackend(StorageBackend):
+        def execute_update_query(self, query, params=None):
+            pass
+
+    with pytest.raises(TypeError):
+        PartialBackend()
+
+
+def test_state_write_bumps_the_version(backend):
+    state, version = db_model.get_state_with_version(backend, CHAT_ID)
+    assert state is None
+
+    db_model.set_state_if_version(backend, CHAT_ID, {"state": "a"}, version)
+    state, new_version = db_model.get_state_with_version(backend, CHAT_ID)
+    assert state == {"state": "a"}
+    assert new_version == version + 1
+
+
+def test_concurrent_state_write_conflicts(backend):
+    _, version = db_model.get_state_with_version(backend, CHAT_ID)
+    db_model.set_state_if_version(backend, CHAT_ID, {"state": "first"}, version)
+
+    # the second write was based on the same version
+    with pytest.raises(db_model.StateConflictError):
+        db_model.set_state_if_version(backend, CHAT_ID, {"state": "second"}, version)
+    assert db_model.get_state(backend, CHAT_ID) == {"state": "first"}
+
+
+def test_state_storage_drops_the_conflicting_write(backend):
+    storage = StateYDBStorage(backend)
+    with storage.unit_of_work():
+        storage.set_state(CHAT_ID, CHAT_ID, "mine")
+        # another update of the chat saves its state in the meantime
+        _, version = db_model.get_state_with_version(backend, CHAT_ID)
+        db_model.set_state_if_version(
+            backend, CHAT_ID, {"state": "theirs", "data": {}}, version
+        )
+
+    assert storage.get_state(CHAT_ID, CHAT_ID) == "theirs"
+    # the storage keeps working after the conflict
+    with storage.unit_of_work():
+        storage.set_state(CHAT_ID, CHAT_ID, "next")
+    assert storage.get_state(CHAT_ID, CHAT_ID) == "next"
+
+
+def get_vocab_row(backend, word):
+    with backend.pool.connection() as connection:
+        return connection.execute(
+            f"SELECT * FROM {queries.VOCABS_TABLE_PATH} WHERE chat_id = ? AND word = ?",
+            (CHAT_ID, word),
+        ).fetchone()
+
+
+def train(backend, session_id, score):
+    db_model.create_training_session(
+        backend, CHAT_ID, session_id, "random", "spanish", "to", 10
+    )
+    db_model.set_training_scores(backend, CHAT_ID, session_id, [1], [score])
+    db_model.update_final_scores(backend, CHAT_ID, session_id, "spanish", "to")
+
+
+def test_training_schedules_the_next_review(backend):
+    db_model.update_vocab(
+        backend, CHAT_ID, "spanish", ["hola"], ['["hello"]'], bucket_size=10
+    )
+    day = queries.SECONDS_IN_DAY
+
+    first_session = 1_700_000_000
+    train(backend, first_session, 1)
+    row = get_vocab_row(backend, "hola")
+    assert row["next_review"] == first_session + day
+    assert row["easiness"] == pytest.approx(queries.SM2_DEFAULT_EASINESS)
+    assert row["score_to"] == 1
+
+    second_session = first_session + day
+    train(backend, second_session, 1)
+    row = get_vocab_row(backend, "hola")
+    assert row["next_review"] == second_session + 6 * day
+    assert row["easiness"] == pytest.approx(queries.SM2_DEFAULT_EASINESS)
+    assert row["n_trains_to"] == 2
+
+    # a wrong answer starts the schedule over and makes the word harder
+    third_session = second_session + 6 * day
+    train(backend, third_session, 0)
+    row = get_vocab_row(backend, "hola")
+    assert row["next_review"] == third_session + day
+    assert row["easiness"] == pytest.approx(
+        queries.SM2_DEFAULT_EASINESS + queries.SM2_EASINESS_DELTA_WRONG
+    )
+
+
+def test_training_session_includes_the_words_without_a_random_key(backend):
+    words = ["uno", "dos", "tres"]
+    db_model.update_vocab(
+        backend, CHAT_ID, "spanish", words, ['["x"]'] * len(words), bucket_size=10
+    )
+    # the words added before the random key existed
+    with backend.pool.connection() as connection:
+        connection.execute(f"UPDATE {queries.VOCABS_TABLE_PATH} SET random_key = NULL")
+
+    db_model.create_training_session(
+        backend, CHAT_ID, 1_700_000_000, "random", "spanish", "to", 10
+    )
+    session_words = db_model.get_training_words(backend, CHAT_ID, 1_700_000_000)
+    assert sorted(word["word"] for word in session_words) == sorted(words)
+
+
+def get_expected_sort_key(word, sort_key):
+    scores = [
+        word["score_{}".format(direction)] / word["n_trains_{}".format(direction)]
+        for direction in ["from", "to"]
+        if word["score_{}".format(direction)] is not None
+        and word["n_trains_{}".format(direction)]
+    ]
+    score = sum(scores) / len(scores) if scores else None
+    n_trains = (word["n_trains_from"] or 0) + (word["n_trains_to"] or 0)
+    return {
+        "word": word["word"],
+        "NVL(score, -1.0)": -1.0 if score is None else score,
+        "NVL(score, 2.0)": 2.0 if score is None else score,
+        "n_trains": n_trains,
+        "added_timestamp": word["added_timestamp"],
+    }[sort_key]
+
+
+@pytest.mark.parametrize("sorting", list(queries.VOCAB_SORTINGS))
+def test_vocab_pages_follow_the_trainings(backend, sorting):
+    words = ["word{}".format(i) for i in range(7)]
+    db_model.update_vocab(
+        backend, CHAT_ID, "spanish", words, ['["x"]'] * len(words), bucket_size=10
+    )
+    session_id = 1_700_000_000
+    db_model.create_training_session(
+        backend, CHAT_ID, session_id, "random", "spanish", "to", 5
+    )
+    db_model.set_training_scores(backend, CHAT_ID, session_id, [1, 2, 3], [1, 0, 1])
+    db_model.update_final_scores(backend, CHAT_ID, session_id, "spanish", "to")
+    db_model.create_training_session(
+        backend, CHAT_ID, session_id + 1, "random", "spanish", "from", 4
+    )
+    db_model.set_training_scores(backend, CHAT_ID, session_id + 1, [1, 2], [1, 1])
+    db_model.update_final_scores(backend, CHAT_ID, session_id + 1, "spanish", "from")
+
+    sort_key, _, is_descending = queries.VOCAB_SORTINGS[sorting]
+    expected = [
+        word["word"]
+        for word in sorted(
+            db_model.get_full_vocab(backend, CHAT_ID, "spanish"),
+            key=lambda word: (get_expected_sort_key(word, sort_key), word["word"]),
+            reverse=is_descending,
+        )
+    ]
+
+    pages, cursor = [], None
+    while True:
+        page = db_model.get_vocab_page(
+            backend, CHAT_ID, "spanish", sorting, cursor, limit=2
+        )
+        pages += [word["word"] for word in page]
+        if len(page) < 2:
+            break
+        cursor = [page[-1]["sort_key"], page[-1]["word"]]
+    assert pages == expected
@@ -0,0 +1,106 @@
+import json
+import sys
+
+sys.path.append("../")
+import database.model as db_model
+import word as word_utils
+from bot import common
+from database.sqlite_backend import SQLiteBackend
+
+CHAT_ID = 1
+LANGUAGE = "spanish"
+SESSION_ID = 1_700_000_000
+
+
+def get_buttons(markup):
+    return [button["text"] for row in markup.keyboard for button in row]
+
+
+def test_old_test_training_gets_the_wrong_options(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "train.sqlite"))
+    try:
+        db_model.create_user(backend, CHAT_ID)
+        words = ["uno", "dos", "tres", "cuatro", "cinco"]
+        translations = ["one", "two", "three", "four", "five"]
+        db_model.update_vocab(
+            backend,
+            CHAT_ID,
+            LANGUAGE,
+            words,
+            [json.dumps([translation]) for translation in translations],
+        )
+        db_model.create_training_session(
+            backend, CHAT_ID, SESSION_ID, "random", LANGUAGE, "to", 10
+        )
+        session_words = db_model.get_training_words(backend, CHAT_ID, SESSION_ID)
+
+        # the state of a training started before the words were moved out of it
+        data = {
+            "words": [
+                {"word": word["word"], "translation": word["translation"]}
+                for word in session_words
+            ],
+            "step": 2,
+            "scores": [1, 0],
+            "hints": "test",
+            "direction": "to",
+        }
+        word_utils.upgrade_train_state(data)
+        assert data["n_words"] == len(words)
+        assert data["scores"] == 0b01
+
+        # what a step of the training reads
+        with db_model.Batch(backend) as batch:
+            step_words = batch.get_training_words_by_idx(
+                CHAT_ID, SESSION_ID, [data["step"] + 1]
+            )
+            candidates = batch.get_random_words(CHAT_ID, LANGUAGE)
+        (next_word,) = step_words.value
+        assert next_word["distractors"] is None
+
+        _, markup = common.format_train_step(next_word, "test", "to", candidates.value)
+        buttons = get_buttons(markup)
+        assert len(set(buttons)) == 4
+        assert next_word["word"] in buttons
+        assert set(buttons) <= set(words)
+    finally:
+        backend.close()
+
+
+def test_other_translations_of_the_answer_are_not_offered():
+    word = {
+        "word": "hola",
+        "translation": json.dumps(["hello", "hi"]),
+        "distractors": None,
+    }
+    candidates = [
+        {"word": "hola", "translation": json.dumps(["hello", "hi"])},
+        {"word": "buenas", "translation": json.dumps(["hi"])},
+        {"word": "saludos", "translation": json.dumps(["hello"])},
+        {"word": "adios", "translation": json.dumps(["bye"])},
+        {"word": "gato", "translation": json.dumps(["cat"])},
+        {"word": "perro", "translation": json.dumps(["dog"])},
+    ]
+    for _ in range(10):
+        _, markup = common.format_train_step(word, "test", "from", candidates)
+        assert sorted(get_buttons(markup)) == ["bye", "cat", "dog", "hello"]
+
+
+def test_candidates_pool_is_capped(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "train.sqlite"))
+    try:
+        db_model.create_user(backend, CHAT_ID)
+        n_words = 3 * db_model.DISTRACTOR_CANDIDATES_NUMBER
+        db_model.update_vocab(
+            backend,
+            CHAT_ID,
+            LANGUAGE,
+            ["word{}".format(i) for i in range(n_words)],
+            [json.dumps(["translation{}".format(i)]) for i in range(n_words)],
+            bucket_size=n_words,
+        )
+        candidates = db_model.get_random_words(backend, CHAT_ID, LANGUAGE)
+        assert len(candidates) == db_model.DISTRACTOR_CANDIDATES_NUMBER
+        assert len(set(word["word"] for word in candidates)) == len(candidates)
+    finally:
+        backend.close()
@@ -0,0 +1,100 @@
+import sys
+import threading
+
+sys.path.append("../")
+from database.vocab_cache import VocabCache
+
+KEY = (1, "spanish")
+
+
+def test_snapshot_is_served_until_invalidated():
+    cache = VocabCache()
+    version = cache.get_version(KEY)
+    cache.put(KEY, version, ["word"])
+    assert cache.get(KEY) == ["word"]
+
+    cache.invalidate(*KEY)
+    assert cache.get(KEY) is None
+    assert cache.get_version(KEY) > version
+
+
+def test_invalidating_all_languages_of_a_user():
+    cache = VocabCache()
+    other_key = (1, "german")
+    for key in [KEY, other_key]:
+        cache.put(key, cache.get_version(key), [key])
+
+    cache.invalidate(1)
+    assert cache.get(KEY) is None
+    assert cache.get(other_key) is None
+
+
+def test_snapshot_read_before_a_write_is_not_stored():
+    cache = VocabCache()
+    version = cache.get_version(KEY)
+    with cache.invalidating(*KEY):
+        pass
+    cache.put(KEY, version, ["stale"])
+    assert cache.get(KEY) is None
+
+
+def test_write_in_another_thread_invalidates_a_read_in_progress():
+    cache = VocabCache()
+    version_read = threading.Event()
+    write_done = threading.Event()
+
+    def read():
+        version = cache.get_version(KEY)
+        version_read.set()
+        write_done.wait(5)
+        # the snapshot was read from the database before the write
+        cache.put(KEY, version, ["stale"])
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    version_read.wait(5)
+    with cache.invalidating(*KEY):
+        pass
+    write_done.set()
+    reader.join(5)
+
+    assert cache.get(KEY) is None
+
+
+def test_invalidating_even_if_the_write_fails():
+    cache = VocabCache()
+    cache.put(KEY, cache.get_version(KEY), ["word"])
+    try:
+        with cache.invalidating(*KEY):
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert cache.get(KEY) is None
+
+
+def test_snapshot_expires():
+    cache = VocabCache(ttl_s=0)
+    cache.put(KEY, cache.get_version(KEY), ["word"])
+    assert cache.get(KEY) is None
+
+
+def test_least_recently_used_version_is_evicted():
+    cache = VocabCache(max_size=2)
+    keys = [(1, "a"), (1, "b"), (1, "c")]
+    versions = {}
+    for key in keys[:2]:
+        versions[key] = cache.get_version(key)
+        cache.put(key, versions[key], [key])
+    cache.get(keys[0])  # keys[1] is now the least recently used
+
+    versions[keys[2]] = cache.get_version(keys[2])
+    cache.put(keys[2], versions[keys[2]], [keys[2]])
+    assert cache.get(keys[0]) == [keys[0]]
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) == [keys[2]]
+
+    # a read started before the eviction can't store its snapshot
+    cache.put(keys[1], versions[keys[1]], ["stale"])
+    assert cache.get(keys[1]) is None
+    # and the new version is not one of the evicted ones
+    assert cache.get_version(keys[1]) > max(versions.values())
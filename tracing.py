@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import re
+import string
+import threading
+import time
+
+from logs import logger
+from user_interaction import options
+
+# a JSON Lines file the incoming updates are appended to, the recording is off if unset
+TRACE_PATH = os.getenv("TRACE_PATH")
+# keeps the hashes stable between cold starts; a random one is used if unset
+TRACE_SALT = os.getenv("TRACE_SALT")
+CHAT_ID_HASH_BYTES = 6
+COMMAND_PATTERN = re.compile(r"/[a-z_]+")
+WORD_PATTERN = re.compile(r"\w+")
+# the texts of the bot's own buttons tell nothing about the user
+KEPT_TEXTS = frozenset(
+    options.train_strategy_options
+    + list(options.train_direction_options)
+    + options.train_duration_options
+    + options.train_hints_options
+    + list(options.show_words_sort_options)
+    + options.add_words_modes
+    + options.export_formats
+    + [options.export_all_words]
+    + list(options.group_add_words_sort_options)
+    + list(options.delete_are_you_sure)
+)
+
+
+class TraceRecorder:
+    """
+    Appends an anonymized event for every update to a trace file: the arrival
+    time, a hash of the chat id and the text with every word replaced by
+    a pseudo-word of the same length. A word is always replaced by the same
+    pseudo-word, so that a replayed trace finds the languages, groups and
+    words it has created; the commands and the bot's own buttons are kept.
+    """
+
+    def __init__(self, path, salt=None):
+        self.path = path
+        self.key = (salt.encode() if salt else os.urandom(16))[:64]
+        self.lock = threading.Lock()
+        self.file = None
+        self.n_recorded = 0
+        self.n_failed = 0
+
+    @property
+    def is_enabled(self):
+        return self.path is not None
+
+    def hash_chat_id(self, chat_id):
+        digest = hashlib.blake2b(
+            str(chat_id).encode(), key=self.key, digest_size=CHAT_ID_HASH_BYTES
+        ).digest()
+        return int.from_bytes(digest, "big")
+
+    def replace_word(self, match):
+        word = match.group(0)
+        digest = hashlib.shake_256(self.key + word.encode()).digest(len(word))
+        return "".join(string.ascii_lowercase[byte % 26] for byte in digest)
+
+    def redact(self, text):
+        if text in KEPT_TEXTS:
+            return text
+        command = COMMAND_PATTERN.match(text)
+        if command is not None:
+            return command.group(0) + WORD_PATTERN.sub(
+                self.replace_word, text[command.end() :]
+            )
+        return WORD_PATTERN.sub(self.replace_word, text)
+
+    def make_event(self, update):
+        message = update.message
+        if message is None:
+            return {"time": time.time(), "chat": None, "type": "other"}
+        event = {
+            "time": time.time(),
+            "chat": self.hash_chat_id(message.chat.id),
+            "type": message.content_type,
+        }
+        if message.content_type == "text":
+            event["text"] = self.redact(message.text)
+        return event
+
+    def record(self, update):
+        if not self.is_enabled:
+            return
+        try:
+            line = json.dumps(self.make_event(update), ensure_ascii=False) + "\n"
+            with self.lock:
+                if self.file is None:
+                    self.file = open(self.path, "a", encoding="utf-8")
+                self.file.write(line)
+                self.file.flush()
+                self.n_recorded += 1
+        except Exception as e:
+            # the trace is a by-product, the update is processed anyway
+            logger.error(f"Failed to record update {update.update_id}: {e}")
+            with self.lock:
+                self.n_failed += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {"recorded": self.n_recorded, "failed": self.n_failed}
+
+
+def read_trace(path):
+    with open(path, encoding="utf-8") as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip()]
+
+
+trace_recorder = TraceRecorder(TRACE_PATH, TRACE_SALT)
@@ -1,4 +1,4 @@
-train_strategy_options = ["random", "new", "bad", "group"]
+train_strategy_options = ["random", "new", "bad", "due", "group"]
 
 train_direction_options = {
     "➡️ㅤ": "to",
@@ -16,20 +16,27 @@ train_reactions = {
     0.0: "😡",
 }
 
-show_words_sort_options = [
-    "a-z",
-    "z-a",
-    "score ⬇️",
-    "score ⬆️",
-    "n trains ⬇️",
-    "n trains ⬆️",
-    "time added ⬇️",
-    "time added ⬆️",
-]
+show_words_sort_options = {
+    "a-z": "word_asc",
+    "z-a": "word_desc",
+    "score ⬇️": "score_desc",
+    "score ⬆️": "score_asc",
+    "n trains ⬇️": "n_trains_desc",
+    "n trains ⬆️": "n_trains_asc",
+    "time added ⬇️": "added_timestamp_desc",
+    "time added ⬆️": "added_timestamp_asc",
+}
 
 add_words_modes = ["one-by-one", "together"]
 
-group_add_words_sort_options = ["a-z", "time added ⬇️"]
+export_formats = ["csv", "jsonl"]
+
+export_all_words = "all words"
+
+group_add_words_sort_options = {
+    "a-z": "translation_asc",
+    "time added ⬇️": "added_timestamp_desc",
+}
 
 group_add_words_prefixes = {
     0: "🖤",
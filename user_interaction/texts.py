@@ -12,6 +12,8 @@ help_message = (
     "(you can add multiple and switch between them without erasing the progress).\n"
     "- /delete_language to delete current language with all data on words, groups, training sessions.\n"
     "- /add_words to add words to current vocabulary.\n"
+    "- /import to add words to current vocabulary from a CSV, TSV or Anki text file.\n"
+    "- /export to download words of current vocabulary as a CSV or JSON Lines file.\n"
     "- /show_words to print out all words you saved for current language.\n"
     "- /delete_words to delete some words from current vocabulary.\n"
     "- /create_group to create new group for words.\n"
@@ -45,6 +47,7 @@ howto_training_text = (
     "\- `random` \- memorise a random sample of all your words\.\n"
     "\- `new` \- random words that were memorised less than 3 times before\.\n"
     "\- `bad` \- random words that have low score \(< 0\.7\)\.\n"
+    "\- `due` \- words that are due for a review: the better you know a word, the less often it comes up\. Only trainings without hints count\.\n"
     "\- `group` \- words from a certain group\. Learn how to create groups: /howto\_groups\.\n\n"
     "Direction:\n"
     "Memorise how to translate words from the language you're studying or to it\.\n\n"
@@ -141,6 +144,7 @@ language_already_exists = "You already have language {}."
 show_languages_none = "You don't have any languages yet. Try /set_language to add one."
 
 available_languages = "You have {} language(s):\n{}"
+language_words_count = "{} - {} word(s)"
 
 # /add_words
 add_words_choose_mode = (
@@ -195,6 +199,55 @@ add_words_none_added = "You didn't add anything. Try again /add_words?"
 
 add_words_translate = "Translate {}"
 
+# /import
+import_instruction = (
+    "Send me a file with words for language '{}'. Every line should have "
+    "a word and its translations separated by a tab, a comma, a semicolon or '=':\n\n"
+    "hola,hello\n"
+    "adiós,farewell / goodbye\n\n"
+    "CSV, TSV and Anki 'Notes in Plain Text' exports are supported.\n"
+    "Type /cancel to exit the process."
+)
+
+import_not_a_file = "Please send a file or type /cancel."
+
+import_file_too_large = "The file is too large, the limit is {} MB."
+
+import_not_utf8 = (
+    "I can't read this file, it should be in UTF-8. "
+    "Save it in this encoding and try again /import?"
+)
+
+import_progress = "Saved {} words..."
+
+import_finished = "Finished! Saved {} words"
+
+import_errors = "Skipped {} line(s):\n{}"
+
+import_errors_more = "\n...and {} more"
+
+import_existing = (
+    "{} word(s) are already in the vocabulary, "
+    "I kept their translations and training progress:\n{}"
+)
+
+import_nothing = "I haven't found any words in this file. Try again /import?"
+
+# /export
+export_choose_format = (
+    "Choose file format:\n"
+    "- csv: word, translations, then scores, can be read back with /import\n"
+    "- jsonl: a JSON object per word"
+)
+
+export_format_unknown = "This format is not supported. Choose a valid format:"
+
+export_choose_group = "Export all words or words from a group?"
+
+export_finished = "Exported {} words"
+
+export_empty = "There are no words to export."
+
 # /create_group
 create_group_name = (
     "Write new group name. It should consist only of latin letters, digits and underscores.\n"
@@ -282,6 +335,7 @@ training_init = (
     "- random - simply random words\n"
     "- new - only words that you've seen not more than 2 times\n"
     "- bad - only words with weak score\n"
+    "- due - words that are due for a review (spaced repetition)\n"
     "- group - words from a particular group"
 )
 
@@ -71,10 +71,88 @@ def get_total_trains(db):
     return ifnull(db["n_trains_from"], 0) + ifnull(db["n_trains_to"], 0)
 
 
-def sample_hints(current_word, words, max_hints_number=3):
-    other_words = list(filter(lambda w: w["word"] != current_word["word"], words))
-    hints = random.sample(other_words, k=min(len(other_words), max_hints_number))
-    return hints
+def get_edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+def get_shared_prefix_length(a, b):
+    length = 0
+    for char_a, char_b in zip(a, b):
+        if char_a != char_b:
+            break
+        length += 1
+    return length
+
+
+def group_hints_by_length(vocabulary, order="from"):
+    # only the first translation is shown on a button
+    hints = set(get_translation(entry, order).split("/")[0] for entry in vocabulary)
+    hints_by_length = {}
+    for hint in hints:
+        hints_by_length.setdefault(len(hint), []).append(hint)
+    return hints_by_length
+
+
+def get_similar_hints(
+    answer, hints_by_length, max_hints_number=3, max_candidates_number=30
+):
+    """
+    The hints that look the most like the answer: at most max_candidates_number
+    candidates of the closest lengths, sampled from the last length bucket
+    needed, are ranked by the edit distance and the shared prefix.
+    """
+    # any translation of the answer would be a correct option as well
+    answers = set(answer.split("/"))
+    answer = answer.split("/")[0]
+    candidates = []
+    max_length = max(hints_by_length.keys(), default=0)
+    for delta in range(max(max_length, len(answer)) + 1):
+        for length in set([len(answer) - delta, len(answer) + delta]):
+            bucket = hints_by_length.get(length, [])
+            n_needed = max_candidates_number - len(candidates)
+            if len(bucket) > n_needed:
+                # more in case the answers are among them
+                bucket = random.sample(
+                    bucket, min(n_needed + len(answers), len(bucket))
+                )
+            candidates.extend(hint for hint in bucket if hint not in answers)
+        if len(candidates) >= max_candidates_number:
+            break
+    del candidates[max_candidates_number:]
+
+    random.shuffle(candidates)  # random among equally similar ones
+    candidates.sort(
+        key=lambda hint: (
+            get_edit_distance(hint, answer),
+            -get_shared_prefix_length(hint, answer),
+            abs(len(hint) - len(answer)),
+        )
+    )
+    return candidates[:max_hints_number]
+
+
+def get_scores_from_bitmap(scores, n_words):
+    return [(scores >> i) & 1 for i in range(n_words)]
+
+
+def upgrade_train_state(data):
+    # a training started before the words were moved out of the state keeps them
+    # there and its scores as a list; the words are in training_sessions as well
+    if "words" in data:
+        data["n_words"] = len(data.pop("words"))
+        data["scores"] = sum(score << i for i, score in enumerate(data["scores"]))
 
 
 def get_az_hint(word):